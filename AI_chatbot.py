@@ -2,6 +2,7 @@ import clickhouse_connect
 import os
 from dotenv import load_dotenv
 from datetime import datetime
+from Profiling import query_settings
 
 # Load credentials from .env
 load_dotenv()
@@ -17,6 +18,25 @@ def get_clickhouse_client():
         password=os.getenv("CLICKHOUSE_PASSWORD", "")
     )
 
+async def get_async_clickhouse_client():
+    """
+    Async client for the web app. One instance is shared by every chat.
+    The pinned clickhouse-connect (0.7.19) has no executor_threads option:
+    queries run on the loop's default executor, which Main_app sizes at
+    startup (DEFAULT_EXECUTOR_THREADS).
+    No server session: queries sharing one session are serialised (or
+    rejected as "session is locked") by ClickHouse.
+    """
+    return await clickhouse_connect.get_async_client(
+        host=os.getenv("CLICKHOUSE_HOST", "localhost"),
+        port=int(os.getenv("CLICKHOUSE_PORT", "8123")),
+        username=os.getenv("CLICKHOUSE_USER", "default"),
+        password=os.getenv("CLICKHOUSE_PASSWORD", ""),
+        autogenerate_session_id=False,
+        send_receive_timeout=int(os.getenv("CLICKHOUSE_SEND_RECEIVE_TIMEOUT", "30")),
+        connect_timeout=int(os.getenv("CLICKHOUSE_CONNECT_TIMEOUT", "5"))
+    )
+
 def get_latest_crypto(client, coin_symbol):
     """
     Fetches latest data using SECURE parameterized queries.
@@ -31,7 +51,7 @@ def get_latest_crypto(client, coin_symbol):
     """
     
     # Pass parameters as a list/tuple
-    result = client.query(query, parameters=[coin_symbol.upper()])
+    result = client.query(query, parameters=[coin_symbol.upper()], settings=query_settings())
     
     if result.result_rows:
         # Zip column names with values to create a safe dictionary
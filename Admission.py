@@ -0,0 +1,185 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from Telemetry import record, register_stats
+
+logger = logging.getLogger(__name__)
+
+# ═══════════════════════════════════════════════════════════════
+# CONFIGURATION
+# ═══════════════════════════════════════════════════════════════
+# Chats answered at the same time (LLM calls + analyses); keep below the Groq rate limit
+CHAT_MAX_ACTIVE = int(os.getenv("CHAT_MAX_ACTIVE", "32"))
+# Chats allowed to wait for a slot; beyond this new chats are shed at once
+CHAT_MAX_QUEUE = int(os.getenv("CHAT_MAX_QUEUE", "100"))
+# Longest a queued chat waits before it is shed
+CHAT_QUEUE_TIMEOUT = float(os.getenv("CHAT_QUEUE_TIMEOUT", "20"))
+# Per-session token bucket: sustained messages per minute and burst size
+CHAT_RATE_PER_MINUTE = float(os.getenv("CHAT_RATE_PER_MINUTE", "10"))
+CHAT_RATE_BURST = int(os.getenv("CHAT_RATE_BURST", "3"))
+# Idle buckets are dropped once this many sessions are tracked
+MAX_TRACKED_SESSIONS = 10000
+
+# ═══════════════════════════════════════════════════════════════
+# ERRORS
+# ═══════════════════════════════════════════════════════════════
+class AdmissionRejected(Exception):
+    """Chat not admitted; the caller answers with a fallback instead"""
+
+class RateLimited(AdmissionRejected):
+    def __init__(self, retry_after):
+        super().__init__(f"Too many messages, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+class Overloaded(AdmissionRejected):
+    pass
+
+# ═══════════════════════════════════════════════════════════════
+# ADMISSION CONTROLLER
+# ═══════════════════════════════════════════════════════════════
+class TokenBucket:
+    def __init__(self, rate_per_second, burst):
+        self.rate = rate_per_second
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self):
+        """0 when a token was taken, else seconds until one is available"""
+        self.refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+class ChatAdmission:
+    """
+    Gate in front of every chat answer.
+
+    - At most `max_active` chats run at once.
+    - Further chats wait in a FIFO queue of at most `max_queue` entries.
+      Each waiter's `on_position(n)` callback fires whenever its place in
+      line changes, so the UI can show it.
+    - Chats that find the queue full, or wait longer than `queue_timeout`,
+      raise Overloaded. The caller then sheds them with a cheap fallback
+      answer instead of letting every request slow down.
+    - A token bucket per session raises RateLimited before any queueing.
+
+    All state lives on the event loop; no locks needed.
+    """
+
+    def __init__(self, max_active=CHAT_MAX_ACTIVE, max_queue=CHAT_MAX_QUEUE, queue_timeout=CHAT_QUEUE_TIMEOUT,
+                 rate_per_minute=CHAT_RATE_PER_MINUTE, burst=CHAT_RATE_BURST):
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.rate_per_second = rate_per_minute / 60
+        self.burst = burst
+        self.active = 0
+        self.waiters = deque()
+        self.buckets = {}
+        self.admitted = 0
+        self.shed = 0
+        self.rate_limited = 0
+
+    def _bucket(self, session_id):
+        bucket = self.buckets.get(session_id)
+        if bucket is None:
+            if len(self.buckets) >= MAX_TRACKED_SESSIONS:
+                self._prune_buckets()
+            bucket = self.buckets[session_id] = TokenBucket(self.rate_per_second, self.burst)
+        return bucket
+
+    def _prune_buckets(self):
+        for session_id, bucket in list(self.buckets.items()):
+            bucket.refill()
+            if bucket.tokens >= bucket.burst:
+                del self.buckets[session_id]
+
+    def _announce_positions(self):
+        for position, (_, on_position) in enumerate(self.waiters, start=1):
+            if on_position is not None:
+                try:
+                    on_position(position)
+                except Exception as e:
+                    logger.debug(f"Queue position callback failed: {e}")
+
+    def _release(self):
+        # Hand the slot straight to the next live waiter, so the FIFO order holds
+        while self.waiters:
+            future, _ = self.waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                self._announce_positions()
+                return
+        self.active -= 1
+
+    async def _acquire(self, on_position):
+        if self.active < self.max_active and not self.waiters:
+            self.active += 1
+            return 0.0
+        if len(self.waiters) >= self.max_queue:
+            raise Overloaded("Chat queue is full")
+
+        queued_at = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        entry = (future, on_position)
+        self.waiters.append(entry)
+        if on_position is not None:
+            on_position(len(self.waiters))
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                self._release()  # the slot was handed over just as we gave up
+            else:
+                future.cancel()
+                self.waiters.remove(entry)
+                self._announce_positions()
+            if isinstance(e, asyncio.TimeoutError):
+                raise Overloaded("Timed out waiting for a chat slot") from None
+            raise
+        return (time.perf_counter() - queued_at) * 1000
+
+    @asynccontextmanager
+    async def slot(self, session_id, on_position=None):
+        """Holds one chat slot for the body of the `async with`"""
+        retry_after = self._bucket(session_id).take()
+        if retry_after:
+            self.rate_limited += 1
+            raise RateLimited(retry_after)
+
+        try:
+            wait_ms = await self._acquire(on_position)
+        except Overloaded:
+            self.shed += 1
+            raise
+        self.admitted += 1
+        record("chat.queue_wait", wait_ms)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def stats(self):
+        return {
+            "active": self.active,
+            "queued": len(self.waiters),
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "rate_limited": self.rate_limited,
+        }
+
+chat_admission = ChatAdmission()
+register_stats("chat_admission", chat_admission.stats)
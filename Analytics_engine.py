@@ -1,37 +1,72 @@
+import asyncio
+import contextvars
+import os
 import pandas as pd
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from AI_chatbot import get_clickhouse_client
+from Telemetry import span, span_context, traced
+from Profiling import query_settings
+from Queries import HISTORY_QUERY
+
+# pandas work is CPU-bound; the async path runs it on its own small pool
+# so chat requests never compete with the event loop's default executor.
+ANALYTICS_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.getenv("ANALYTICS_WORKERS", "4")),
+    thread_name_prefix="analytics"
+)
 
 # ============================================================================
 # DATA FETCHING
 # ============================================================================
 
-def fetch_historical_data(client, coin_symbol, days=30):
-    """Get historical price/volume data"""
-    query = """
-        SELECT timestamp, price, volume_24h, market_cap, change_24h
-        FROM crypto_prices
-        WHERE coin = %s
-        AND timestamp >= now() - INTERVAL %s DAY
-        ORDER BY timestamp ASC
+def history_to_dataframe(df):
     """
-    
-    result = client.query(query, parameters=[coin_symbol.upper(), days])
-    
-    if not result.result_rows:
+    Validate a columnar history result (client.query_df). Columns arrive
+    as numpy arrays with timestamps already datetime64, so there is no
+    per-row conversion; None when the coin has no history.
+    """
+    if df is None or df.empty:
         return None
     
-    df = pd.DataFrame(result.result_rows, columns=result.column_names)
-    df['timestamp'] = pd.to_datetime(df['timestamp'])
-    df = df.sort_values('timestamp')
+    if not pd.api.types.is_datetime64_any_dtype(df['timestamp']):
+        df['timestamp'] = pd.to_datetime(df['timestamp'])
+    if not df['timestamp'].is_monotonic_increasing:
+        df = df.sort_values('timestamp', ignore_index=True)
     
     return df
 
+def is_storage_backend(client):
+    """Storage.StorageBackend instances answer history() themselves (no SQL)"""
+    return hasattr(client, "history")
+
+def fetch_historical_data(client, coin_symbol, days=30):
+    """Get historical price/volume data from a ClickHouse client or a Storage backend"""
+    if is_storage_backend(client):
+        return history_to_dataframe(client.history(coin_symbol, days))
+    df = client.query_df(HISTORY_QUERY, parameters=[coin_symbol.upper(), days], settings=query_settings())
+    return history_to_dataframe(df)
+
+async def fetch_historical_data_async(client, coin_symbol, days=30):
+    """Same as fetch_historical_data, for an AsyncClient, Query_layer.QueryLayer or a Storage backend"""
+    with span("db.history", symbol=coin_symbol.upper()) as s:
+        if is_storage_backend(client):
+            loop = asyncio.get_running_loop()
+            df = await loop.run_in_executor(ANALYTICS_EXECUTOR, client.history, coin_symbol, days)
+        else:
+            df = await client.query_df(
+                HISTORY_QUERY, parameters=[coin_symbol.upper(), days], settings=query_settings()
+            )
+        s.tag(rows=len(df))
+    with span("analytics.to_dataframe", symbol=coin_symbol.upper()):
+        return history_to_dataframe(df)
+
 # ============================================================================
 # PRICE ANALYSIS
 # ============================================================================
 
+@traced("analytics.moving_averages")
 def calculate_moving_averages(df):
     """7-day and 30-day moving averages"""
     current_price = df['price'].iloc[-1]
@@ -46,6 +81,7 @@ def calculate_moving_averages(df):
         'price_vs_ma30_pct': round(((current_price / ma_30) - 1) * 100, 2)
     }
 
+@traced("analytics.volatility")
 def calculate_volatility(df):
     """Standard deviation of returns"""
     if len(df) < 2:
@@ -79,6 +115,7 @@ def detect_trend(current_price, ma_7, ma_30):
 # VOLUME ANALYSIS  
 # ============================================================================
 
+@traced("analytics.volume")
 def analyze_volume(df):
     """Volume spikes and patterns"""
     if len(df) < 2:
@@ -122,6 +159,7 @@ def get_volume_interpretation(status, ratio):
 # SUPPORT/RESISTANCE
 # ============================================================================
 
+@traced("analytics.support_resistance")
 def find_support_resistance(df, window=7):
     """Key price levels based on recent highs/lows"""
     if len(df) < window:
@@ -158,6 +196,7 @@ def find_support_resistance(df, window=7):
 # PATTERN RECOGNITION (BONUS)
 # ============================================================================
 
+@traced("analytics.similar_patterns")
 def find_similar_patterns(df):
     """Find historical patterns similar to current situation"""
     if len(df) < 14:
@@ -196,7 +235,25 @@ def get_crypto_analysis(client, coin_symbol):
     This is what GenAi.py will use
     """
     df = fetch_historical_data(client, coin_symbol, days=30)
-    
+    return build_analysis(df, coin_symbol)
+
+async def get_crypto_analysis_async(client, coin_symbol):
+    """
+    Async variant of get_crypto_analysis: awaits the query on an AsyncClient,
+    then runs the pandas analytics on ANALYTICS_EXECUTOR.
+    """
+    df = await fetch_historical_data_async(client, coin_symbol, days=30)
+    loop = asyncio.get_running_loop()
+    # copy_context keeps the request id visible to spans inside the worker thread
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(ANALYTICS_EXECUTOR, ctx.run, build_analysis, df, coin_symbol)
+
+def build_analysis(df, coin_symbol):
+    """Run every analytic over a history DataFrame"""
+    with span_context(symbol=coin_symbol.upper()), span("analytics.build"):
+        return _build_analysis(df, coin_symbol)
+
+def _build_analysis(df, coin_symbol):
     if df is None or len(df) == 0:
         return {
             'error': f'No historical data found for {coin_symbol}',
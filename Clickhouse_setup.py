@@ -30,6 +30,12 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from API.fetch_api import fetch_crypto_data
 
+from Telemetry import span, count, set_gauge
+
+from Profiling import query_settings
+
+from Storage import get_storage, ClickHouseStorage
+
 
 
 load_dotenv()
@@ -78,7 +84,7 @@ def get_clickhouse_client():
 
         # Test connection
 
-        client.command("SELECT 1")
+        client.command("SELECT 1", settings=query_settings("setup.ping"))
 
         logger.info(f"✅ Connected to ClickHouse at {host}:{port}")
 
@@ -138,7 +144,7 @@ def setup_table(client):
 
         """
 
-        client.command(query)
+        client.command(query, settings=query_settings("setup.create_table"))
 
         logger.info("Table 'crypto_prices' verified/created")
 
@@ -146,7 +152,13 @@ def setup_table(client):
 
         # 2. Schema Evolution: If 'name' column doesn't exist, add it
 
-        client.command("ALTER TABLE crypto_prices ADD COLUMN IF NOT EXISTS name String AFTER coin")
+        client.command(
+
+            "ALTER TABLE crypto_prices ADD COLUMN IF NOT EXISTS name String AFTER coin",
+
+            settings=query_settings("setup.migrate")
+
+        )
 
         logger.info("Table schema is up to date")
 
@@ -198,11 +210,11 @@ def validate_dataframe(df):
 
 
 
-def insert_data(client, df):
+def insert_data(storage, df):
 
     """
 
-    Inserts validated data into ClickHouse.
+    Inserts validated data through a Storage backend (see Storage.get_storage).
 
     """
 
@@ -222,31 +234,21 @@ def insert_data(client, df):
 
         
 
-        columns = ["timestamp", "coin", "name", "price", "volume_24h", "market_cap", "change_24h"]
-
-        
-
-        # Convert to list for ClickHouse insert
+        with span("pipeline.insert", rows=len(df)) as s:
 
-        data_to_insert = df[columns].values.tolist()
+            rows_inserted = storage.insert(df, site="pipeline.insert")
 
         
 
-        client.insert(
+        count("pipeline_rows_inserted", rows_inserted)
 
-            "crypto_prices",
-
-            data_to_insert,
-
-            column_names=columns
-
-        )
+        set_gauge("pipeline_insert_rows_per_second", rows_inserted / max(s.duration_ms / 1000, 1e-6))
 
         
 
-        logger.info(f"✅ Successfully inserted {len(df)} rows into ClickHouse")
+        logger.info(f"✅ Successfully inserted {rows_inserted} rows into {type(storage).__name__}")
 
-        return len(df)
+        return rows_inserted
 
         
 
@@ -270,23 +272,29 @@ def main():
 
     Main ETL pipeline: Fetch -> Validate -> Insert
 
+    Writes through the STORAGE_BACKEND storage (ClickHouse by default).
+
+    Returns the number of rows inserted (0 when the fetch came back empty).
+
     """
 
-    client = None
+    storage = None
 
     
 
     try:
 
-        # 1. Connect to ClickHouse
+        # 1. Open storage (connects to ClickHouse for that backend)
 
-        client = get_clickhouse_client()
+        storage = get_storage(client_factory=get_clickhouse_client)
 
         
 
         # 2. Ensure table exists
 
-        setup_table(client)
+        if isinstance(storage, ClickHouseStorage):
+
+            setup_table(storage.client)
 
         
 
@@ -300,18 +308,22 @@ def main():
 
         if df.empty:
 
+            count("pipeline_empty_fetches")
+
             logger.warning("No data fetched from API - skipping insert")
 
-            return
+            return 0
 
         
 
-        # 4. Insert into database
+        # 4. Insert into storage
 
-        rows_inserted = insert_data(client, df)
+        rows_inserted = insert_data(storage, df)
 
         logger.info(f"Pipeline completed successfully: {rows_inserted} rows processed")
 
+        return rows_inserted
+
         
 
     except Exception as e:
@@ -324,19 +336,19 @@ def main():
 
     finally:
 
-        # Always close the connection
+        # Always close the connection (an embedded store saves its file here)
 
-        if client:
+        if storage:
 
             try:
 
-                client.close()
+                storage.close()
 
-                logger.info("ClickHouse connection closed")
+                logger.info("Storage closed")
 
-            except:
+            except Exception as e:
 
-                pass
+                logger.warning(f"Error closing storage: {e}")
 
 
 
@@ -0,0 +1,323 @@
+"""
+HTTP/JSON and WebSocket data API served by the web app.
+
+Every response comes from the in-process caches (market snapshot, chart
+cache, analysis cache), never from a per-request ClickHouse query on the
+hot path. Encoded bodies are memoised per data version and carry an ETag,
+so a bot polling with If-None-Match gets a 304 without any serialisation.
+
+    GET /api/prices?coins=BTC,ETH            latest row per coin
+    GET /api/screener?q=sol&sort=change_24h&limit=50
+    GET /api/history/{coin}?range=7D&mode=candles
+    GET /api/analysis/{coin}
+    WS  /api/stream?coins=BTC,ETH            price deltas after every ingest
+    GET /metrics                             Prometheus metrics for this worker
+
+Tabular endpoints also speak Arrow IPC (`?format=arrow` or
+`Accept: application/vnd.apache.arrow.stream`).
+With PROFILE_ALLOW_REQUESTS set, `X-Profile: 1` or `?profile=1` profiles
+one request (see Profiling); the response names it in X-Request-Id.
+"""
+import os
+import sys
+import json
+import math
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from datetime import datetime
+
+from fastapi import Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.middleware.gzip import GZipMiddleware
+from nicegui import app
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from Market_data import market_snapshot, chart_cache, CHART_RANGES, CHART_MODES, SORT_KEYS
+from Query_layer import query_layer
+from Telemetry import prometheus_text, register_stats, request_scope
+from Profiling import profiled, PROFILE_ALLOW_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+# ═══════════════════════════════════════════════════════════════
+# CONFIGURATION
+# ═══════════════════════════════════════════════════════════════
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+# Encoded bodies kept per (endpoint, params, format, data version)
+API_BODY_CACHE_SIZE = int(os.getenv("API_BODY_CACHE_SIZE", "1024"))
+# Analyses kept per (coin, data version)
+API_ANALYSIS_CACHE_SIZE = int(os.getenv("API_ANALYSIS_CACHE_SIZE", "256"))
+SCREENER_MAX_LIMIT = 500
+# Bodies below this size aren't worth gzipping
+GZIP_MIN_BYTES = 1024
+
+# ═══════════════════════════════════════════════════════════════
+# ENCODING
+# ═══════════════════════════════════════════════════════════════
+def json_default(obj):
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    return str(obj)
+
+def finite(value):
+    """Payload with NaN/Infinity floats (e.g. indicators over short histories) as None"""
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {key: finite(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [finite(item) for item in value]
+    return value
+
+def encode_json(payload):
+    """Strict JSON: NaN and Infinity aren't valid JSON, so they become null"""
+    return json.dumps(finite(payload), separators=(",", ":"), default=json_default, allow_nan=False).encode()
+
+def encode_arrow(columns):
+    """{name: [values]} -> Arrow IPC stream bytes"""
+    import pyarrow as pa
+
+    table = pa.table(columns)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def arrow_available():
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def wants_arrow(request):
+    return (
+        request.query_params.get("format") == "arrow"
+        or ARROW_MEDIA_TYPE in request.headers.get("accept", "")
+    )
+
+def rows_to_columns(rows, fields):
+    return {field: [row.get(field) for row in rows] for field in fields}
+
+class BodyCache:
+    """LRU of (body, etag) per request key; the key includes the data version"""
+
+    def __init__(self, max_entries=API_BODY_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    def get_or_build(self, key, build):
+        entry = self.entries.get(key)
+        if entry is None:
+            body = build()
+            entry = (body, f'"{hashlib.blake2b(body, digest_size=12).hexdigest()}"')
+            self.entries[key] = entry
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        else:
+            self.entries.move_to_end(key)
+        return entry
+
+body_cache = BodyCache()
+register_stats("api_body_cache", lambda: {"entries": len(body_cache.entries)})
+
+def etag_matches(if_none_match, etag):
+    """If-None-Match check (weak comparison, as RFC 9110 asks for GET)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = (tag.strip() for tag in if_none_match.split(","))
+    return any((tag[2:] if tag.startswith("W/") else tag) == etag for tag in candidates)
+
+def cached_response(request, key, payload_fn, columns_fn=None):
+    """
+    Serves payload_fn() as JSON, or columns_fn() as Arrow when asked for.
+    `key` must change whenever the data does (it includes a version).
+    """
+    if wants_arrow(request):
+        if columns_fn is None or not arrow_available():
+            return Response(status_code=406, content=b'{"error":"arrow format not available here"}',
+                            media_type="application/json")
+        media_type = ARROW_MEDIA_TYPE
+        body, etag = body_cache.get_or_build(key + ("arrow",), lambda: encode_arrow(columns_fn()))
+    else:
+        media_type = "application/json"
+        body, etag = body_cache.get_or_build(key + ("json",), lambda: encode_json(payload_fn()))
+
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept, Accept-Encoding"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type=media_type, headers=headers)
+
+def error_response(status_code, message):
+    return Response(status_code=status_code, content=encode_json({"error": message}), media_type="application/json")
+
+def parse_coins(value):
+    return sorted({coin.strip().upper() for coin in value.split(",") if coin.strip()}) if value else None
+
+# ═══════════════════════════════════════════════════════════════
+# ANALYSIS CACHE
+# ═══════════════════════════════════════════════════════════════
+class AnalysisCache:
+    """get_crypto_analysis per (coin, data version), loads coalesced like ChartCache"""
+
+    def __init__(self, max_entries=API_ANALYSIS_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.inflight = {}
+
+    async def get(self, coin):
+        row = market_snapshot.get(coin)
+        key = (coin, row["timestamp"] if row else None)
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return key, self.entries[key]
+
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(self._load(key))
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self.inflight[key] = task
+        return key, await asyncio.shield(task)
+
+    async def _load(self, key):
+        from Analytics_engine import get_crypto_analysis_async
+
+        try:
+            analysis = await get_crypto_analysis_async(query_layer, key[0])
+            self.entries[key] = analysis
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            return analysis
+        finally:
+            self.inflight.pop(key, None)
+
+analysis_cache = AnalysisCache()
+
+# ═══════════════════════════════════════════════════════════════
+# ROUTES
+# ═══════════════════════════════════════════════════════════════
+ROW_FIELDS = ("coin", "name", "timestamp", "price", "volume_24h", "market_cap", "change_24h")
+
+@app.get("/api/prices")
+async def api_prices(request: Request, coins: str = None):
+    wanted = parse_coins(coins)
+    rows = market_snapshot.all()
+
+    def selected():
+        return [rows[c] for c in (wanted or sorted(rows)) if c in rows]
+
+    key = ("prices", tuple(wanted or ()), market_snapshot.version)
+    return cached_response(
+        request, key,
+        lambda: {"version": market_snapshot.version, "data": selected()},
+        lambda: rows_to_columns(selected(), ROW_FIELDS)
+    )
+
+@app.get("/api/screener")
+async def api_screener(request: Request, q: str = "", sort: str = "market_cap", limit: int = 50):
+    if sort not in SORT_KEYS:
+        return error_response(400, f"sort must be one of {', '.join(SORT_KEYS)}")
+    limit = max(1, min(limit, SCREENER_MAX_LIMIT))
+    index = market_snapshot.index
+
+    def selected():
+        return [market_snapshot.get(coin) for coin in index.listing(q, sort)[:limit]]
+
+    key = ("screener", q.strip().lower(), sort, limit, market_snapshot.version)
+    return cached_response(
+        request, key,
+        lambda: {"version": market_snapshot.version, "sort": sort, "data": selected()},
+        lambda: rows_to_columns(selected(), ROW_FIELDS)
+    )
+
+@app.get("/api/history/{coin}")
+async def api_history(request: Request, coin: str, range_key: str = Query("1D", alias="range"), mode: str = "line"):
+    coin = coin.upper()
+    if range_key not in CHART_RANGES or mode not in CHART_MODES:
+        return error_response(400, f"range must be one of {list(CHART_RANGES)}, mode one of {list(CHART_MODES)}")
+    if market_snapshot.ready and market_snapshot.get(coin) is None:
+        return error_response(404, f"Unknown coin {coin}")
+    try:
+        # The key the series was loaded under: an ingest during the await
+        # must not label the old body with the new version's ETag
+        key, series = await chart_cache.get_keyed_series(coin, range_key, mode)
+    except Exception as e:
+        logger.warning(f"History API failed for {coin} ({range_key}, {mode}): {e}")
+        return error_response(503, "History temporarily unavailable")
+    return cached_response(
+        request, ("history",) + key,
+        lambda: {"coin": coin, "range": range_key, "mode": mode, **series},
+        lambda: series
+    )
+
+@app.get("/api/analysis/{coin}")
+async def api_analysis(request: Request, coin: str):
+    coin = coin.upper()
+    if market_snapshot.ready and market_snapshot.get(coin) is None:
+        return error_response(404, f"Unknown coin {coin}")
+    try:
+        key, analysis = await analysis_cache.get(coin)
+    except Exception as e:
+        logger.warning(f"Analysis API failed for {coin}: {e}")
+        return error_response(503, "Analysis temporarily unavailable")
+    return cached_response(request, ("analysis",) + key, lambda: analysis)
+
+@app.get("/metrics")
+async def metrics():
+    return Response(content=prometheus_text(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.websocket("/api/stream")
+async def api_stream(websocket: WebSocket, coins: str = None):
+    """
+    Sends the current prices once, then one message per ingest with the
+    coins that changed: {"version": ..., "data": {coin: {price, change_24h, timestamp}}}.
+    A slow consumer only ever holds the newest pending message.
+    """
+    await websocket.accept()
+    wanted = set(parse_coins(coins) or ())
+    pending = asyncio.Queue(maxsize=1)
+
+    def on_update(delta):
+        if wanted:
+            delta = {coin: change for coin, change in delta.items() if coin in wanted}
+        if not delta:
+            return
+        if pending.full():
+            # Merge into the unsent message instead of queueing a backlog
+            delta = {**pending.get_nowait(), **delta}
+        pending.put_nowait(delta)
+
+    initial = {
+        coin: {"price": row["price"], "change_24h": row["change_24h"], "timestamp": row["timestamp"]}
+        for coin, row in market_snapshot.all().items() if not wanted or coin in wanted
+    }
+    market_snapshot.subscribe(on_update)
+    try:
+        await websocket.send_text(encode_json({"version": market_snapshot.version, "data": initial}).decode())
+        while True:
+            delta = await pending.get()
+            await websocket.send_text(encode_json({"version": market_snapshot.version, "data": delta}).decode())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        market_snapshot.unsubscribe(on_update)
+
+@app.middleware("http")
+async def profile_api_requests(request: Request, call_next):
+    """Tags /api requests with a request id (carried into query log_comments) and profiles sampled ones"""
+    if not request.url.path.startswith("/api/"):
+        return await call_next(request)
+    force = PROFILE_ALLOW_REQUESTS and (
+        request.headers.get("x-profile") == "1" or request.query_params.get("profile") == "1"
+    )
+    with request_scope() as request_id, profiled(f"api{request.url.path.replace('/', '.')}", force=force):
+        response = await call_next(request)
+    response.headers["X-Request-Id"] = request_id
+    return response
+
+# NiceGUI may already compress its own responses; never stack two gzip layers
+if not any(middleware.cls is GZipMiddleware for middleware in app.user_middleware):
+    app.add_middleware(GZipMiddleware, minimum_size=GZIP_MIN_BYTES)
@@ -1,26 +1,43 @@
 import os
 import sys
+import re
 import json
+import time
+import asyncio
+import logging
+from collections import OrderedDict
 from datetime import datetime
-from groq import Groq
 from dotenv import load_dotenv
 from pathlib import Path
 
 # Fix import path - add current directory to Python path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from AI_chatbot import get_latest_crypto, get_clickhouse_client
-from Analytics_engine import get_crypto_analysis  
+from AI_chatbot import get_latest_crypto
+from Analytics_engine import get_crypto_analysis_async
+from Telemetry import span, record, request_scope, register_stats
+from Market_data import market_snapshot, VERSION_QUERY
+from Query_layer import query_layer
+from Profiling import query_settings
 
 # 1. SETUP & CONFIG
 env_path = Path(__file__).resolve().parent.parent / '.env'
 load_dotenv(dotenv_path=env_path)
 
-GROQ_KEY = os.getenv("GROQ_API_KEY")
-if not GROQ_KEY:
-    raise ValueError("❌ Error: GROQ_API_KEY not found in .env file.")
+# The Groq client is built on first use (see get_llm_client) so importing
+# this module stays cheap and never fails on a missing key.
+_llm_client = None
 
-client = Groq(api_key=GROQ_KEY)
+logger = logging.getLogger(__name__)
+
+TOOL_MODEL = "llama-3.3-70b-versatile"
+SYNTHESIS_MODEL = "llama-3.1-8b-instant"
+
+# Compact tool payloads cut phase-3 input tokens (latency + cost). Set to 0 to
+# send the full get_crypto_analysis dict instead.
+COMPACT_TOOL_PAYLOADS = os.getenv("COMPACT_TOOL_PAYLOADS", "1") == "1"
+# Approximate token budget shared by all tool results of one request
+TOOL_PAYLOAD_TOKEN_BUDGET = int(os.getenv("TOOL_PAYLOAD_TOKEN_BUDGET", "600"))
 
 # 2. HELPER: HANDLE DATETIMES IN JSON
 def datetime_handler(obj):
@@ -50,10 +67,262 @@ def get_crypto_tools():
         }
     ]
 
-# 4. CORE LOGIC
-def get_mrcrypto_response(user_input):
-    ch_client = get_clickhouse_client()
-    
+# 4. TOOL PAYLOADS
+COMPACT_KEYS_LEGEND = (
+    "### TOOL DATA KEYS:\n"
+    "s=symbol, p=price, c24=24h change %, mcap=market cap, "
+    "ma7/ma30=moving averages, d7/d30=price vs MA7/MA30 %, tr=trend, "
+    "v7/v30=volatility % (7d/30d), risk=risk level, vr=volume ratio vs normal, vs=volume status, "
+    "sup/res=nearest support/resistance, sd/rd=distance to support/resistance %, "
+    "hi/lo=30d range, pat=similar patterns [date, correlation, 3d outcome %], ts=last update (UTC), "
+    "err=data error\n\n"
+)
+
+# Dropped first when a payload exceeds its share of the token budget
+TRIM_ORDER = ["pat", "mcap", "v7", "hi", "lo", "ts", "vs", "c24"]
+
+def _px(value):
+    """Prices keep 6 significant digits so BTC and DOGE both stay readable"""
+    return float(f"{value:.6g}")
+
+def _pct(value):
+    return round(float(value), 2)
+
+def estimate_tokens(text):
+    """Cheap ~4 chars/token estimate; good enough for budgeting"""
+    return len(text) // 4 + 1
+
+def compact_analysis(data):
+    """Short-key, fixed-precision view of a get_crypto_analysis result"""
+    if not data or 'error' in data:
+        return {"s": (data or {}).get('symbol'), "err": "no data"}
+
+    ma = data['moving_averages']
+    vol = data['volatility']
+    volume = data['volume_analysis']
+    levels = data['support_resistance']
+
+    compact = {
+        "s": data['symbol'],
+        "p": _px(data['current_price']),
+        "c24": _pct(data['change_24h']),
+        "mcap": int(float(f"{data['market_cap']:.3g}")),
+        "ma7": _px(ma['ma_7']),
+        "ma30": _px(ma['ma_30']),
+        "d7": _pct(ma['price_vs_ma7_pct']),
+        "d30": _pct(ma['price_vs_ma30_pct']),
+        "tr": data['trend'],
+        "v7": _pct(vol.get('volatility_7d_pct', 0)),
+        "v30": _pct(vol.get('volatility_30d_pct', 0)),
+        "risk": vol.get('risk_level'),
+        "vr": _pct(volume.get('volume_ratio', 1)),
+        "vs": volume.get('volume_status'),
+        "ts": data['timestamp'].strftime("%Y-%m-%d %H:%M") if isinstance(data['timestamp'], datetime) else str(data['timestamp']),
+    }
+    if levels.get('nearest_support') is not None:
+        compact.update({
+            "sup": _px(levels['nearest_support']),
+            "res": _px(levels['nearest_resistance']),
+            "sd": _pct(levels['support_distance_pct']),
+            "rd": _pct(levels['resistance_distance_pct']),
+            "hi": _px(levels['range_30d']['high']),
+            "lo": _px(levels['range_30d']['low']),
+        })
+    if data.get('similar_patterns'):
+        compact["pat"] = [
+            [p['date'], p['correlation'], p['outcome_3d']] for p in data['similar_patterns']
+        ]
+    return compact
+
+def serialize_tool_payload(data, token_budget):
+    """
+    Renders one tool result for the LLM. In compact mode, low-value fields are
+    trimmed (TRIM_ORDER) until the payload fits its token budget.
+    """
+    if not COMPACT_TOOL_PAYLOADS:
+        return json.dumps(data, default=datetime_handler)
+
+    compact = compact_analysis(data)
+    content = json.dumps(compact, separators=(",", ":"), default=datetime_handler)
+
+    for key in TRIM_ORDER:
+        if estimate_tokens(content) <= token_budget:
+            break
+        if compact.pop(key, None) is not None:
+            content = json.dumps(compact, separators=(",", ":"), default=datetime_handler)
+
+    return content
+
+# 5. DATA ACCESS & RESPONSE CACHE
+# None = the shared Query_layer (pooled, bounded, with timeouts and reconnect)
+_ch_client = None
+
+async def get_shared_clickhouse_client():
+    """Async ClickHouse access for chats: the injected client or the shared query layer"""
+    return _ch_client or query_layer
+
+def set_clickhouse_client(ch_client):
+    """Injects the async ClickHouse client (load tests, offline runs)"""
+    global _ch_client
+    _ch_client = ch_client
+
+def get_llm_client():
+    """
+    Lazily builds the process-wide AsyncGroq client. One pooled async HTTP
+    client serves every chat; the connection limit (not a thread pool) is
+    what bounds concurrent Groq requests.
+    """
+    global _llm_client
+    if _llm_client is None:
+        groq_key = os.getenv("GROQ_API_KEY")
+        if not groq_key:
+            raise ValueError("❌ Error: GROQ_API_KEY not found in .env file.")
+
+        import httpx
+        from groq import AsyncGroq
+
+        _llm_client = AsyncGroq(
+            api_key=groq_key,
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=int(os.getenv("GROQ_MAX_CONNECTIONS", "500")))
+            )
+        )
+    return _llm_client
+
+def set_llm_client(llm_client):
+    """Injects a Groq-compatible async client (e.g. fake_groq.FakeAsyncGroq)"""
+    global _llm_client
+    _llm_client = llm_client
+
+class ResponseCache:
+    """
+    LRU + TTL cache of final answers. Keys include the latest data version of
+    the symbols involved, so a new ingest naturally invalidates old answers.
+    In-flight futures let identical concurrent questions share one LLM call.
+    `latest` keeps the newest answer per question regardless of data
+    version: too old to serve normally, good enough when shedding load.
+    """
+
+    def __init__(self, max_entries=512, ttl_seconds=300, enabled=True):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        # False bypasses lookups, coalescing and storing altogether
+        self.enabled = enabled
+        self.entries = OrderedDict()
+        self.latest = OrderedDict()
+        self.inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def normalize_question(text):
+        text = re.sub(r"[^a-z0-9$%.\s]", " ", text.lower())
+        return " ".join(text.split()).strip(" .")
+
+    def make_key(self, user_input, symbols, data_version):
+        return (
+            self.normalize_question(user_input),
+            tuple(sorted(set(symbols or []))),
+            data_version
+        )
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None or time.monotonic() - entry[0] > self.ttl_seconds:
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, answer):
+        self.entries[key] = (time.monotonic(), answer)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+        question_key = key[:2]
+        self.latest[question_key] = answer
+        self.latest.move_to_end(question_key)
+        while len(self.latest) > self.max_entries:
+            self.latest.popitem(last=False)
+
+    def get_stale(self, user_input, symbols):
+        """Newest answer to this question from any data version, or None"""
+        return self.latest.get(self.make_key(user_input, symbols, None)[:2])
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return (self.hits + self.coalesced) / lookups if lookups else 0.0
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "inflight": len(self.inflight),
+            "hit_rate": round(self.hit_rate(), 4),
+        }
+
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("RESPONSE_CACHE_SIZE", "512")),
+    ttl_seconds=int(os.getenv("RESPONSE_CACHE_TTL", "300")),
+    enabled=os.getenv("RESPONSE_CACHE_ENABLED", "1") == "1"
+)
+register_stats("response_cache", response_cache.stats)
+
+async def get_data_version(symbols=None):
+    """
+    Latest ingest timestamp across the given symbols (the cache's data
+    version). Without symbols the model may still pick any coin, so the
+    newest ingest overall is used.
+    """
+    if market_snapshot.ready:
+        if not symbols:
+            return market_snapshot.version
+        rows = [market_snapshot.get(s) for s in symbols]
+        if all(rows):
+            return max(row["timestamp"] for row in rows)
+
+    ch_client = await get_shared_clickhouse_client()
+    if not symbols:
+        with span("db.data_version", symbols="*"):
+            result = await ch_client.query(VERSION_QUERY, settings=query_settings())
+        return result.result_rows[0][0] if result.result_rows else None
+    with span("db.data_version", symbols=",".join(symbols)):
+        result = await ch_client.query(
+            "SELECT max(timestamp) FROM crypto_prices WHERE coin IN %s",
+            parameters=[tuple(s.upper() for s in symbols)],
+            settings=query_settings()
+        )
+    return result.result_rows[0][0] if result.result_rows else None
+
+def fallback_answer(user_input, symbols=None):
+    """
+    Instant answer for a chat shed under load: the last answer to the same
+    question, else the latest snapshot quote of the coins mentioned.
+    No LLM or ClickHouse call.
+    """
+    stale = response_cache.get_stale(user_input, symbols)
+    if stale is not None:
+        return f"_High demand right now, showing the most recent answer to this question._\n\n{stale}"
+
+    lines = []
+    for symbol in symbols or []:
+        row = market_snapshot.get(symbol)
+        if row:
+            lines.append(f"• **{symbol}**: ${row['price']:,.2f} ({row['change_24h']:+.2f}% 24h)")
+    if lines:
+        return "_High demand right now, full analysis unavailable. Latest prices:_\n\n" + "\n".join(lines)
+    return "⏳ MrCrypto is at capacity right now. Please try again in a few seconds."
+
+# 6. CORE LOGIC
+def build_messages(user_input):
     messages = [
         {
             "role": "system", 
@@ -115,55 +384,264 @@ def get_mrcrypto_response(user_input):
                 
                 "Remember: You're analyzing PRE-CALCULATED metrics. Never make up analysis. "
                 "Explain what the numbers mean for trading decisions."
+                + ("\n\n" + COMPACT_KEYS_LEGEND if COMPACT_TOOL_PAYLOADS else "")
             )
         },
         {"role": "user", "content": user_input}
     ]
+    return messages
 
-    try:
-        # --- PHASE 1: INITIAL REASONING ---
-        response = client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=messages,
-            tools=get_crypto_tools(),
-            tool_choice="auto",
-            temperature=0.1
+async def execute_tool_call(ch_client, call_id, sym, token_budget, prefetched=None):
+    """Returns (tool message, failed); a failed call's message carries the error for the model"""
+    task = (prefetched or {}).get(sym)
+    failed = True
+    with span("chat.tool_call", symbol=sym, prefetched=task is not None) as s:
+        try:
+            data = await task if task else await get_crypto_analysis_async(ch_client, sym)
+            if data:
+                content = serialize_tool_payload(data, token_budget)
+                failed = False
+            else:
+                content = f"Error: {sym} not found in database."
+        except Exception as e:
+            content = f"Database Sync Error: {str(e)}"
+        s.tag(payload_tokens=estimate_tokens(content), failed=failed)
+
+    return {
+        "tool_call_id": call_id,
+        "role": "tool",
+        "name": "fetch_crypto_analysis",
+        "content": content
+    }, failed
+
+def log_token_usage(phase, usage, current_span=None):
+    if usage is None:
+        return
+    if current_span is not None:
+        current_span.tag(
+            prompt_tokens=usage.prompt_tokens,
+            completion_tokens=usage.completion_tokens
         )
+    logger.info(
+        f"Token usage [{phase}]: prompt={usage.prompt_tokens} "
+        f"completion={usage.completion_tokens} total={usage.total_tokens}"
+    )
+
+def prefetch_analyses(ch_client, symbols):
+    """Starts the analysis for every detected symbol before the LLM has asked for it"""
+    return {
+        sym.upper(): asyncio.create_task(get_crypto_analysis_async(ch_client, sym.upper()))
+        for sym in symbols
+    }
+
+def discard_prefetch(prefetched):
+    """Cancels prefetches the model never asked for and silences their errors"""
+    for task in prefetched.values():
+        if not task.done():
+            task.cancel()
+        elif not task.cancelled():
+            task.exception()
+
+def synthetic_tool_calls(symbols):
+    """Assistant tool-call message equivalent to what phase 1 would have returned"""
+    return {
+        "role": "assistant",
+        "content": None,
+        "tool_calls": [
+            {
+                "id": f"prefetch_{sym}",
+                "type": "function",
+                "function": {
+                    "name": "fetch_crypto_analysis",
+                    "arguments": json.dumps({"symbol": sym})
+                }
+            }
+            for sym in symbols
+        ]
+    }
+
+async def run_tool_calls(messages, prefetched=None, skip_tool_choice=False):
+    """
+    Phase 1 + 2: lets the model pick tools, then executes them against ClickHouse.
+    Returns (messages, direct_answer, tool_failed). direct_answer is set when
+    no tool was needed; tool_failed when any tool payload was an error.
+
+    :param prefetched: {symbol: Task} analyses already running; tool calls for
+        these symbols are served from the task instead of a new query.
+    :param skip_tool_choice: Trust the prefetched symbols and skip the phase-1
+        round trip entirely.
+    """
+    ch_client = await get_shared_clickhouse_client()
 
+    if skip_tool_choice and prefetched:
+        messages.append(synthetic_tool_calls(list(prefetched)))
+        calls = [(f"prefetch_{sym}", sym) for sym in prefetched]
+    else:
+        # --- PHASE 1: INITIAL REASONING ---
+        with span("chat.tool_choice", model=TOOL_MODEL) as s:
+            response = await get_llm_client().chat.completions.create(
+                model=TOOL_MODEL,
+                messages=messages,
+                tools=get_crypto_tools(),
+                tool_choice="auto",
+                temperature=0.1
+            )
+            log_token_usage("tool_choice", response.usage, s)
         response_message = response.choices[0].message
         tool_calls = response_message.tool_calls
 
-        # --- PHASE 2: TOOL EXECUTION ---
-        if tool_calls:
-            messages.append(response_message)
-            
-            for tool_call in tool_calls:
-                function_args = json.loads(tool_call.function.arguments)
-                sym = function_args.get("symbol").upper()
-                
-                try:
-                    data = get_crypto_analysis(ch_client, sym)
-                    content = json.dumps(data, default=datetime_handler) if data else f"Error: {sym} not found in database."
-                except Exception as e:
-                    content = f"Database Sync Error: {str(e)}"
-                
-                messages.append({
-                    "tool_call_id": tool_call.id,
-                    "role": "tool",
-                    "name": "fetch_crypto_analysis",  
-                    "content": content
-                })
-            
-            # --- PHASE 3: FINAL SYNTHESIS ---
-            final_response = client.chat.completions.create(
-                model="llama-3.1-8b-instant", 
-                messages=messages
-            )
-            return final_response.choices[0].message.content
+        if not tool_calls:
+            return messages, response_message.content, False
+
+        messages.append(response_message)
+        calls = [
+            (tool_call.id, json.loads(tool_call.function.arguments).get("symbol").upper())
+            for tool_call in tool_calls
+        ]
+
+    # --- PHASE 2: TOOL EXECUTION (all symbols concurrently) ---
+    token_budget = max(TOOL_PAYLOAD_TOKEN_BUDGET // len(calls), 1)
+    with span("chat.tools", symbols=",".join(sym for _, sym in calls)):
+        results = await asyncio.gather(
+            *(execute_tool_call(ch_client, call_id, sym, token_budget, prefetched) for call_id, sym in calls)
+        )
+    messages.extend(message for message, _ in results)
+
+    return messages, None, any(failed for _, failed in results)
 
-        return response_message.content
+async def stream_answer(user_input, symbols=None, skip_tool_choice=False, status=None):
+    """
+    Phases 1-3 without error handling: yields answer chunks as Groq streams them.
+    Everything is awaited on the event loop, so cancelling the consuming task
+    (e.g. when the browser disconnects) aborts the in-flight request.
 
-    except Exception as e:
-        return f"🚨 Neural Link Failure: {str(e)}"
+    Analyses for `symbols` start immediately, concurrently with phase 1.
+    `status`, when given, gets "tool_failed" once the tools have run.
+    """
+    stream = None
+    prefetched = {}
+
+    try:
+        if symbols:
+            prefetched = prefetch_analyses(await get_shared_clickhouse_client(), symbols)
+
+        messages, direct_answer, tool_failed = await run_tool_calls(
+            build_messages(user_input), prefetched, skip_tool_choice
+        )
+        if status is not None:
+            status["tool_failed"] = tool_failed
+
+        if direct_answer is not None:
+            yield direct_answer
+            return
+
+        # --- PHASE 3: FINAL SYNTHESIS (STREAMED) ---
+        with span("chat.synthesis", model=SYNTHESIS_MODEL) as s:
+            stream = await get_llm_client().chat.completions.create(
+                model=SYNTHESIS_MODEL,
+                messages=messages,
+                stream=True
+            )
+
+            async for chunk in stream:
+                # Groq reports usage on the final streamed chunk under x_groq
+                x_groq = getattr(chunk, "x_groq", None)
+                if x_groq is not None and getattr(x_groq, "usage", None) is not None:
+                    log_token_usage("synthesis", x_groq.usage, s)
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if "ttft_ms" not in s.tags:
+                        s.tag(ttft_ms=round((time.perf_counter() - s.started) * 1000, 1))
+                    yield delta
     finally:
-        ch_client.close()
\ No newline at end of file
+        discard_prefetch(prefetched)
+        if stream is not None:
+            await stream.response.aclose()
+
+async def get_mrcrypto_response(user_input, symbols=None, skip_tool_choice=False):
+    """
+    Async generator yielding the answer as text chunks.
+
+    :param symbols: Coins already detected in the message (e.g. by Main_app).
+        Their analyses are prefetched in parallel with phase 1, and they are
+        part of the response-cache key together with their latest data
+        version (the newest ingest overall when there are none), so a
+        cached answer is never served across an ingest.
+    :param skip_tool_choice: Caller is confident `symbols` is exactly what the
+        user asked about; phase 1 is skipped and the prefetched data is used.
+    """
+    with request_scope() as request_id:
+        started = time.perf_counter()
+        first_token_at = None
+        source = "llm"
+
+        try:
+            if not response_cache.enabled:
+                source = "uncached"
+                async for delta in stream_answer(user_input, symbols, skip_tool_choice and bool(symbols)):
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    yield delta
+                return
+
+            data_version = await get_data_version(symbols)
+            key = response_cache.make_key(user_input, symbols, data_version)
+
+            cached = response_cache.get(key)
+            if cached is not None:
+                source = "cache"
+                first_token_at = time.perf_counter()
+                yield cached
+                return
+
+            leader = response_cache.inflight.get(key)
+            if leader is not None:
+                # Identical question already being answered: wait for that one
+                try:
+                    answer = await asyncio.shield(leader)
+                    source = "coalesced"
+                    response_cache.coalesced += 1
+                    first_token_at = time.perf_counter()
+                    yield answer
+                    return
+                except Exception:
+                    pass  # leader failed; answer it ourselves below
+
+            future = asyncio.get_running_loop().create_future()
+            response_cache.inflight[key] = future
+            parts = []
+            status = {}
+            try:
+                async for delta in stream_answer(user_input, symbols, skip_tool_choice and bool(symbols), status):
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    parts.append(delta)
+                    yield delta
+            except BaseException as e:
+                if not future.done():
+                    future.set_exception(e if isinstance(e, Exception) else RuntimeError("cancelled"))
+                    future.exception()  # mark retrieved; followers fall back on their own
+                raise
+            finally:
+                if response_cache.inflight.get(key) is future:
+                    del response_cache.inflight[key]
+
+            answer = "".join(parts)
+            # An answer written around a failed lookup must not outlive the failure
+            if not status.get("tool_failed"):
+                response_cache.put(key, answer)
+            future.set_result(answer)
+
+        except Exception as e:
+            yield f"🚨 Neural Link Failure: {str(e)}"
+        finally:
+            total = time.perf_counter() - started
+            ttft = (first_token_at - started) if first_token_at else total
+            record("chat.ttft", ttft * 1000, source=source)
+            record("chat.total", total * 1000, source=source, symbols=",".join(symbols or []))
+            logger.info(
+                f"Chat response {request_id} [{source}]: ttft={ttft * 1000:.0f}ms total={total * 1000:.0f}ms "
+                f"cache_hit_rate={response_cache.hit_rate():.1%}"
+            )
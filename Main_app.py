@@ -1,18 +1,66 @@
-from nicegui import ui
-import pandas as pd
-import plotly.graph_objects as go
+from nicegui import ui, app, background_tasks, Client
 import asyncio
+import functools
+import html
+import json
+import logging
+import time
 import sys, os
-import markdown
+from concurrent.futures import ThreadPoolExecutor
 
+# markdown and the LLM stack (GenAi, which pulls in pandas) are imported
+# lazily: the page can be served before any of them is loaded, and warm_up()
+# pulls them in the background right after boot. Charts are plain plotly
+# dicts, so plotly itself is never imported here.
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
-from AI_chatbot import get_clickhouse_client, get_latest_crypto
-from GenAi import get_mrcrypto_response
+from Market_data import market_snapshot, chart_cache, CHART_RANGES
+from Query_layer import query_layer
+from Admission import chat_admission, RateLimited, Overloaded
+from Profiling import profiled
+import Data_api  # noqa: F401  (registers the /api routes on the NiceGUI app)
+
+logger = logging.getLogger(__name__)
+
+# Multi-process deployment (see serve_workers.py): web workers read the market
+# snapshot and live charts from the publisher's shared segment instead of
+# polling ClickHouse themselves.
+if os.getenv("MARKET_SHM_ROLE") == "reader":
+    from Shared_market import attach_reader
+    attach_reader()
 
 # ═══════════════════════════════════════════════════════════════
 # CONFIGURATION
 # ═══════════════════════════════════════════════════════════════
-TOP_COINS = ["BTC", "ETH", "SOL", "BNB", "XRP", "ADA", "AVAX", "DOGE", "LINK", "DOT"]
+# Virtualised market list: fixed row pitch (card height + margin), card
+# elements that actually exist, and rows rendered beyond the top edge
+MARKET_ROW_HEIGHT = 88
+MARKET_SLOTS = int(os.getenv("MARKET_LIST_SLOTS", "16"))
+MARKET_OVERSCAN = 2
+
+SORT_LABELS = {"market_cap": "Cap", "change_24h": "24h %", "volume_24h": "Volume"}
+
+# Minimum seconds between markdown re-renders while an answer is streaming in
+STREAM_RENDER_INTERVAL = 0.1
+
+# Skip the LLM tool-choice call when the message clearly names at most this many coins
+SKIP_TOOL_CHOICE_MAX_SYMBOLS = 3
+
+# Points kept on the live chart (24h at 5-minute resolution)
+CHART_POINTS = 288
+
+# Threads of the event loop's default executor, sized once at startup. It is
+# shared: clickhouse-connect 0.7's AsyncClient runs every query there, next to
+# build_series, the warm-up imports and NiceGUI's own blocking calls. Keep
+# QUERY_MAX_CONCURRENCY below it so queries can't take every thread.
+DEFAULT_EXECUTOR_THREADS = int(os.getenv("DEFAULT_EXECUTOR_THREADS", "32"))
+
+RANGE_LABELS = {
+    "1D": "Last 24 hours",
+    "7D": "Last 7 days",
+    "30D": "Last 30 days",
+    "1Y": "Last 12 months",
+    "All": "All history",
+}
 
 COLORS = {
     'bg': '#0a0e14',
@@ -126,6 +174,7 @@ body, .nicegui-content {{
     transition: all 0.2s ease;
     position: relative;
     overflow: hidden;
+    height: 78px;
     margin-bottom: 10px;
 }}
 
@@ -158,6 +207,12 @@ body, .nicegui-content {{
     margin-bottom: 4px;
 }}
 
+.coin-name {{
+    font-weight: 500;
+    color: {COLORS['text_dim']};
+    margin-left: 6px;
+}}
+
 .coin-price {{
     font-size: 15px;
     font-weight: 600;
@@ -300,6 +355,12 @@ body, .nicegui-content {{
     border-radius: 16px 16px 16px 4px;
 }}
 
+.queue-position {{
+    font-size: 12px;
+    color: {COLORS['text_dim']};
+    margin-left: 4px;
+}}
+
 .typing-dot {{
     width: 8px;
     height: 8px;
@@ -394,103 +455,396 @@ body, .nicegui-content {{
 # ═══════════════════════════════════════════════════════════════
 # DATA FUNCTIONS
 # ═══════════════════════════════════════════════════════════════
-_client = None
+def empty_chart():
+    """Placeholder figure as a plain dict, so rendering it needs no plotly import"""
+    return {
+        'data': [],
+        'layout': {
+            'height': 450,
+            'margin': dict(l=0, r=0, t=10, b=0),
+            'paper_bgcolor': 'rgba(0,0,0,0)',
+            'plot_bgcolor': 'rgba(0,0,0,0)',
+            'xaxis': {'visible': False},
+            'yaxis': {'visible': False},
+        }
+    }
 
-def get_client():
-    global _client
-    if not _client:
-        _client = get_clickhouse_client()
-    return _client
+def candlestick_trace(sym, series):
+    return {
+        'type': 'candlestick',
+        'x': list(series["timestamps"]),
+        'open': list(series["open"]),
+        'high': list(series["high"]),
+        'low': list(series["low"]),
+        'close': list(series["close"]),
+        'increasing': {'line': {'color': COLORS['chart_up']}, 'fillcolor': COLORS['chart_up']},
+        'decreasing': {'line': {'color': COLORS['chart_down']}, 'fillcolor': COLORS['chart_down']},
+        'name': sym
+    }
 
-def fetch_coin(sym):
-    try:
-        return get_latest_crypto(get_client(), sym)
-    except:
-        return None
+def build_chart_figure(sym, series, mode="line"):
+    """
+    Plotly figure as a plain dict built from a cached series. Each call gets
+    fresh data lists, so a page can extend its own copy without touching the
+    shared cache.
+    """
+    timestamps = series["timestamps"]
+    if not timestamps:
+        return empty_chart()
 
-def create_chart(sym):
-    try:
-        q = """
-        SELECT timestamp, price
-        FROM crypto_prices
-        WHERE coin = %s
-        ORDER BY timestamp DESC
-        LIMIT 288
-        """
-        r = get_client().query(q, parameters=[sym])
-        df = pd.DataFrame(r.result_rows, columns=r.column_names)
-        df["timestamp"] = pd.to_datetime(df["timestamp"])
-        df = df.sort_values("timestamp")
-    except:
-        return go.Figure()
-
-    if df.empty:
-        return go.Figure()
-
-    price_change = df.price.iloc[-1] - df.price.iloc[0]
+    closes = series["close"] if mode == "candles" else series["prices"]
+    price_change = closes[-1] - closes[0]
     line_color = COLORS['chart_up'] if price_change >= 0 else COLORS['chart_down']
     
-    fig = go.Figure()
-    fig.add_trace(go.Scatter(
-        x=df.timestamp,
-        y=df.price,
-        mode='lines',
-        line=dict(color=line_color, width=2.5),
-        fill='tozeroy',
-        fillcolor=f'rgba({int(line_color[1:3], 16)}, {int(line_color[3:5], 16)}, {int(line_color[5:7], 16)}, 0.15)',
-        hovertemplate='<b>$%{y:,.2f}</b><br>%{x|%b %d, %H:%M}<extra></extra>',
-        name=sym
-    ))
+    if mode == "candles":
+        trace = candlestick_trace(sym, series)
+    else:
+        trace = {
+            'type': 'scatter',
+            'x': list(timestamps),
+            'y': list(closes),
+            'mode': 'lines',
+            'line': dict(color=line_color, width=2.5),
+            'fill': 'tozeroy',
+            'fillcolor': f'rgba({int(line_color[1:3], 16)}, {int(line_color[3:5], 16)}, {int(line_color[5:7], 16)}, 0.15)',
+            'hovertemplate': '<b>$%{y:,.2f}</b><br>%{x|%b %d, %H:%M}<extra></extra>',
+            'name': sym
+        }
     
-    fig.update_layout(
-        autosize=True,
-        height=450,
-        margin=dict(l=0, r=0, t=10, b=0),
-        paper_bgcolor='rgba(0,0,0,0)',
-        plot_bgcolor='rgba(0,0,0,0)',
-        showlegend=False,
-        xaxis=dict(
-            showgrid=True,
-            gridcolor=COLORS['border'],
-            color=COLORS['text_dim'],
-            showline=False,
-            zeroline=False
-        ),
-        yaxis=dict(
-            showgrid=True,
-            gridcolor=COLORS['border'],
-            color=COLORS['text_dim'],
-            showline=False,
-            zeroline=False,
-            tickprefix='$',
-            tickformat=',.0f'
-        ),
-        hovermode='x unified',
-        font=dict(family='Inter', size=12, color=COLORS['text_dim'])
+    return {
+        'data': [trace],
+        'layout': dict(
+            autosize=True,
+            height=450,
+            margin=dict(l=0, r=0, t=10, b=0),
+            paper_bgcolor='rgba(0,0,0,0)',
+            plot_bgcolor='rgba(0,0,0,0)',
+            showlegend=False,
+            xaxis=dict(
+                showgrid=True,
+                gridcolor=COLORS['border'],
+                color=COLORS['text_dim'],
+                showline=False,
+                zeroline=False,
+                rangeslider=dict(visible=False)
+            ),
+            yaxis=dict(
+                showgrid=True,
+                gridcolor=COLORS['border'],
+                color=COLORS['text_dim'],
+                showline=False,
+                zeroline=False,
+                tickprefix='$',
+                tickformat=',.0f'
+            ),
+            hovermode='x unified',
+            font=dict(family='Inter', size=12, color=COLORS['text_dim'])
+        )
+    }
+
+async def create_chart(sym, range_key="1D", mode="line"):
+    """Chart for a coin; the data comes from the shared, coalescing chart cache"""
+    try:
+        series = await chart_cache.get_series(sym, range_key, mode)
+    except Exception as e:
+        logger.warning(f"Chart load failed for {sym} ({range_key}, {mode}): {e}")
+        return empty_chart()
+    return build_chart_figure(sym, series, mode)
+
+def coin_card_html(coin, data, active):
+    price = data.get("price", 0)
+    change = data.get("change_24h", 0)
+    return f'''
+    <div class="coin-card {'active' if active else ''}" id="coin-{coin}">
+        <div class="coin-symbol">{coin}<span class="coin-name">{html.escape(str(data.get("name") or ""))}</span></div>
+        <div class="coin-price">${price:,.2f}</div>
+        <div class="coin-change {'positive' if change >= 0 else 'negative'}">{change:+.2f}%</div>
+    </div>
+    '''
+
+def chart_header_html(symbol, data, range_key="1D"):
+    return f'''
+    <div class="chart-header">
+        <div>
+            <div class="chart-title">{symbol} / USD</div>
+            <div class="chart-subtitle">{RANGE_LABELS[range_key]}</div>
+        </div>
+        <div style="text-align: right;">
+            <div class="chart-price">${data.get("price", 0):,.2f}</div>
+            <div class="chart-change {'positive' if data.get('change_24h', 0) >= 0 else 'negative'}">{data.get('change_24h', 0):+.2f}%</div>
+        </div>
+    </div>
+    '''
+
+def typing_indicator_html(queue_position=None):
+    queued = f'<span class="queue-position">Queued · #{queue_position}</span>' if queue_position else ''
+    return f'''
+    <div class="typing-indicator">
+        <div class="typing-dot"></div>
+        <div class="typing-dot"></div>
+        <div class="typing-dot"></div>
+        {queued}
+    </div>
+    '''
+
+def status_badge_html(updated_at=None):
+    label = f"Live · {updated_at:%H:%M:%S} UTC" if updated_at else "Live Market Data"
+    return f'''
+        <div class="status-badge">
+            <div class="status-dot"></div>
+            <span>{label}</span>
+        </div>
+    '''
+
+# Trace keys that carry data arrays; everything else (layout, styling) stays put
+TRACE_DATA_KEYS = ('x', 'y', 'open', 'high', 'low', 'close')
+TRACE_STYLE_KEYS = ('line', 'fillcolor', 'name')
+
+def run_plotly_js(chart_element, body):
+    """Runs `body` against the chart's graph div (as `el`) in that page's browser"""
+    chart_element.client.run_javascript(f"""
+        (() => {{
+            const el = document.getElementById('c{chart_element.id}');
+            if (!el || !window.Plotly || !el.data) return;
+            {body}
+        }})();
+    """)
+
+def append_chart_point(chart_element, timestamp, price, max_points=CHART_POINTS):
+    """
+    Adds the newest ingest with Plotly.extendTraces: only the new point goes
+    over the websocket. The server-side figure is trimmed to the same bounded
+    window so a reconnect re-renders exactly what the browser shows.
+    """
+    fig = chart_element.figure
+    if not fig['data']:
+        return  # placeholder still showing; the full chart load will include it
+    trace = fig['data'][0]
+    timestamp = timestamp.isoformat()
+    if trace['x'] and trace['x'][-1] == timestamp:
+        return
+    trace['x'] = (trace['x'] + [timestamp])[-max_points:]
+    trace['y'] = (trace['y'] + [price])[-max_points:]
+    run_plotly_js(
+        chart_element,
+        f"Plotly.extendTraces(el, {json.dumps({'x': [[timestamp]], 'y': [[price]]})}, [0], {max_points});"
+    )
+
+def swap_chart_data(chart_element, figure):
+    """
+    Replaces only the trace data arrays (Plotly.restyle) when the trace type
+    is unchanged, e.g. on a coin or range switch; layout is never re-sent.
+    Falls back to a full update when going to/from the placeholder or
+    between line and candles.
+    """
+    old = chart_element.figure
+    if not old['data'] or not figure['data'] or old['data'][0]['type'] != figure['data'][0]['type']:
+        chart_element.update_figure(figure)
+        return
+
+    trace = figure['data'][0]
+    restyle = {key: [trace[key]] for key in TRACE_DATA_KEYS + TRACE_STYLE_KEYS if key in trace}
+    old['data'][0] = trace
+    run_plotly_js(
+        chart_element,
+        f"Plotly.restyle(el, {json.dumps(restyle)}, [0]);"
+        "Plotly.relayout(el, {'xaxis.autorange': true, 'yaxis.autorange': true});"
     )
-    
-    return fig
 
 def extract_coin_symbols(text):
-    text_upper = text.upper()
-    detected = []
-    
-    for coin in TOP_COINS:
-        if coin in text_upper:
-            detected.append(coin)
-    
-    name_map = {
-        "BITCOIN": "BTC", "ETHEREUM": "ETH", "SOLANA": "SOL",
-        "BINANCE": "BNB", "RIPPLE": "XRP", "CARDANO": "ADA",
-        "AVALANCHE": "AVAX", "DOGECOIN": "DOGE", "CHAINLINK": "LINK",
-        "POLKADOT": "DOT"
-    }
+    """Coins named in a chat message (ticker or name, whole tokens only)"""
+    return market_snapshot.matcher.find(text)
+
+def is_unambiguous_mention(text, symbols):
+    """
+    True when the message names few enough coins that the LLM's tool-choice
+    round trip can be skipped. The matcher only reports whole-token ticker
+    or name hits, so every detected symbol is an explicit mention.
+    """
+    return bool(symbols) and len(symbols) <= SKIP_TOOL_CHOICE_MAX_SYMBOLS
+
+async def consume_response_stream(tokens, render, interval=STREAM_RENDER_INTERVAL):
+    """
+    Accumulates streamed answer tokens and calls render(html) at most once per
+    `interval` seconds, plus a final render. Kept free of UI objects so the
+    load-test harness can drive the exact send_message rendering path.
+    """
+    import markdown
+
+    response = ""
+    last_render = 0.0
     
-    for name, symbol in name_map.items():
-        if name in text_upper and symbol not in detected:
-            detected.append(symbol)
+    try:
+        async for token in tokens:
+            response += token
+            now = time.monotonic()
+            if now - last_render >= interval:
+                render(markdown.markdown(response))
+                last_render = now
+    except Exception as e:
+        response += f"\n\n⚠️ Error: Unable to process request. {str(e)}"
     
-    return detected
+    render(markdown.markdown(response))
+    return response
+
+async def text_stream(text):
+    yield text
+
+async def answer_chat(session_id, user_text, symbols, render, on_position=None):
+    """
+    One chat answer behind the admission controller, rendered via render(html).
+    Rate-limited or shed chats get an instant fallback answer instead of
+    queueing behind the LLM. on_position(n) reports the place in the queue.
+    A PROFILE_SAMPLE_RATE fraction of admitted chats is profiled.
+    """
+    from GenAi import get_mrcrypto_response, fallback_answer
+
+    try:
+        async with chat_admission.slot(session_id, on_position):
+            with profiled("chat"):
+                return await consume_response_stream(
+                    get_mrcrypto_response(
+                        user_text,
+                        symbols=symbols,
+                        skip_tool_choice=is_unambiguous_mention(user_text, symbols)
+                    ),
+                    render
+                )
+    except RateLimited as e:
+        text = f"⏳ You're sending messages quickly. Try again in {max(e.retry_after, 1):.0f}s."
+    except Overloaded:
+        text = fallback_answer(user_text, symbols)
+    return await consume_response_stream(text_stream(text), render)
+
+# ═══════════════════════════════════════════════════════════════
+# PAGE STATE
+# ═══════════════════════════════════════════════════════════════
+class PageState:
+    """
+    View state of one page plus the elements rendered from it.
+
+    The market list is virtualised: `listing` holds every coin matching the
+    search in sort order, but only MARKET_SLOTS card elements exist. They
+    show listing[first:first + MARKET_SLOTS] inside a spacer as tall as
+    the whole list, and are re-bound to other coins as the list scrolls.
+
+    Mutators only mark coins (or the header, or the window) dirty; flush()
+    re-renders the dirty pieces and skips any whose HTML is identical to
+    what the browser already shows. A selection change therefore touches
+    two cards, a price tick only the visible coins that moved. Everything
+    set in one flush goes out in the same NiceGUI outbox cycle, i.e. a
+    single websocket message.
+    """
+
+    def __init__(self, current_coin="BTC", range_key="1D", chart_mode="line"):
+        self.current_coin = current_coin
+        self.range = range_key
+        self.chart_mode = chart_mode
+        self.search = ""
+        self.sort_key = "market_cap"
+        self.listing = market_snapshot.index.listing(self.search, self.sort_key)
+        self.first = 0
+        self.slots = []
+        self.list_body = None
+        self.list_window = None
+        self.header = None
+        self._rendered = {}
+        self._dirty = set()
+        self._window_dirty = True
+        self._header_dirty = False
+
+    @staticmethod
+    def data(coin):
+        return market_snapshot.get(coin) or {}
+
+    def card_html(self, coin):
+        return coin_card_html(coin, self.data(coin), coin == self.current_coin)
+
+    def header_html(self):
+        return chart_header_html(self.current_coin, self.data(self.current_coin), self.range)
+
+    def coin_at(self, slot):
+        index = self.first + slot
+        return self.listing[index] if index < len(self.listing) else None
+
+    def select(self, coin):
+        if coin != self.current_coin:
+            self._dirty.update((self.current_coin, coin))
+            self.current_coin = coin
+            self._header_dirty = True
+
+    def set_range(self, range_key):
+        self.range = range_key
+        self._header_dirty = True
+
+    def set_listing(self, search=None, sort_key=None):
+        """Re-runs the search/sort against the current market index"""
+        if search is not None:
+            self.search = search
+        if sort_key is not None:
+            self.sort_key = sort_key
+        listing = market_snapshot.index.listing(self.search, self.sort_key)
+        if search is not None or sort_key is not None:
+            self.first = 0
+        if listing != self.listing:
+            self.listing = listing
+            self.first = min(self.first, max(len(listing) - len(self.slots), 0))
+            self._window_dirty = True
+
+    def scroll_to(self, pixels):
+        first = min(
+            max(int(pixels // MARKET_ROW_HEIGHT) - MARKET_OVERSCAN, 0),
+            max(len(self.listing) - len(self.slots), 0)
+        )
+        if first != self.first:
+            self.first = first
+            self._window_dirty = True
+
+    def reload(self):
+        """Re-reads list and header from the snapshot (first load after a cold start)"""
+        self.set_listing()
+        self._window_dirty = True
+        self._header_dirty = True
+
+    def update_coins(self, delta):
+        """Marks the coins of a snapshot delta for re-render"""
+        self._dirty.update(delta)
+        if self.current_coin in delta:
+            self._header_dirty = True
+
+    def mount_list(self):
+        """Creates the spacer and the card slots in the current UI context"""
+        self.list_body = ui.element('div').style('position: relative; width: 100%;')
+        with self.list_body:
+            self.list_window = ui.column().classes('w-full').style('position: absolute; top: 0; gap: 0;')
+            with self.list_window:
+                self.slots = [ui.html('', sanitize=False) for _ in range(MARKET_SLOTS)]
+        return self.slots
+
+    def mount_header(self):
+        content = self.header_html()
+        self.header = ui.html(content, sanitize=False)
+        self._rendered[self.header.id] = content
+        return self.header
+
+    def _set(self, element, content):
+        if self._rendered.get(element.id) != content:
+            element.content = content
+            self._rendered[element.id] = content
+
+    def flush(self):
+        if self._window_dirty and self.list_body is not None:
+            self.list_body.style(f'height: {len(self.listing) * MARKET_ROW_HEIGHT}px')
+            self.list_window.style(f'top: {self.first * MARKET_ROW_HEIGHT}px')
+        for slot, element in enumerate(self.slots):
+            coin = self.coin_at(slot)
+            if self._window_dirty or coin in self._dirty:
+                self._set(element, self.card_html(coin) if coin else '')
+        self._dirty.clear()
+        self._window_dirty = False
+        if self._header_dirty and self.header is not None:
+            self._set(self.header, self.header_html())
+        self._header_dirty = False
 
 # ═══════════════════════════════════════════════════════════════
 # MAIN APPLICATION
@@ -499,95 +853,93 @@ def extract_coin_symbols(text):
 def main_page():
     ui.add_head_html(get_global_css())
     
-    state = {"current_coin": "BTC", "coin_data": {}}
-    
-    for coin in TOP_COINS:
-        state["coin_data"][coin] = fetch_coin(coin) or {}
+    # Served from the shared in-memory snapshot: no DB work per page load.
+    # Before the first refresh the page renders an empty market list and
+    # load_initial_data() fills them in once the browser is connected.
+    view = PageState()
     
     with ui.row().classes('w-full terminal-header'):
         ui.html('<div class="logo-text">⚡ MRCRYPTO TERMINAL</div>', sanitize=False)
-        ui.html('''
-            <div class="status-badge">
-                <div class="status-dot"></div>
-                <span>Live Market Data</span>
-            </div>
-        ''', sanitize=False)
+        status_badge = ui.html(status_badge_html(), sanitize=False)
     
     with ui.row().classes('w-full').style(f'height: calc(100vh - 60px); background: {COLORS["bg"]};'):
         
-        with ui.column().classes('h-full').style('flex: 0 0 280px; overflow-y: auto;'):
+        with ui.column().classes('h-full').style('flex: 0 0 280px; overflow: hidden; flex-wrap: nowrap;'):
             ui.html('<div class="coin-selector"><div style="font-size: 13px; font-weight: 700; color: #8b949e; margin-bottom: 12px; text-transform: uppercase; letter-spacing: 0.05em;">Markets</div></div>', sanitize=False)
             
-            coin_cards_container = ui.column().style('padding: 0 20px 20px 20px;')
-            coin_cards = {}
-            
-            with coin_cards_container:
-                for coin in TOP_COINS:
-                    data = state["coin_data"].get(coin, {})
-                    price = data.get("price", 0)
-                    change = data.get("change_24h", 0)
-                    
-                    card_html = f'''
-                    <div class="coin-card {'active' if coin == state["current_coin"] else ''}" id="coin-{coin}">
-                        <div class="coin-symbol">{coin}</div>
-                        <div class="coin-price">${price:,.2f}</div>
-                        <div class="coin-change {'positive' if change >= 0 else 'negative'}">{change:+.2f}%</div>
-                    </div>
-                    '''
-                    card_element = ui.html(card_html, sanitize=False)
-                    coin_cards[coin] = card_element
-                    
-                    def make_click_handler(symbol):
-                        async def handler():
-                            state["current_coin"] = symbol
-                            
-                            for c, card in coin_cards.items():
-                                data = state["coin_data"].get(c, {})
-                                price = data.get("price", 0)
-                                change = data.get("change_24h", 0)
-                                card.content = f'''
-                                <div class="coin-card {'active' if c == symbol else ''}" id="coin-{c}">
-                                    <div class="coin-symbol">{c}</div>
-                                    <div class="coin-price">${price:,.2f}</div>
-                                    <div class="coin-change {'positive' if change >= 0 else 'negative'}">{change:+.2f}%</div>
-                                </div>
-                                '''
-                            
-                            data = state["coin_data"].get(symbol, {})
-                            chart_header.content = f'''
-                            <div class="chart-header">
-                                <div>
-                                    <div class="chart-title">{symbol} / USD</div>
-                                    <div class="chart-subtitle">Last 24 hours</div>
-                                </div>
-                                <div style="text-align: right;">
-                                    <div class="chart-price">${data.get("price", 0):,.2f}</div>
-                                    <div class="chart-change {'positive' if data.get('change_24h', 0) >= 0 else 'negative'}">{data.get('change_24h', 0):+.2f}%</div>
-                                </div>
-                            </div>
-                            '''
-                            chart_element.update_figure(create_chart(symbol))
-                        return handler
-                    
-                    card_element.on('click', make_click_handler(coin))
+            async def select_coin(symbol):
+                view.select(symbol)
+                view.flush()
+                await refresh_chart()
+
+            async def on_slot_click(slot):
+                coin = view.coin_at(slot)
+                if coin:
+                    await select_coin(coin)
+
+            def on_search(e):
+                view.set_listing(search=e.value or "")
+                market_list.scroll_to(pixels=0)
+                view.flush()
+
+            def on_sort(e):
+                view.set_listing(sort_key=e.value)
+                market_list.scroll_to(pixels=0)
+                view.flush()
+
+            def on_list_scroll(e):
+                view.scroll_to(e.vertical_position)
+                view.flush()
+
+            with ui.column().classes('w-full').style('padding: 0 20px 12px 20px; gap: 8px;'):
+                ui.input(placeholder='Search coins...', on_change=on_search) \
+                    .props('dense outlined clearable debounce=150 dark color=deep-orange').classes('w-full')
+                ui.toggle(SORT_LABELS, value=view.sort_key, on_change=on_sort) \
+                    .props('dense flat no-caps toggle-color=deep-orange text-color=grey-5')
+
+            market_list = ui.scroll_area(on_scroll=on_list_scroll).classes('w-full').style('flex: 1; padding: 0 20px;')
+            with market_list:
+                for slot, element in enumerate(view.mount_list()):
+                    element.on('click', functools.partial(on_slot_click, slot))
+            view.flush()
         
         with ui.column().classes('h-full').style('flex: 1; padding: 20px; overflow: hidden;'):
             with ui.column().classes('chart-container'):
-                initial_data = state["coin_data"].get("BTC", {})
-                chart_header = ui.html(f'''
-                <div class="chart-header">
-                    <div>
-                        <div class="chart-title">BTC / USD</div>
-                        <div class="chart-subtitle">Last 24 hours</div>
-                    </div>
-                    <div style="text-align: right;">
-                        <div class="chart-price">${initial_data.get("price", 0):,.2f}</div>
-                        <div class="chart-change {'positive' if initial_data.get('change_24h', 0) >= 0 else 'negative'}">{initial_data.get('change_24h', 0):+.2f}%</div>
-                    </div>
-                </div>
-                ''', sanitize=False)
+                view.mount_header()
+
+                async def refresh_chart():
+                    swap_chart_data(
+                        chart_element,
+                        await create_chart(view.current_coin, view.range, view.chart_mode)
+                    )
+
+                async def on_range_change(e):
+                    view.set_range(e.value)
+                    view.flush()
+                    await refresh_chart()
+
+                async def on_mode_change(e):
+                    view.chart_mode = e.value
+                    await refresh_chart()
+
+                with ui.row().classes('w-full items-center justify-between').style('margin-bottom: 8px;'):
+                    ui.toggle(list(CHART_RANGES), value=view.range, on_change=on_range_change) \
+                        .props('dense flat no-caps toggle-color=deep-orange text-color=grey-5')
+                    ui.toggle({"line": "Line", "candles": "Candles"}, value=view.chart_mode, on_change=on_mode_change) \
+                        .props('dense flat no-caps toggle-color=deep-orange text-color=grey-5')
                 
-                chart_element = ui.plotly(create_chart("BTC")).style('flex: 1; width: 100%;')
+                chart_element = ui.plotly(empty_chart()).style('flex: 1; width: 100%;')
+
+                async def load_initial_data():
+                    if not market_snapshot.ready:
+                        market_snapshot.start()
+                        await market_snapshot.wait_ready()
+                        view.reload()
+                        view.flush()
+                    await refresh_chart()
+
+                # Data that isn't cached yet is filled in once the page is on screen
+                ui.timer(0, load_initial_data, once=True)
         
         with ui.column().classes('chat-panel').style('flex: 0 0 400px;'):
             ui.html('''
@@ -624,6 +976,14 @@ def main_page():
                     send_btn = ui.button(icon='send').props('flat round dense').classes('send-button')
             
             typing_indicator = None
+            active_chats = set()
+
+            def cancel_active_chats():
+                # Browser went away: abort in-flight Groq/ClickHouse work for this page
+                for task in list(active_chats):
+                    task.cancel()
+
+            ui.context.client.on_disconnect(cancel_active_chats)
             
             async def send_message():
                 nonlocal typing_indicator
@@ -639,70 +999,98 @@ def main_page():
                 
                 mentioned = extract_coin_symbols(user_text)
                 if mentioned:
-                    symbol = mentioned[0]
-                    state["current_coin"] = symbol
-                    
-                    for c, card in coin_cards.items():
-                        data = state["coin_data"].get(c, {})
-                        price = data.get("price", 0)
-                        change = data.get("change_24h", 0)
-                        card.content = f'''
-                        <div class="coin-card {'active' if c == symbol else ''}" id="coin-{c}">
-                            <div class="coin-symbol">{c}</div>
-                            <div class="coin-price">${price:,.2f}</div>
-                            <div class="coin-change {'positive' if change >= 0 else 'negative'}">{change:+.2f}%</div>
-                        </div>
-                        '''
-                    
-                    data = state["coin_data"].get(symbol, {})
-                    chart_header.content = f'''
-                    <div class="chart-header">
-                        <div>
-                            <div class="chart-title">{symbol} / USD</div>
-                            <div class="chart-subtitle">Last 24 hours</div>
-                        </div>
-                        <div style="text-align: right;">
-                            <div class="chart-price">${data.get("price", 0):,.2f}</div>
-                            <div class="chart-change {'positive' if data.get('change_24h', 0) >= 0 else 'negative'}">{data.get('change_24h', 0):+.2f}%</div>
-                        </div>
-                    </div>
-                    '''
-                    chart_element.update_figure(create_chart(symbol))
+                    await select_coin(mentioned[0])
                 
                 with messages_container:
-                    typing_indicator = ui.html('''
-                    <div class="typing-indicator">
-                        <div class="typing-dot"></div>
-                        <div class="typing-dot"></div>
-                        <div class="typing-dot"></div>
-                    </div>
-                    ''', sanitize=False)
+                    typing_indicator = ui.html(typing_indicator_html(), sanitize=False)
                 
                 messages_scroll.scroll_to(percent=1.0)
                 
-                loop = asyncio.get_event_loop()
+                assistant_bubble = None
+
+                def render_response(html_response):
+                    nonlocal typing_indicator, assistant_bubble
+                    if assistant_bubble is None:
+                        if typing_indicator:
+                            typing_indicator.delete()
+                            typing_indicator = None
+                        with messages_container:
+                            assistant_bubble = ui.html('<div class="message-assistant"></div>', sanitize=False)
+                    assistant_bubble.content = f'<div class="message-assistant">{html_response}</div>'
+                    messages_scroll.scroll_to(percent=1.0)
+
+                def show_queue_position(position):
+                    if typing_indicator:
+                        typing_indicator.content = typing_indicator_html(position)
+
+                chat_task = asyncio.current_task()
+                active_chats.add(chat_task)
                 try:
-                    response = await loop.run_in_executor(None, get_mrcrypto_response, user_text)
-                except Exception as e:
-                    response = f"⚠️ Error: Unable to process request. {str(e)}"
-                
-                if typing_indicator:
-                    typing_indicator.delete()
-                    typing_indicator = None
-                
-                with messages_container:
-                    html_response = markdown.markdown(response)
-                    ui.html(f'<div class="message-assistant">{html_response}</div>', sanitize=False)
-                
-                messages_scroll.scroll_to(percent=1.0)
+                    await answer_chat(page_client.id, user_text, mentioned, render_response, show_queue_position)
+                finally:
+                    active_chats.discard(chat_task)
             
             send_btn.on('click', send_message)
             chat_input.on('keydown.enter', send_message)
 
+    # ─── Live updates pushed by the shared market snapshot ─────
+    page_client = ui.context.client
+
+    def on_market_update(delta):
+        if page_client.id not in Client.instances:
+            market_snapshot.unsubscribe(on_market_update)
+            return
+
+        view.set_listing()
+        view.update_coins(delta)
+        view.flush()
+
+        current = view.current_coin
+        # Only the raw 24h line maps 1:1 onto ingests; other views reload on demand
+        if current in delta and view.range == "1D" and view.chart_mode == "line":
+            append_chart_point(chart_element, delta[current]["timestamp"], delta[current]["price"])
+
+        latest = max(change["timestamp"] for change in delta.values())
+        status_badge.content = status_badge_html(latest)
+
+    market_snapshot.subscribe(on_market_update)
+
+# ═══════════════════════════════════════════════════════════════
+# STARTUP
+# ═══════════════════════════════════════════════════════════════
+def size_default_executor():
+    """Replaces the default executor before anything has submitted work to it"""
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=DEFAULT_EXECUTOR_THREADS, thread_name_prefix="default")
+    )
+
+def import_heavy_modules():
+    # Imported here so the first chat doesn't pay for it on the event loop
+    # (consume_response_stream imports it again, by then from sys.modules)
+    import markdown  # noqa: F401
+    import GenAi
+    GenAi.get_llm_client()
+
+async def warm_up():
+    """Loads heavy modules and primes caches in the background after boot"""
+    started = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    try:
+        market_snapshot.start()
+        await loop.run_in_executor(None, import_heavy_modules)
+        await query_layer.get_client()
+        logger.info(f"Warm-up finished in {time.perf_counter() - started:.2f}s")
+    except Exception as e:
+        logger.warning(f"Warm-up incomplete: {e}")
+
+app.on_startup(size_default_executor)
+app.on_startup(lambda: background_tasks.create(warm_up(), name='warm_up'))
+app.on_shutdown(query_layer.close)
+
 if __name__ in {"__main__", "__mp_main__"}:
     ui.run(
         host='0.0.0.0',
-        port=8080,
+        port=int(os.getenv("APP_PORT", "8080")),
         title="MrCrypto Terminal",
         dark=True,
         reload=False
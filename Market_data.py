@@ -0,0 +1,545 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+from bisect import bisect_left
+from collections import OrderedDict, defaultdict, deque
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from Query_layer import query_layer
+from Telemetry import register_stats
+from Queries import SNAPSHOT_QUERY, VERSION_QUERY, CHART_QUERY, SORT_KEYS
+
+logger = logging.getLogger(__name__)
+
+# ═══════════════════════════════════════════════════════════════
+# CONFIGURATION
+# ═══════════════════════════════════════════════════════════════
+# How often to check for a new ingest (a single max(timestamp) probe)
+SNAPSHOT_POLL_SECONDS = int(os.getenv("SNAPSHOT_POLL_SECONDS", "15"))
+
+# Below this many prefix hits, search falls back to fuzzy (trigram) matching
+FUZZY_MIN_RESULTS = 5
+
+# Symbol matcher contents before the first snapshot (and aliases kept after it)
+SEED_COINS = {
+    "BTC": "Bitcoin", "ETH": "Ethereum", "SOL": "Solana", "BNB": "Binance",
+    "XRP": "Ripple", "ADA": "Cardano", "AVAX": "Avalanche", "DOGE": "Dogecoin",
+    "LINK": "Chainlink", "DOT": "Polkadot",
+}
+# Tickers that are also everyday words: only matched when typed in
+# upper case or as $TICKER, never from "link" or "one" in a sentence
+AMBIGUOUS_SYMBOLS = {
+    "A", "AI", "ALL", "AN", "ANY", "ARE", "AT", "BE", "BIG", "BY", "CAN", "DO", "FOR", "GAS",
+    "GET", "GO", "HIGH", "HOT", "I", "IN", "IS", "IT", "KEY", "LINK", "ME", "MORE", "NEAR",
+    "NEW", "NOW", "OF", "ON", "ONE", "OR", "OUT", "SO", "SUN", "THE", "TO", "UP", "US", "WE",
+    "WIN",
+}
+
+# Chart ranges: label -> days of history (None = everything)
+CHART_RANGES = {"1D": 1, "7D": 7, "30D": 30, "1Y": 365, "All": None}
+CHART_MODES = ("line", "candles")
+
+# Raw data is 5-minute resolution; never bucket finer than that
+MIN_BUCKET_SECONDS = 300
+# Buckets returned by ClickHouse before LTTB thins them further
+MAX_SERVER_BUCKETS = int(os.getenv("CHART_MAX_BUCKETS", "2000"))
+# Points actually sent to the browser for a line chart (~ chart width in px)
+CHART_PIXEL_BUDGET = int(os.getenv("CHART_PIXEL_BUDGET", "500"))
+# Candles are wider than pixels; keep them readable
+CANDLE_BUDGET = int(os.getenv("CHART_CANDLE_BUDGET", "120"))
+
+# "All" has no fixed span: it is sized from the history actually stored
+SPAN_QUERY = """
+    SELECT dateDiff('second', min(timestamp), max(timestamp))
+    FROM crypto_prices
+    WHERE coin = %s
+"""
+
+CHART_CACHE_SIZE = int(os.getenv("CHART_CACHE_SIZE", "256"))
+
+# ═══════════════════════════════════════════════════════════════
+# MARKET INDEX
+# ═══════════════════════════════════════════════════════════════
+def trigrams(term):
+    padded = f" {term} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class MarketIndex:
+    """
+    Search and sort structures over one snapshot, rebuilt once per ingest.
+
+    Prefix search bisects a sorted list of search terms (symbol, full name
+    and each name word); fuzzy search scores trigram overlap against an
+    inverted index. The orderings for every SORT_KEYS column are computed
+    up front, so a lookup never sorts the whole universe.
+    """
+
+    def __init__(self, rows):
+        entries = []
+        grams = defaultdict(set)
+        for coin, row in rows.items():
+            name = str(row.get("name") or "").lower()
+            for term in {coin.lower(), name, *name.split()} - {""}:
+                entries.append((term, coin))
+                for gram in trigrams(term):
+                    grams[gram].add(coin)
+        entries.sort()
+
+        self.terms = [term for term, _ in entries]
+        self.term_coins = [coin for _, coin in entries]
+        self.grams = grams
+        self.orders = {
+            key: sorted(rows, key=lambda coin: rows[coin].get(key) or 0, reverse=True)
+            for key in SORT_KEYS
+        }
+        self.ranks = {key: {coin: i for i, coin in enumerate(order)} for key, order in self.orders.items()}
+
+    def __len__(self):
+        return len(self.orders[SORT_KEYS[0]])
+
+    def prefix(self, text):
+        """Coins with a term starting with `text` (already lower-case)"""
+        lo = bisect_left(self.terms, text)
+        hi = bisect_left(self.terms, text + "\uffff", lo)
+        return list(dict.fromkeys(self.term_coins[lo:hi]))
+
+    def fuzzy(self, text, exclude=()):
+        """Coins sharing at least half of the query's trigrams, best first"""
+        query = trigrams(text)
+        scores = defaultdict(int)
+        for gram in query:
+            for coin in self.grams.get(gram, ()):
+                scores[coin] += 1
+        threshold = len(query) / 2
+        hits = [coin for coin, score in scores.items() if score >= threshold and coin not in exclude]
+        rank = self.ranks[SORT_KEYS[0]]
+        return sorted(hits, key=lambda coin: (-scores[coin], rank[coin]))
+
+    def listing(self, text="", sort_key="market_cap"):
+        """
+        Coins to show for a search box value: every coin in `sort_key` order
+        when empty, else prefix matches in that order followed by fuzzy
+        matches by score.
+        """
+        text = text.strip().lower()
+        if not text:
+            return self.orders[sort_key]
+
+        matches = self.prefix(text)
+        if len(matches) * 8 > len(self):
+            # Broad match: filtering the precomputed order beats sorting
+            hits = set(matches)
+            matches = [coin for coin in self.orders[sort_key] if coin in hits]
+        else:
+            matches.sort(key=self.ranks[sort_key].__getitem__)
+        if len(matches) < FUZZY_MIN_RESULTS and len(text) >= 3:
+            matches += self.fuzzy(text, exclude=set(matches))
+        return matches
+
+# ═══════════════════════════════════════════════════════════════
+# SYMBOL MATCHER
+# ═══════════════════════════════════════════════════════════════
+class CoinMatcher:
+    """
+    Aho-Corasick automaton over every coin symbol and name.
+
+    find() makes one pass over the message, so its cost depends on the
+    message length, not on how many coins are tracked. Matches count only
+    on whole tokens ("ADA" is not found in "CANADA"). Overlaps resolve
+    leftmost-longest, so "Bitcoin Cash" wins over "Bitcoin".
+    """
+
+    def __init__(self, coins, aliases=SEED_COINS):
+        # coins / aliases: {symbol: name}; aliases only add names for known symbols
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+
+        for symbol in coins:
+            self._add(symbol.upper(), (symbol.upper(), True))
+        for names in (coins, aliases):
+            for symbol, name in names.items():
+                name = " ".join(str(name or "").upper().split())
+                if symbol in coins and name and name != symbol.upper():
+                    self._add(name, (symbol.upper(), False))
+        self._link()
+
+    def _add(self, pattern, value):
+        node = 0
+        for char in pattern:
+            if char not in self.goto[node]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+                self.goto[node][char] = len(self.goto) - 1
+            node = self.goto[node][char]
+        self.output[node].append((len(pattern), value))
+
+    def _link(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    @staticmethod
+    def _is_boundary(text, index):
+        return index < 0 or index >= len(text) or not text[index].isalnum()
+
+    def find(self, text):
+        """Symbols mentioned in `text`, in order of first appearance"""
+        # Per-character upper-casing keeps indices aligned with `text`
+        upper = "".join(c.upper() if len(c.upper()) == 1 else c for c in text)
+        matches = []
+        node = 0
+        for end, char in enumerate(upper):
+            while node and char not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(char, 0)
+            for length, (symbol, is_ticker) in self.output[node]:
+                start = end - length + 1
+                if not (self._is_boundary(upper, start - 1) and self._is_boundary(upper, end + 1)):
+                    continue
+                if is_ticker and symbol in AMBIGUOUS_SYMBOLS:
+                    typed_upper = text[start:end + 1] == symbol
+                    if not typed_upper and not (start and text[start - 1] == "$"):
+                        continue
+                matches.append((start, -length, symbol))
+
+        symbols = []
+        covered_until = -1
+        for start, negative_length, symbol in sorted(matches):
+            if start <= covered_until:
+                continue
+            covered_until = start - negative_length - 1
+            if symbol not in symbols:
+                symbols.append(symbol)
+        return symbols
+
+# ═══════════════════════════════════════════════════════════════
+# MARKET SNAPSHOT
+# ═══════════════════════════════════════════════════════════════
+class ClickHouseSource:
+    """Snapshot rows straight from ClickHouse (the default source)"""
+
+    async def load(self, known_version=None):
+        """(version, rows); rows is None when the version is still `known_version`"""
+        version_result = await query_layer.query(VERSION_QUERY, site="snapshot.version")
+        version = version_result.result_rows[0][0] if version_result.result_rows else None
+        if known_version is not None and version == known_version:
+            return version, None
+
+        result = await query_layer.query(SNAPSHOT_QUERY, site="snapshot.rows")
+        return version, {
+            row["coin"]: row
+            for row in (dict(zip(result.column_names, values)) for values in result.result_rows)
+        }
+
+class MarketSnapshot:
+    """
+    In-memory latest row per coin, shared by every page load.
+
+    A background loop probes the source every SNAPSHOT_POLL_SECONDS and
+    reloads only when a new ingest has landed. With ClickHouse as the
+    source that is one small max(timestamp) query per poll no matter how
+    many visitors there are; web workers of a multi-process deployment use
+    Shared_market's segment instead and never query it at all.
+    Changed coins are then pushed to every subscribed page; pages never poll.
+    """
+
+    def __init__(self, poll_seconds=SNAPSHOT_POLL_SECONDS, source=None):
+        self.poll_seconds = poll_seconds
+        self.source = source or ClickHouseSource()
+        self.rows = {}
+        self.index = MarketIndex({})
+        self.matcher = CoinMatcher(SEED_COINS)
+        self._matcher_key = None
+        self.version = None
+        self.refreshed_at = None
+        self._task = None
+        self._ready = asyncio.Event()
+        self._listeners = set()
+
+    async def refresh(self, force=False):
+        """Reloads the snapshot if the data version moved; returns True if it did"""
+        known_version = None if force or not self.rows else self.version
+        version, rows = await self.source.load(known_version)
+        if rows is None:
+            return False
+
+        delta = self.diff(self.rows, rows)
+        loop = asyncio.get_running_loop()
+        index = await loop.run_in_executor(None, MarketIndex, rows)
+
+        # The automaton only depends on the coin list, which rarely changes
+        coins = {coin: row.get("name") for coin, row in rows.items()}
+        matcher_key = frozenset(coins.items())
+        if matcher_key != self._matcher_key:
+            self.matcher = await loop.run_in_executor(None, CoinMatcher, coins)
+            self._matcher_key = matcher_key
+
+        # Swap in new objects so readers never see a half-built snapshot
+        self.rows = rows
+        self.index = index
+        self.version = version
+        self.refreshed_at = time.time()
+        self._ready.set()
+        logger.info(f"Market snapshot refreshed: {len(rows)} coins @ {version}, {len(delta)} changed")
+
+        if delta:
+            self._notify(delta)
+        return True
+
+    @staticmethod
+    def diff(old_rows, new_rows):
+        """
+        {coin: {price, change_24h, timestamp}} for coins with a newer row.
+        (timestamp, price) doubles as the new chart point for that coin.
+        """
+        delta = {}
+        for coin, row in new_rows.items():
+            previous = old_rows.get(coin)
+            if previous is None or row["timestamp"] != previous["timestamp"]:
+                delta[coin] = {
+                    "price": row["price"],
+                    "change_24h": row["change_24h"],
+                    "timestamp": row["timestamp"],
+                }
+        return delta
+
+    # ─── Push to connected pages ──────────────────────────────
+    def subscribe(self, listener):
+        """listener(delta) is called on the event loop after every new ingest"""
+        self._listeners.add(listener)
+
+    def unsubscribe(self, listener):
+        self._listeners.discard(listener)
+
+    def _notify(self, delta):
+        for listener in list(self._listeners):
+            try:
+                listener(delta)
+            except Exception as e:
+                logger.warning(f"Dropping market listener after error: {e}")
+                self._listeners.discard(listener)
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Market snapshot refresh failed: {e}")
+            await asyncio.sleep(self.poll_seconds)
+
+    def start(self):
+        """Starts the background refresher (idempotent)"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run(), name="market_snapshot")
+        return self._task
+
+    async def wait_ready(self, timeout=None):
+        await asyncio.wait_for(self._ready.wait(), timeout)
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def get(self, coin):
+        return self.rows.get(coin.upper())
+
+    def all(self):
+        return self.rows
+
+    def stats(self):
+        """Ingestion lag as seen by the app: age of the newest row and of the last refresh"""
+        newest = max((row["timestamp"] for row in self.rows.values()), default=None)
+        return {
+            "coins": len(self.rows),
+            "listeners": len(self._listeners),
+            "data_age_seconds": (datetime.utcnow() - newest).total_seconds() if isinstance(newest, datetime) else None,
+            "refresh_age_seconds": time.time() - self.refreshed_at if self.refreshed_at else None,
+        }
+
+market_snapshot = MarketSnapshot()
+register_stats("market_snapshot", market_snapshot.stats)
+
+# ═══════════════════════════════════════════════════════════════
+# CHART CACHE
+# ═══════════════════════════════════════════════════════════════
+def bucket_seconds(range_key, mode, span_seconds=0):
+    """
+    Bucket width that keeps a range within its point budget. "All" has no
+    fixed length; `span_seconds` is the stored history it covers.
+    """
+    days = CHART_RANGES[range_key]
+    span = days * 86400 if days else int(span_seconds or 0)
+    budget = CANDLE_BUDGET if mode == "candles" else MAX_SERVER_BUCKETS
+    return max(MIN_BUCKET_SECONDS, -(-span // budget))
+
+def lttb(xs, ys, threshold):
+    """
+    Largest-Triangle-Three-Buckets downsampling. Returns the indices of the
+    points to keep, always including the first and last. Keeps the visual
+    shape (peaks, dips) far better than taking every n-th point.
+    """
+    n = len(xs)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+
+    kept = [0]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # Average of the next bucket is the third triangle vertex
+        next_start = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        span = next_end - next_start
+        avg_x = sum(xs[next_start:next_end]) / span
+        avg_y = sum(ys[next_start:next_end]) / span
+
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        best, best_area = start, -1.0
+        ax, ay = xs[a], ys[a]
+        for j in range(start, end):
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        kept.append(best)
+        a = best
+    kept.append(n - 1)
+    return kept
+
+def build_series(df, mode, pixel_budget=CHART_PIXEL_BUDGET):
+    """
+    Bucketed OHLC columns (a query_df result) -> browser payload. Line mode
+    keeps the close price thinned by LTTB; candle mode keeps every (already
+    coarse) bucket. Works on the numpy columns; Python objects are only
+    created for the points actually sent.
+    """
+    import numpy as np
+
+    if df.empty:
+        return {"timestamps": [], **({k: [] for k in ("open", "high", "low", "close")}
+                                     if mode == "candles" else {"prices": []})}
+
+    stamps = df["bucket"].to_numpy(dtype="datetime64[s]")
+    if mode == "candles":
+        return {
+            "timestamps": np.datetime_as_string(stamps).tolist(),
+            **{column: df[column].to_numpy(dtype=float).tolist() for column in ("open", "high", "low", "close")},
+        }
+
+    closes = df["close"].to_numpy(dtype=float)
+    kept = lttb(stamps.astype("int64").tolist(), closes.tolist(), pixel_budget)
+    return {
+        "timestamps": np.datetime_as_string(stamps[kept]).tolist(),
+        "prices": closes[kept].tolist(),
+    }
+
+class ChartCache:
+    """
+    Chart series keyed by (coin, range, mode, data version), shared by all pages.
+
+    Loads run as their own tasks through the query layer, never on the event
+    loop thread; LTTB runs on the default executor. Concurrent requests for
+    the same key await the same task, and a waiter being cancelled (e.g. a
+    closed tab) doesn't cancel the load for everyone else. Payload size is
+    bounded by CHART_PIXEL_BUDGET / CANDLE_BUDGET whatever the range.
+    """
+
+    def __init__(self, max_entries=CHART_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.inflight = {}
+        self.hits = 0
+        self.misses = 0
+        # Optional Shared_market.SharedMarketReader serving the 1D line series
+        self.shared = None
+
+    def make_key(self, coin, range_key, mode):
+        if range_key not in CHART_RANGES or mode not in CHART_MODES:
+            raise ValueError(f"Unknown chart range/mode: {range_key}/{mode}")
+        row = market_snapshot.get(coin)
+        return (coin.upper(), range_key, mode, row["timestamp"] if row else None)
+
+    async def get_series(self, coin, range_key="1D", mode="line"):
+        """
+        Line: {'timestamps', 'prices'}; candles: {'timestamps', 'open',
+        'high', 'low', 'close'}. Timestamps are ISO strings, oldest first.
+        """
+        _, series = await self.get_keyed_series(coin, range_key, mode)
+        return series
+
+    async def get_keyed_series(self, coin, range_key="1D", mode="line"):
+        """(key, series): the key the series was loaded under, for ETags"""
+        key = self.make_key(coin, range_key, mode)
+
+        series = self.entries.get(key)
+        if series is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return key, series
+
+        self.misses += 1
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(self._load(key))
+            # Retrieve the error even if every waiter went away
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self.inflight[key] = task
+        return key, await asyncio.shield(task)
+
+    async def _load(self, key):
+        coin, range_key, mode, _ = key
+        try:
+            if self.shared is not None:
+                series = self.shared.series(coin, range_key, mode)
+                if series is not None:
+                    return self._store(key, series)
+
+            days = CHART_RANGES[range_key]
+            span = 0
+            if days is None:
+                result = await query_layer.query(SPAN_QUERY, parameters=[coin], site="chart.span")
+                span = result.result_rows[0][0] if result.result_rows else 0
+            time_filter = "AND timestamp >= now() - INTERVAL %s DAY" if days else ""
+            parameters = [bucket_seconds(range_key, mode, span), coin] + ([days] if days else [])
+
+            df = await query_layer.query_df(
+                CHART_QUERY.format(time_filter=time_filter), parameters=parameters, site="chart.series"
+            )
+
+            loop = asyncio.get_running_loop()
+            series = await loop.run_in_executor(None, build_series, df, mode)
+            return self._store(key, series)
+        finally:
+            self.inflight.pop(key, None)
+
+    def _store(self, key, series):
+        self.entries[key] = series
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return series
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+chart_cache = ChartCache()
+register_stats("chart_cache", chart_cache.stats)
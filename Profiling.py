@@ -0,0 +1,151 @@
+"""
+Opt-in sampling profiler and ClickHouse query tagging.
+
+Profiling is off unless PROFILE_SAMPLE_RATE > 0 (a fraction of chats and
+API requests) or an API request asks for it with `X-Profile: 1` /
+`?profile=1` while PROFILE_ALLOW_REQUESTS is set. A profiled block has
+its thread's Python stack sampled from a background thread, and the
+result is written to PROFILE_DIR as collapsed stacks ("a;b;c 42" per
+line), which flamegraph.pl, speedscope and inferno read directly.
+
+Every ClickHouse query carries a `mrcrypto-` query_id and a JSON
+log_comment with its call site and request id (see query_settings), so
+query_report.py can join system.query_log back to the code that ran it.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import logging
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from Telemetry import request_id_var
+
+logger = logging.getLogger(__name__)
+
+# ═══════════════════════════════════════════════════════════════
+# CONFIGURATION
+# ═══════════════════════════════════════════════════════════════
+# Fraction of chats / API requests profiled (0 disables sampling)
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+# Let callers force a profile per request (header or query parameter)
+PROFILE_ALLOW_REQUESTS = os.getenv("PROFILE_ALLOW_REQUESTS", "false").lower() == "true"
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+# Stacks deeper than this are cut at the root end
+MAX_STACK_DEPTH = 128
+
+QUERY_ID_PREFIX = "mrcrypto-"
+
+# ═══════════════════════════════════════════════════════════════
+# QUERY TAGGING
+# ═══════════════════════════════════════════════════════════════
+def query_settings(site=None, **settings):
+    """
+    ClickHouse settings tagging one query: a fresh query_id plus a
+    log_comment {"site", "request_id"} that lands in system.query_log.
+    `site` defaults to the calling function's name, like QueryLayer's.
+    """
+    return {
+        "query_id": f"{QUERY_ID_PREFIX}{uuid.uuid4().hex}",
+        "log_comment": json.dumps({
+            "site": site or sys._getframe(1).f_code.co_name,
+            "request_id": request_id_var.get(),
+        }),
+        **settings,
+    }
+
+# ═══════════════════════════════════════════════════════════════
+# SAMPLING PROFILER
+# ═══════════════════════════════════════════════════════════════
+def frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def collapse_stack(frame):
+    labels = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+class SamplingProfiler:
+    """
+    Samples one thread's stack every `interval_ms` from a helper thread.
+    Sampling the event loop thread also catches whatever other coroutines
+    ran in between, so profiles are best read with that in mind.
+    """
+
+    def __init__(self, thread_id=None, interval_ms=PROFILE_INTERVAL_MS):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval_ms / 1000
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                return
+            self.stacks[collapse_stack(frame)] += 1
+            self.samples += 1
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def write(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            f.write(self.collapsed())
+        return path
+
+# One profile at a time: samplers on the same loop would profile each other
+_profile_slot = threading.Lock()
+
+def should_profile(force=False):
+    return force or (PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE)
+
+@contextmanager
+def profiled(name, force=False):
+    """
+    Profiles the block when sampled (or forced) and no other profile is
+    running; yields the profiler or None. Works around sync and async code.
+    """
+    if not should_profile(force) or not _profile_slot.acquire(blocking=False):
+        yield None
+        return
+
+    profiler = SamplingProfiler().start()
+    started = time.perf_counter()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+        _profile_slot.release()
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        path = os.path.join(
+            PROFILE_DIR, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{request_id_var.get() or uuid.uuid4().hex[:12]}.folded"
+        )
+        try:
+            profiler.write(path)
+            logger.info(f"Profile of {name} ({elapsed_ms:.0f} ms, {profiler.samples} samples) written to {path}")
+        except OSError as e:
+            logger.warning(f"Could not write profile {path}: {e}")
@@ -0,0 +1,49 @@
+"""
+SQL over crypto_prices shared by the app, the pipeline and Storage.
+
+Only constants live here (no app imports), so the ingestion side can use
+the same queries without pulling in the web app.
+"""
+
+# Latest row for every coin in one pass; the window prunes old partitions
+SNAPSHOT_QUERY = """
+    SELECT
+        coin,
+        argMax(name, timestamp) AS name,
+        max(timestamp) AS timestamp,
+        argMax(price, timestamp) AS price,
+        argMax(volume_24h, timestamp) AS volume_24h,
+        argMax(market_cap, timestamp) AS market_cap,
+        argMax(change_24h, timestamp) AS change_24h
+    FROM crypto_prices
+    WHERE timestamp >= now() - INTERVAL 2 DAY
+    GROUP BY coin
+"""
+
+VERSION_QUERY = "SELECT max(timestamp) FROM crypto_prices"
+
+# Market list orderings, all descending (largest cap / top gainer / most traded first)
+SORT_KEYS = ("market_cap", "change_24h", "volume_24h")
+
+# OHLC per time bucket, computed inside ClickHouse
+CHART_QUERY = """
+    SELECT
+        toStartOfInterval(timestamp, INTERVAL %s SECOND) AS bucket,
+        argMin(price, timestamp) AS open,
+        max(price) AS high,
+        min(price) AS low,
+        argMax(price, timestamp) AS close
+    FROM crypto_prices
+    WHERE coin = %s
+    {time_filter}
+    GROUP BY bucket
+    ORDER BY bucket ASC
+"""
+
+HISTORY_QUERY = """
+    SELECT timestamp, price, volume_24h, market_cap, change_24h
+    FROM crypto_prices
+    WHERE coin = %s
+    AND timestamp >= now() - INTERVAL %s DAY
+    ORDER BY timestamp ASC
+"""
@@ -0,0 +1,179 @@
+import os
+import sys
+import time
+import asyncio
+import inspect
+import logging
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from AI_chatbot import get_async_clickhouse_client
+from Telemetry import record, register_stats
+from Profiling import query_settings
+
+logger = logging.getLogger(__name__)
+
+# ═══════════════════════════════════════════════════════════════
+# CONFIGURATION
+# ═══════════════════════════════════════════════════════════════
+# Queries allowed in flight at once across the whole process
+QUERY_MAX_CONCURRENCY = int(os.getenv("QUERY_MAX_CONCURRENCY", "16"))
+# Client-side deadline; ClickHouse is also told to stop via max_execution_time
+QUERY_TIMEOUT_SECONDS = float(os.getenv("QUERY_TIMEOUT_SECONDS", "10"))
+# Extra attempts after a connection-level failure (each one reconnects first)
+QUERY_RETRIES = int(os.getenv("QUERY_RETRIES", "1"))
+
+# ═══════════════════════════════════════════════════════════════
+# QUERY LAYER
+# ═══════════════════════════════════════════════════════════════
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.retries = 0
+        self.total_ms = 0.0
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "retries": self.retries,
+            "avg_ms": round(self.total_ms / self.count, 2) if self.count else 0.0,
+        }
+
+class QueryLayer:
+    """
+    The web app's single way into ClickHouse.
+
+    - One pooled AsyncClient (HTTP keep-alive pool + worker threads), created
+      lazily and rebuilt after connection failures.
+    - No shared server session, so concurrent queries never collide on a
+      session lock.
+    - A semaphore bounds in-flight queries; waiters queue instead of piling
+      onto ClickHouse.
+    - Per-call-site counters and `db.<site>` latency histograms; every query
+      carries a query_id and its site in log_comment (see Profiling).
+
+    `query()` and the columnar `query_df()` / `query_np()` have the same
+    shape as their AsyncClient counterparts, so analytics code can take
+    either one. The columnar variants decode straight into numpy/pandas
+    columns (DateTime already datetime64), with no per-row Python tuples;
+    use them for anything longer than a handful of rows.
+    """
+
+    def __init__(self, max_concurrency=QUERY_MAX_CONCURRENCY, timeout=QUERY_TIMEOUT_SECONDS,
+                 retries=QUERY_RETRIES, client_factory=get_async_clickhouse_client):
+        self.timeout = timeout
+        self.retries = retries
+        self.client_factory = client_factory
+        self._client = None
+        self._client_lock = asyncio.Lock()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+
+    async def get_client(self):
+        async with self._client_lock:
+            if self._client is None:
+                self._client = await self.client_factory()
+        return self._client
+
+    async def reconnect(self, broken):
+        """Replaces the client unless another caller already did"""
+        async with self._client_lock:
+            if self._client is broken:
+                self._client = None
+                try:
+                    await close_client(broken)
+                except Exception:
+                    pass
+        return await self.get_client()
+
+    def _site_stats(self, site):
+        with self._stats_lock:
+            if site not in self._stats:
+                self._stats[site] = QueryStats()
+            return self._stats[site]
+
+    async def query(self, query, parameters=None, site=None, timeout=None, settings=None):
+        """
+        Runs a read query returning a QueryResult. `site` tags counters,
+        histograms and the query's log_comment; it defaults to the calling
+        function's name. `settings` are passed through to ClickHouse.
+        """
+        return await self._execute("query", query, parameters, site or sys._getframe(1).f_code.co_name, timeout, settings)
+
+    async def query_df(self, query, parameters=None, site=None, timeout=None, settings=None):
+        """Runs a read query returning a pandas DataFrame built column-wise"""
+        return await self._execute("query_df", query, parameters, site or sys._getframe(1).f_code.co_name, timeout, settings)
+
+    async def query_np(self, query, parameters=None, site=None, timeout=None, settings=None):
+        """Runs a read query returning a numpy array built column-wise"""
+        return await self._execute("query_np", query, parameters, site or sys._getframe(1).f_code.co_name, timeout, settings)
+
+    async def _execute(self, method, query, parameters, site, timeout, settings=None):
+        timeout = timeout or self.timeout
+        stats = self._site_stats(site)
+        settings = {"max_execution_time": max(int(timeout), 1), **query_settings(site), **(settings or {})}
+
+        async with self._semaphore:
+            started = time.perf_counter()
+            attempt = 0
+            try:
+                while True:
+                    client = await self.get_client()
+                    try:
+                        return await asyncio.wait_for(
+                            getattr(client, method)(query, parameters=parameters, settings=settings), timeout
+                        )
+                    except asyncio.TimeoutError:
+                        stats.timeouts += 1
+                        raise
+                    except Exception as e:
+                        if attempt >= self.retries or not is_connection_error(e):
+                            raise
+                        attempt += 1
+                        stats.retries += 1
+                        logger.warning(f"ClickHouse connection error at {site}, reconnecting: {e}")
+                        await self.reconnect(client)
+                        # The first attempt may still be running server-side under the old id
+                        settings["query_id"] = query_settings(site)["query_id"]
+            except Exception:
+                stats.errors += 1
+                raise
+            finally:
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                stats.count += 1
+                stats.total_ms += elapsed_ms
+                record(f"db.{site}", elapsed_ms, query_id=settings["query_id"])
+
+    def stats(self):
+        with self._stats_lock:
+            return {site: s.as_dict() for site, s in self._stats.items()}
+
+    async def close(self):
+        async with self._client_lock:
+            if self._client is not None:
+                await close_client(self._client)
+                self._client = None
+
+async def close_client(client):
+    """AsyncClient.close() is synchronous in clickhouse-connect 0.7; newer releases make it a coroutine"""
+    result = client.close()
+    if inspect.isawaitable(result):
+        await result
+
+def is_connection_error(error):
+    """Transport-level failures worth a reconnect (not SQL errors)"""
+    try:
+        from clickhouse_connect.driver.exceptions import OperationalError
+        if isinstance(error, OperationalError):
+            return True
+    except ImportError:
+        pass
+    return isinstance(error, (ConnectionError, OSError))
+
+query_layer = QueryLayer()
+register_stats("db_queries", query_layer.stats, label="site")
@@ -0,0 +1,323 @@
+"""
+Shared-memory market cache for the multi-process web tier.
+
+One publisher process refreshes the market snapshot from ClickHouse and
+writes it, together with the last 24h of 5-minute prices for every coin,
+into a memory-mapped segment. Web workers (Main_app with
+MARKET_SHM_ROLE=reader) map the same file read-only and serve cards,
+search, the symbol matcher and the 1D line chart from it, so ClickHouse
+load stays the same however many workers run.
+
+    python Shared_market.py          # the publisher (serve_workers.py starts it)
+
+Layout: a small header followed by two equally sized slots. The publisher
+fills the slot readers are *not* using, including that slot's own coin
+count and data version, then flips `active` and bumps `generation`; a
+reader retries if the generation moved while it read. Nothing a reader
+uses is written outside the inactive slot before the flip.
+"""
+import os
+import sys
+import mmap
+import asyncio
+import logging
+import calendar
+import tempfile
+from datetime import datetime, timezone
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from Market_data import MarketSnapshot, market_snapshot, SNAPSHOT_POLL_SECONDS
+from Query_layer import query_layer
+
+logger = logging.getLogger(__name__)
+
+# ═══════════════════════════════════════════════════════════════
+# CONFIGURATION
+# ═══════════════════════════════════════════════════════════════
+MARKET_SHM_PATH = os.getenv(
+    "MARKET_SHM_PATH",
+    os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "mrcrypto_market")
+)
+# Coin capacity of the segment; coins past it are left out (and logged)
+MARKET_SHM_MAX_COINS = int(os.getenv("MARKET_SHM_MAX_COINS", "4096"))
+# 24h at 5-minute resolution, matching the live chart window
+MARKET_SHM_CHART_POINTS = int(os.getenv("MARKET_SHM_CHART_POINTS", "288"))
+# How often readers check the generation counter (a single 8-byte read)
+MARKET_SHM_POLL_SECONDS = float(os.getenv("MARKET_SHM_POLL_SECONDS", "1"))
+
+MAGIC = 0x4D52435259505432  # "MRCRYPT2"
+HEADER_BYTES = 64
+# Header words (uint64): magic, generation, active slot, max coins, chart points
+H_MAGIC, H_GENERATION, H_ACTIVE, H_MAX_COINS, H_POINTS = range(5)
+
+SYMBOL_DTYPE = "S16"
+NAME_DTYPE = "S64"
+# Per-coin numeric columns of the snapshot
+VALUE_FIELDS = ("timestamp", "price", "volume_24h", "market_cap", "change_24h")
+
+# Last day of raw prices for every coin in one columnar pass, grouped by coin
+RECENT_SERIES_QUERY = """
+    SELECT coin, timestamp, price
+    FROM crypto_prices
+    WHERE timestamp >= now() - INTERVAL 1 DAY
+    ORDER BY coin, timestamp
+"""
+
+# ═══════════════════════════════════════════════════════════════
+# LAYOUT
+# ═══════════════════════════════════════════════════════════════
+def to_epoch(ts):
+    """Naive UTC datetime (as ClickHouse returns it) -> seconds"""
+    return float(calendar.timegm(ts.timetuple())) + ts.microsecond / 1e6
+
+def from_epoch(seconds):
+    return datetime.fromtimestamp(seconds, timezone.utc).replace(tzinfo=None)
+
+class SegmentLayout:
+    """numpy views over one mapped segment; nothing is copied"""
+
+    def __init__(self, buffer, max_coins, points):
+        self.header = np.ndarray((8,), dtype=np.uint64, buffer=buffer, offset=0)
+        self.slots = []
+        offset = HEADER_BYTES
+        for _ in range(2):
+            slot = {}
+            for name, shape, dtype in (
+                ("count", (1,), np.int64),
+                ("version", (1,), np.float64),
+                ("symbols", (max_coins,), SYMBOL_DTYPE),
+                ("names", (max_coins,), NAME_DTYPE),
+                ("values", (max_coins, len(VALUE_FIELDS)), np.float64),
+                ("chart_len", (max_coins,), np.int64),
+                ("chart_ts", (max_coins, points), np.float64),
+                ("chart_px", (max_coins, points), np.float64),
+            ):
+                array = np.ndarray(shape, dtype=dtype, buffer=buffer, offset=offset)
+                slot[name] = array
+                offset += array.nbytes
+            self.slots.append(slot)
+
+    @staticmethod
+    def size(max_coins, points):
+        per_coin = (
+            np.dtype(SYMBOL_DTYPE).itemsize + np.dtype(NAME_DTYPE).itemsize
+            + 8 * len(VALUE_FIELDS) + 8 + 16 * points
+        )
+        return HEADER_BYTES + 2 * (16 + max_coins * per_coin)
+
+# ═══════════════════════════════════════════════════════════════
+# PUBLISHER
+# ═══════════════════════════════════════════════════════════════
+class SharedMarketWriter:
+    def __init__(self, path=MARKET_SHM_PATH, max_coins=MARKET_SHM_MAX_COINS, points=MARKET_SHM_CHART_POINTS):
+        self.path = path
+        self.max_coins = max_coins
+        self.points = points
+        size = SegmentLayout.size(max_coins, points)
+        # Write to a temp file and rename, so readers never map a half-sized file
+        tmp_path = f"{path}.{os.getpid()}"
+        with open(tmp_path, "wb") as f:
+            f.truncate(size)
+        self._file = open(tmp_path, "r+b")
+        self._map = mmap.mmap(self._file.fileno(), size)
+        self.layout = SegmentLayout(self._map, max_coins, points)
+        header = self.layout.header
+        header[H_MAX_COINS] = max_coins
+        header[H_POINTS] = points
+        header[H_MAGIC] = MAGIC
+        os.replace(tmp_path, path)
+
+    def publish(self, rows, version, series):
+        """rows: snapshot rows by coin; series: {coin: (epoch seconds array, price array)}"""
+        header = self.layout.header
+        target = 1 - int(header[H_ACTIVE]) if header[H_GENERATION] else 0
+        slot = self.layout.slots[target]
+
+        coins = sorted(rows)
+        if len(coins) > self.max_coins:
+            logger.warning(f"Shared segment holds {self.max_coins} coins; dropping {len(coins) - self.max_coins}")
+            coins = coins[:self.max_coins]
+
+        for i, coin in enumerate(coins):
+            row = rows[coin]
+            slot["symbols"][i] = coin.encode()[:16]
+            slot["names"][i] = str(row.get("name") or "").encode()[:64]
+            slot["values"][i] = [
+                to_epoch(row["timestamp"]), row["price"], row["volume_24h"], row["market_cap"], row["change_24h"]
+            ]
+            epochs, prices = series.get(coin, ((), ()))
+            n = min(len(epochs), self.points)
+            slot["chart_len"][i] = n
+            if n:
+                slot["chart_ts"][i, :n] = epochs[-n:]
+                slot["chart_px"][i, :n] = prices[-n:]
+
+        slot["count"][0] = len(coins)
+        slot["version"][0] = to_epoch(version) if version else 0.0
+        header[H_ACTIVE] = target
+        header[H_GENERATION] += 1
+        self._map.flush()
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+async def load_recent_series():
+    """{coin: (epoch seconds, prices)} as numpy slices of one columnar result"""
+    df = await query_layer.query_df(RECENT_SERIES_QUERY, site="shared.recent_series")
+    if df.empty:
+        return {}
+    coins = df["coin"].to_numpy()
+    epochs = df["timestamp"].to_numpy(dtype="datetime64[ns]").astype(np.int64) / 1e9
+    prices = df["price"].to_numpy(dtype=np.float64)
+    # Rows are sorted by coin, so each coin is one contiguous slice
+    starts = np.flatnonzero(np.r_[True, coins[1:] != coins[:-1]])
+    ends = np.r_[starts[1:], len(coins)]
+    return {coins[a]: (epochs[a:b], prices[a:b]) for a, b in zip(starts, ends)}
+
+async def publish_forever(poll_seconds=SNAPSHOT_POLL_SECONDS):
+    """The single refresher of a multi-process deployment"""
+    snapshot = MarketSnapshot(poll_seconds=poll_seconds)
+    writer = SharedMarketWriter()
+    published_version = None
+    logger.info(f"Publishing market data to {writer.path}")
+    try:
+        while True:
+            try:
+                await snapshot.refresh()
+                if snapshot.rows and snapshot.version != published_version:
+                    writer.publish(snapshot.rows, snapshot.version, await load_recent_series())
+                    published_version = snapshot.version
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Shared market publish failed: {e}")
+            await asyncio.sleep(poll_seconds)
+    finally:
+        writer.close()
+
+# ═══════════════════════════════════════════════════════════════
+# READER
+# ═══════════════════════════════════════════════════════════════
+class SharedMarketReader:
+    """
+    Read-only view of the publisher's segment. Acts as a MarketSnapshot
+    source (load) and serves 1D line series to the chart cache (series).
+    """
+
+    def __init__(self, path=MARKET_SHM_PATH):
+        self.path = path
+        self.layout = None
+        self.generation = None
+        self._map = None
+        self._inode = None
+
+    def attach(self):
+        """
+        Maps the segment; False while the publisher hasn't created it yet.
+        A restarted publisher creates a new file, which is re-mapped here.
+        """
+        try:
+            inode = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return self.layout is not None
+        if self.layout is not None and inode == self._inode:
+            return True
+
+        try:
+            with open(self.path, "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            return self.layout is not None
+        header = np.ndarray((8,), dtype=np.uint64, buffer=mapped, offset=0)
+        if header[H_MAGIC] != MAGIC:
+            return self.layout is not None
+        # The old mapping stays alive until the arrays viewing it are gone
+        self._map = mapped
+        self._inode = inode
+        self.generation = None
+        self.layout = SegmentLayout(mapped, int(header[H_MAX_COINS]), int(header[H_POINTS]))
+        logger.info(f"Attached shared market segment {self.path}")
+        return True
+
+    def _consistent(self, read):
+        """Runs read(slot) until no publish happened while it ran"""
+        header = self.layout.header
+        while True:
+            generation = int(header[H_GENERATION])
+            if not generation:
+                return generation, None
+            slot = self.layout.slots[int(header[H_ACTIVE])]
+            result = read(slot, int(slot["count"][0]))
+            if int(header[H_GENERATION]) == generation:
+                return generation, result
+
+    def _read_rows(self, slot, count):
+        symbols = slot["symbols"][:count]
+        names = slot["names"][:count]
+        values = slot["values"][:count].tolist()
+        rows = {}
+        for symbol, name, (ts, price, volume, cap, change) in zip(symbols, names, values):
+            coin = symbol.decode()
+            rows[coin] = {
+                "coin": coin,
+                "name": name.decode(errors="ignore"),
+                "timestamp": from_epoch(ts),
+                "price": price,
+                "volume_24h": volume,
+                "market_cap": cap,
+                "change_24h": change,
+            }
+        return rows
+
+    async def load(self, known_version=None):
+        """MarketSnapshot source: rows of the newest generation, or None if unchanged"""
+        if not self.attach():
+            return None, None
+        generation, result = self._consistent(
+            lambda slot, count: (float(slot["version"][0]), self._read_rows(slot, count))
+        )
+        if result is None or (known_version is not None and generation == self.generation):
+            return known_version, None
+        self.generation = generation
+        version, rows = result
+        return from_epoch(version), rows
+
+    def series(self, coin, range_key, mode):
+        """{'timestamps', 'prices'} for the 1D line chart, or None for other views"""
+        if range_key != "1D" or mode != "line" or self.layout is None:
+            return None
+
+        def read(slot, count):
+            symbols = slot["symbols"][:count]
+            matches = np.flatnonzero(symbols == coin.upper().encode())
+            if not len(matches):
+                return None
+            i = matches[0]
+            n = int(slot["chart_len"][i])
+            return slot["chart_ts"][i, :n].tolist(), slot["chart_px"][i, :n].tolist()
+
+        _, points = self._consistent(read)
+        if not points:
+            return None
+        timestamps, prices = points
+        return {"timestamps": [from_epoch(ts).isoformat() for ts in timestamps], "prices": prices}
+
+def attach_reader():
+    """Switches this process's snapshot and chart cache to the shared segment"""
+    from Market_data import chart_cache
+
+    reader = SharedMarketReader()
+    market_snapshot.source = reader
+    market_snapshot.poll_seconds = MARKET_SHM_POLL_SECONDS
+    chart_cache.shared = reader
+    return reader
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    try:
+        asyncio.run(publish_forever())
+    except KeyboardInterrupt:
+        pass
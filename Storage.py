@@ -0,0 +1,278 @@
+"""
+Pluggable storage for crypto_prices.
+
+Two backends share one interface: insert, data_version, latest, history,
+rollup and screener.
+
+- ClickHouseStorage runs the same SQL the app and the pipeline use.
+- EmbeddedStorage is an in-process columnar store (pandas/numpy) with
+  the same semantics. It lets analytics, ingestion and benchmarks run
+  with no server.
+
+    storage = get_storage()                      # STORAGE_BACKEND=clickhouse|embedded
+    storage.insert(df)                           # crypto_prices columns
+    get_crypto_analysis(storage, "BTC")          # Analytics_engine accepts a backend
+
+EmbeddedStorage keeps everything in memory. With EMBEDDED_STORAGE_PATH
+set, it loads that file on start and writes it back on close(), so
+offline runs can carry data over.
+"""
+import os
+import sys
+import logging
+import threading
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from Queries import SNAPSHOT_QUERY, VERSION_QUERY, CHART_QUERY, SORT_KEYS, HISTORY_QUERY
+from Profiling import query_settings
+
+logger = logging.getLogger(__name__)
+
+# ═══════════════════════════════════════════════════════════════
+# CONFIGURATION
+# ═══════════════════════════════════════════════════════════════
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "clickhouse")
+EMBEDDED_STORAGE_PATH = os.getenv("EMBEDDED_STORAGE_PATH")
+
+COLUMNS = ["timestamp", "coin", "name", "price", "volume_24h", "market_cap", "change_24h"]
+HISTORY_COLUMNS = ["timestamp", "price", "volume_24h", "market_cap", "change_24h"]
+# latest() / screener() only consider coins seen this recently (as SNAPSHOT_QUERY does)
+SNAPSHOT_WINDOW_DAYS = 2
+
+def check_columns(df):
+    missing = [column for column in COLUMNS if column not in df.columns]
+    if missing:
+        raise ValueError(f"DataFrame missing required columns: {missing}")
+
+# ═══════════════════════════════════════════════════════════════
+# INTERFACE
+# ═══════════════════════════════════════════════════════════════
+class StorageBackend(ABC):
+    """
+    What ingestion, analytics and the benchmarks need from storage.
+    Timestamps are naive UTC datetimes throughout.
+    """
+
+    @abstractmethod
+    def insert(self, df, site="storage.insert"):
+        """
+        Appends crypto_prices rows (a DataFrame with COLUMNS); returns the
+        row count. `site` names the caller in query tags where supported.
+        """
+
+    @abstractmethod
+    def data_version(self):
+        """Newest timestamp stored, or None when empty"""
+
+    @abstractmethod
+    def latest(self, coins=None):
+        """{coin: row dict} with the newest row of each (or of the given) coin"""
+
+    @abstractmethod
+    def history(self, coin, days=30):
+        """DataFrame of HISTORY_COLUMNS for the last `days` days, oldest first"""
+
+    @abstractmethod
+    def rollup(self, coin, bucket_seconds, days=None):
+        """OHLC per time bucket: DataFrame of bucket, open, high, low, close, oldest first"""
+
+    @abstractmethod
+    def screener(self, sort_key="market_cap", limit=50):
+        """Latest rows ordered by `sort_key`, largest first"""
+
+    def close(self):
+        pass
+
+# ═══════════════════════════════════════════════════════════════
+# CLICKHOUSE
+# ═══════════════════════════════════════════════════════════════
+class ClickHouseStorage(StorageBackend):
+    """
+    crypto_prices on a ClickHouse server, via a sync clickhouse_connect
+    client. `table` points the same queries at another table with the
+    same schema (e.g. for benchmarks).
+    """
+
+    def __init__(self, client=None, table="crypto_prices"):
+        if client is None:
+            from AI_chatbot import get_clickhouse_client
+            client = get_clickhouse_client()
+        self.client = client
+        self.table = table
+
+    def _sql(self, query):
+        return query.replace("FROM crypto_prices", f"FROM {self.table}")
+
+    def insert(self, df, site="storage.insert"):
+        check_columns(df)
+        if df.empty:
+            return 0
+        self.client.insert_df(self.table, df[COLUMNS], settings=query_settings(site))
+        return len(df)
+
+    def data_version(self):
+        result = self.client.query(self._sql(VERSION_QUERY), settings=query_settings("storage.version"))
+        return result.result_rows[0][0] if result.result_rows else None
+
+    def latest(self, coins=None):
+        result = self.client.query(self._sql(SNAPSHOT_QUERY), settings=query_settings("storage.latest"))
+        rows = {row["coin"]: row for row in (dict(zip(result.column_names, values)) for values in result.result_rows)}
+        return {coin: rows[coin] for coin in (c.upper() for c in coins) if coin in rows} if coins else rows
+
+    def history(self, coin, days=30):
+        return self.client.query_df(
+            self._sql(HISTORY_QUERY), parameters=[coin.upper(), days], settings=query_settings("storage.history")
+        )
+
+    def rollup(self, coin, bucket_seconds, days=None):
+        time_filter = "AND timestamp >= now() - INTERVAL %s DAY" if days else ""
+        parameters = [bucket_seconds, coin.upper()] + ([days] if days else [])
+        return self.client.query_df(
+            self._sql(CHART_QUERY.format(time_filter=time_filter)), parameters=parameters,
+            settings=query_settings("storage.rollup")
+        )
+
+    def screener(self, sort_key="market_cap", limit=50):
+        if sort_key not in SORT_KEYS:
+            raise ValueError(f"sort_key must be one of {SORT_KEYS}")
+        # sort_key is whitelisted above, so formatting it in is safe
+        result = self.client.query(
+            f"SELECT * FROM ({self._sql(SNAPSHOT_QUERY)}) ORDER BY {sort_key} DESC LIMIT %s",
+            parameters=[limit], settings=query_settings("storage.screener")
+        )
+        return [dict(zip(result.column_names, values)) for values in result.result_rows]
+
+    def close(self):
+        self.client.close()
+
+# ═══════════════════════════════════════════════════════════════
+# EMBEDDED
+# ═══════════════════════════════════════════════════════════════
+class EmbeddedStorage(StorageBackend):
+    """
+    In-process columnar store with ClickHouse's semantics for this table:
+    append-only, duplicates kept, reads by coin and time range.
+
+    Inserts are split per coin and only appended. A coin's chunks are
+    concatenated and sorted (stable, so equal timestamps keep insert order)
+    the first time it is read afterwards. Repeated reads therefore cost a
+    searchsorted on its timestamp column, not a scan of the whole table.
+    """
+
+    def __init__(self, path=EMBEDDED_STORAGE_PATH):
+        self.path = path
+        self._pending = defaultdict(list)
+        self._frames = {}
+        self._lock = threading.RLock()
+        if path and os.path.exists(path):
+            loaded = self.insert(pd.read_pickle(path))
+            logger.info(f"Embedded storage loaded {loaded} rows from {path}")
+
+    def insert(self, df, site="storage.insert"):
+        check_columns(df)
+        if df.empty:
+            return 0
+        df = df[COLUMNS].copy()
+        df["coin"] = df["coin"].str.upper()
+        df["timestamp"] = pd.to_datetime(df["timestamp"]).astype("datetime64[ns]")
+        with self._lock:
+            for coin, group in df.groupby("coin", sort=False):
+                self._pending[coin].append(group)
+        return len(df)
+
+    def _frame(self, coin):
+        """All rows of one coin sorted by time, or None"""
+        with self._lock:
+            pending = self._pending.pop(coin, None)
+            if pending:
+                parts = ([self._frames[coin]] if coin in self._frames else []) + pending
+                self._frames[coin] = pd.concat(parts, ignore_index=True) \
+                    .sort_values("timestamp", kind="stable", ignore_index=True)
+            return self._frames.get(coin)
+
+    def _coins(self):
+        with self._lock:
+            return set(self._frames) | set(self._pending)
+
+    @staticmethod
+    def _since(frame, days):
+        """Rows newer than now - days (a binary search on the sorted column)"""
+        if days is None:
+            return frame
+        cutoff = np.datetime64(datetime.utcnow() - timedelta(days=days), "ns")
+        return frame.iloc[frame["timestamp"].searchsorted(cutoff):]
+
+    def data_version(self):
+        newest = [frame["timestamp"].iloc[-1] for frame in map(self._frame, self._coins()) if frame is not None]
+        return max(newest).to_pydatetime() if newest else None
+
+    def latest(self, coins=None):
+        rows = {}
+        for coin in (c.upper() for c in coins) if coins else self._coins():
+            frame = self._frame(coin)
+            if frame is None:
+                continue
+            recent = self._since(frame, SNAPSHOT_WINDOW_DAYS)
+            if recent.empty:
+                continue
+            row = recent.iloc[-1].to_dict()
+            row["timestamp"] = row["timestamp"].to_pydatetime()
+            rows[coin] = row
+        return rows
+
+    def history(self, coin, days=30):
+        frame = self._frame(coin.upper())
+        if frame is None:
+            return pd.DataFrame(columns=HISTORY_COLUMNS)
+        return self._since(frame, days)[HISTORY_COLUMNS].reset_index(drop=True)
+
+    def rollup(self, coin, bucket_seconds, days=None):
+        frame = self._frame(coin.upper())
+        if frame is None:
+            return pd.DataFrame(columns=["bucket", "open", "high", "low", "close"])
+        frame = self._since(frame, days)
+        # Epoch-aligned buckets, like toStartOfInterval(..., INTERVAL n SECOND)
+        buckets = frame["timestamp"].dt.floor(f"{bucket_seconds}s")
+        grouped = frame["price"].groupby(buckets.to_numpy())
+        df = pd.DataFrame({
+            "open": grouped.first(), "high": grouped.max(), "low": grouped.min(), "close": grouped.last(),
+        })
+        return df.rename_axis("bucket").reset_index()
+
+    def screener(self, sort_key="market_cap", limit=50):
+        if sort_key not in SORT_KEYS:
+            raise ValueError(f"sort_key must be one of {SORT_KEYS}")
+        rows = sorted(self.latest().values(), key=lambda row: row[sort_key], reverse=True)
+        return rows[:limit]
+
+    def save(self, path=None):
+        path = path or self.path
+        frames = [frame for frame in map(self._frame, sorted(self._coins())) if frame is not None]
+        table = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=COLUMNS)
+        table.to_pickle(path)
+        logger.info(f"Embedded storage saved {len(table)} rows to {path}")
+
+    def close(self):
+        if self.path:
+            self.save()
+
+# ═══════════════════════════════════════════════════════════════
+# FACTORY
+# ═══════════════════════════════════════════════════════════════
+def get_storage(backend=None, client_factory=None):
+    """
+    Storage backend named by `backend` or STORAGE_BACKEND. `client_factory`
+    builds the ClickHouse client (only called for that backend).
+    """
+    backend = (backend or STORAGE_BACKEND).lower()
+    if backend == "clickhouse":
+        return ClickHouseStorage(client=client_factory() if client_factory else None)
+    if backend == "embedded":
+        return EmbeddedStorage()
+    raise ValueError(f"Unknown storage backend: {backend} (expected clickhouse or embedded)")
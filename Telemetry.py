@@ -0,0 +1,312 @@
+import os
+import json
+import time
+import uuid
+import math
+import bisect
+import logging
+import threading
+import contextvars
+from functools import wraps
+from contextlib import contextmanager
+
+# ═══════════════════════════════════════════════════════════════
+# CONFIGURATION
+# ═══════════════════════════════════════════════════════════════
+# Histogram bucket upper bounds in milliseconds
+LATENCY_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000]
+
+# Optional JSON-lines trace log (one line per finished span)
+TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH")
+
+request_id_var = contextvars.ContextVar("request_id", default=None)
+# Tags inherited by every span opened inside span_context()
+context_tags_var = contextvars.ContextVar("span_context_tags", default={})
+
+_trace_logger = logging.getLogger("mrcrypto.trace")
+_trace_logger.propagate = False
+if TRACE_LOG_PATH:
+    _handler = logging.FileHandler(TRACE_LOG_PATH)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    _trace_logger.addHandler(_handler)
+    _trace_logger.setLevel(logging.INFO)
+
+# ═══════════════════════════════════════════════════════════════
+# HISTOGRAMS
+# ═══════════════════════════════════════════════════════════════
+class Histogram:
+    """Fixed-bucket latency histogram (milliseconds) with quantile estimates"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.count = 0
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value_ms):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, value_ms)] += 1
+            self.count += 1
+            self.total += value_ms
+
+    def quantile(self, q):
+        """Linear interpolation inside the bucket that holds the q-th observation"""
+        with self._lock:
+            if self.count == 0:
+                return 0.0
+            rank = q * self.count
+            seen = 0
+            for i, bucket_count in enumerate(self.counts):
+                if seen + bucket_count >= rank and bucket_count:
+                    lower = self.buckets[i - 1] if i > 0 else 0.0
+                    upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                    return lower + (upper - lower) * ((rank - seen) / bucket_count)
+                seen += bucket_count
+            return float(self.buckets[-1])
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "buckets": list(self.buckets),
+                "counts": list(self.counts),
+                "count": self.count,
+                "sum": self.total,
+            }
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+def get_histogram(name):
+    with _histograms_lock:
+        if name not in _histograms:
+            _histograms[name] = Histogram()
+        return _histograms[name]
+
+def histogram_summary():
+    """{span name: {count, p50, p95, p99}} for every span seen so far"""
+    with _histograms_lock:
+        items = list(_histograms.items())
+    return {
+        name: {
+            "count": hist.count,
+            "p50_ms": round(hist.quantile(0.50), 1),
+            "p95_ms": round(hist.quantile(0.95), 1),
+            "p99_ms": round(hist.quantile(0.99), 1),
+        }
+        for name, hist in items
+    }
+
+def all_histograms():
+    with _histograms_lock:
+        return dict(_histograms)
+
+# ═══════════════════════════════════════════════════════════════
+# SPANS
+# ═══════════════════════════════════════════════════════════════
+@contextmanager
+def request_scope():
+    """
+    Starts a new request id (yielded) for the block; spans opened inside are
+    tagged with it. Reset on exit so it never leaks into the caller's task.
+    """
+    request_id = uuid.uuid4().hex[:12]
+    token = request_id_var.set(request_id)
+    try:
+        yield request_id
+    finally:
+        try:
+            request_id_var.reset(token)
+        except ValueError:
+            pass  # exited from another context (e.g. a garbage-collected generator)
+
+@contextmanager
+def span_context(**tags):
+    """Adds tags (e.g. symbol) to every span opened inside the block"""
+    token = context_tags_var.set({**context_tags_var.get(), **tags})
+    try:
+        yield
+    finally:
+        context_tags_var.reset(token)
+
+class Span:
+    def __init__(self, name, tags):
+        self.name = name
+        self.tags = tags
+        self.started = time.perf_counter()
+        self.duration_ms = None
+
+    def tag(self, **tags):
+        """Attach tags discovered mid-span (e.g. token counts)"""
+        self.tags.update({k: v for k, v in tags.items() if v is not None})
+
+@contextmanager
+def span(name, **tags):
+    """
+    Times a block, records it in the `name` histogram and, if TRACE_LOG_PATH
+    is set, writes a JSON trace line tagged with the current request id.
+    Works the same inside sync and async code.
+    """
+    merged = {**context_tags_var.get(), **tags}
+    current = Span(name, {k: v for k, v in merged.items() if v is not None})
+    error = None
+    try:
+        yield current
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        current.duration_ms = (time.perf_counter() - current.started) * 1000
+        if error:
+            current.tags["error"] = error
+        record(name, current.duration_ms, **current.tags)
+
+def record(name, duration_ms, **tags):
+    """Records an already-measured duration exactly like a finished span"""
+    get_histogram(name).observe(duration_ms)
+    if TRACE_LOG_PATH:
+        entry = {
+            "ts": time.time(),
+            "request_id": request_id_var.get(),
+            "span": name,
+            "duration_ms": round(duration_ms, 2),
+            **{k: v for k, v in tags.items() if v is not None},
+        }
+        _trace_logger.info(json.dumps(entry, default=str))
+
+def traced(name):
+    """Decorator form of span() for plain functions"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# ═══════════════════════════════════════════════════════════════
+# METRICS (Prometheus text format)
+# ═══════════════════════════════════════════════════════════════
+METRICS_PREFIX = "mrcrypto"
+
+_counters = {}
+_gauges = {}
+_collectors = []
+_metrics_lock = threading.Lock()
+
+def _series_key(name, labels):
+    return (name, tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None)))
+
+def count(name, value=1, **labels):
+    """Adds to a monotonically increasing counter (exported as <name>_total)"""
+    key = _series_key(name, labels)
+    with _metrics_lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def set_gauge(name, value, **labels):
+    key = _series_key(name, labels)
+    with _metrics_lock:
+        _gauges[key] = value
+
+def register_stats(prefix, stats_fn, label=None):
+    """
+    Exports an existing stats() dict as gauges on every scrape:
+    {key: number} -> <prefix>_<key>, or with `label`,
+    {label value: {key: number}} -> <prefix>_<key>{label="..."}.
+    Non-numeric values are skipped.
+    """
+    _collectors.append((prefix, stats_fn, label))
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in labels) + "}"
+
+def _format_value(value):
+    """Sample value at full precision: integers as-is, floats via repr"""
+    if isinstance(value, int):
+        return str(int(value))
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return str(int(value)) if value.is_integer() and abs(value) < 2 ** 53 else repr(value)
+
+def _metric_name(name):
+    return f"{METRICS_PREFIX}_" + "".join(c if c.isalnum() else "_" for c in name)
+
+def _collected_samples():
+    samples = []
+    for prefix, stats_fn, label in list(_collectors):
+        try:
+            stats = stats_fn()
+        except Exception as e:
+            logging.getLogger(__name__).debug(f"Metrics collector {prefix} failed: {e}")
+            continue
+        groups = stats.items() if label else [(None, stats)]
+        for label_value, values in groups:
+            labels = ((label, label_value),) if label else ()
+            for key, value in values.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    samples.append((f"{prefix}_{key}", labels, value))
+    return samples
+
+def prometheus_text():
+    """Every histogram, counter, gauge and registered stats dict, in exposition format"""
+    lines = []
+
+    family = _metric_name("span_duration_seconds")
+    lines += [f"# HELP {family} Span and query latency by span name", f"# TYPE {family} histogram"]
+    for name, hist in sorted(all_histograms().items()):
+        snap = hist.snapshot()
+        cumulative = 0
+        for upper, bucket_count in zip(snap["buckets"] + ["+Inf"], snap["counts"]):
+            cumulative += bucket_count
+            le = upper if upper == "+Inf" else f"{upper / 1000:g}"
+            lines.append(f"{family}_bucket{_format_labels((('span', name), ('le', le)))} {cumulative}")
+        lines.append(f"{family}_sum{_format_labels((('span', name),))} {snap['sum'] / 1000:.6f}")
+        lines.append(f"{family}_count{_format_labels((('span', name),))} {snap['count']}")
+
+    with _metrics_lock:
+        counters = sorted(_counters.items())
+        gauges = list(_gauges.items())
+    # Series of one family must be contiguous
+    gauges = sorted(gauges + [((name, labels), value) for name, labels, value in _collected_samples()],
+                    key=lambda item: item[0])
+
+    seen = set()
+    for kind, items, suffix in (("counter", counters, "_total"), ("gauge", gauges, "")):
+        for (name, labels), value in items:
+            metric = _metric_name(name) + suffix
+            if metric not in seen:
+                seen.add(metric)
+                lines.append(f"# TYPE {metric} {kind}")
+            lines.append(f"{metric}{_format_labels(labels)} {_format_value(value)}")
+
+    return "\n".join(lines) + "\n"
+
+def start_metrics_server(port, host="0.0.0.0"):
+    """Serves /metrics from a daemon thread, for processes without a web app"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = prometheus_text().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
@@ -0,0 +1,234 @@
+"""
+Historical backfill for crypto_prices.
+
+Pulls CoinGecko market-chart ranges for many coins concurrently, stays
+inside a shared request budget, and checkpoints every finished chunk so
+an interrupted run resumes where it stopped. Each chunk is inserted
+column-wise, without the points already stored, so re-running (or
+overlapping with run_pipeline) never duplicates rows.
+
+    python backfill.py --days 30 --top 50
+    python backfill.py --coins bitcoin,solana --days 7 --workers 2
+
+Against the local mock server (no API key or quota needed):
+
+    python mock_coingecko.py --port 8765 &
+    COINGECKO_BASE_URL=http://127.0.0.1:8765 COINGECKO_API_KEY=mock python backfill.py --days 3 --top 5
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+# Allow import from API folder
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from API.fetch_api import get_session_with_retries, fetch_top_coin_ids, fetch_market_chart_range
+from Clickhouse_setup import get_clickhouse_client, setup_table, validate_dataframe
+from Profiling import query_settings
+
+logger = logging.getLogger(__name__)
+
+# ═══════════════════════════════════════════════════════════════
+# CONFIGURATION
+# ═══════════════════════════════════════════════════════════════
+# CoinGecko demo plan: 30 calls/minute; leave headroom for run_pipeline
+BACKFILL_REQUESTS_PER_MINUTE = int(os.getenv("BACKFILL_REQUESTS_PER_MINUTE", "25"))
+BACKFILL_CHECKPOINT = os.getenv("BACKFILL_CHECKPOINT", "backfill_checkpoint.json")
+# market_chart/range picks its granularity from the range length: 5-minute
+# points only within the last day, hourly up to 90 days, daily beyond. 90-day
+# chunks are the widest that still come back hourly.
+CHUNK_DAYS = 90
+# A backfilled point this close to a stored one is treated as the same sample
+DUPLICATE_WINDOW_SECONDS = 150
+
+COLUMNS = ["timestamp", "coin", "name", "price", "volume_24h", "market_cap", "change_24h"]
+
+EXISTING_QUERY = """
+    SELECT timestamp, price
+    FROM crypto_prices
+    WHERE coin = %s AND timestamp >= %s AND timestamp <= %s
+    ORDER BY timestamp
+"""
+
+# ═══════════════════════════════════════════════════════════════
+# RATE LIMIT & CHECKPOINT
+# ═══════════════════════════════════════════════════════════════
+class RateBudget:
+    """Evenly spaced request slots shared by all worker threads"""
+
+    def __init__(self, per_minute):
+        self.interval = 60.0 / per_minute
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        time.sleep(max(slot - now, 0))
+
+class Checkpoint:
+    """{coin id: end of the last inserted chunk (ISO)} persisted after every chunk"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            with open(path) as f:
+                self.done = json.load(f)
+        except FileNotFoundError:
+            self.done = {}
+
+    def resume_from(self, coin_id, default):
+        value = self.done.get(coin_id)
+        return max(datetime.fromisoformat(value), default) if value else default
+
+    def mark(self, coin_id, chunk_end):
+        with self.lock:
+            self.done[coin_id] = chunk_end.isoformat()
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.done, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+
+# ═══════════════════════════════════════════════════════════════
+# CHUNK PROCESSING
+# ═══════════════════════════════════════════════════════════════
+_local = threading.local()
+
+def thread_client():
+    """One ClickHouse client per worker thread (clients aren't shared across threads)"""
+    if getattr(_local, "client", None) is None:
+        _local.client = get_clickhouse_client()
+    return _local.client
+
+def prepare_chunk(df, existing):
+    """
+    Drops points already stored (within DUPLICATE_WINDOW_SECONDS) and
+    derives change_24h from the price 24h earlier, looked up in the
+    stored rows plus the chunk itself.
+    """
+    # merge_asof needs both sides on the same resolution
+    df["timestamp"] = df["timestamp"].astype("datetime64[ns]")
+    new_ts = df["timestamp"].to_numpy(dtype="datetime64[s]").astype(np.int64)
+    if len(existing):
+        old_ts = existing["timestamp"].to_numpy(dtype="datetime64[s]").astype(np.int64)
+        pos = np.searchsorted(old_ts, new_ts)
+        nearest = np.minimum(
+            np.abs(new_ts - old_ts[np.maximum(pos - 1, 0)]),
+            np.abs(new_ts - old_ts[np.minimum(pos, len(old_ts) - 1)])
+        )
+        df = df[nearest > DUPLICATE_WINDOW_SECONDS].reset_index(drop=True)
+    if df.empty:
+        return df
+
+    reference = pd.concat([existing[["timestamp", "price"]], df[["timestamp", "price"]]]) \
+        .sort_values("timestamp").drop_duplicates("timestamp")
+    lookup = pd.merge_asof(
+        pd.DataFrame({"timestamp": df["timestamp"] - pd.Timedelta(days=1)}),
+        reference.rename(columns={"price": "price_24h_ago"}),
+        on="timestamp", direction="backward"
+    )
+    change = (df["price"].to_numpy() / lookup["price_24h_ago"].to_numpy() - 1) * 100
+    df["change_24h"] = np.nan_to_num(change, nan=0.0, posinf=0.0, neginf=0.0)
+    return df[COLUMNS]
+
+def backfill_chunk(coin, start, end, session, budget):
+    """Fetches and inserts one chunk; returns the number of rows written"""
+    coin_id, symbol, name = coin
+    budget.wait()
+    df = fetch_market_chart_range(coin_id, symbol, name, start, end, session=session)
+    if df.empty:
+        return 0
+
+    client = thread_client()
+    existing = client.query_df(EXISTING_QUERY, parameters=[symbol, start - timedelta(days=1), end],
+                               settings=query_settings("backfill.existing"))
+    if existing.empty:
+        existing = pd.DataFrame({"timestamp": pd.Series(dtype="datetime64[ns]"), "price": pd.Series(dtype=float)})
+    existing["timestamp"] = pd.to_datetime(existing["timestamp"]).astype("datetime64[ns]")
+    df = prepare_chunk(df, existing)
+    if df.empty:
+        return 0
+
+    validate_dataframe(df)
+    client.insert_df(
+        "crypto_prices", df,
+        settings=query_settings(
+            "backfill.insert", insert_deduplication_token=f"backfill:{symbol}:{start:%Y%m%d%H%M}:{end:%Y%m%d%H%M}"
+        )
+    )
+    return len(df)
+
+def backfill_coin(coin, start, end, checkpoint, budget):
+    """Walks one coin's range oldest-first, so change_24h can see the previous day"""
+    coin_id, symbol, _ = coin
+    session = get_session_with_retries()
+    chunk_start = checkpoint.resume_from(coin_id, start)
+    inserted = 0
+    while chunk_start < end:
+        chunk_end = min(chunk_start + timedelta(days=CHUNK_DAYS), end)
+        inserted += backfill_chunk(coin, chunk_start, chunk_end, session, budget)
+        checkpoint.mark(coin_id, chunk_end)
+        chunk_start = chunk_end
+    logger.info(f"{symbol}: {inserted} rows backfilled")
+    return inserted
+
+def run(coins, days, workers, checkpoint_path, requests_per_minute):
+    end = datetime.utcnow().replace(second=0, microsecond=0)
+    start = end - timedelta(days=days)
+    checkpoint = Checkpoint(checkpoint_path)
+    budget = RateBudget(requests_per_minute)
+
+    setup_table(get_clickhouse_client())
+    logger.info(f"Backfilling {len(coins)} coins from {start} to {end} with {workers} workers")
+
+    total, failed = 0, []
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="backfill") as pool:
+        futures = {pool.submit(backfill_coin, coin, start, end, checkpoint, budget): coin for coin in coins}
+        for future in as_completed(futures):
+            coin = futures[future]
+            try:
+                total += future.result()
+            except Exception as e:
+                # Progress up to the failing chunk is checkpointed; a re-run resumes there
+                failed.append(coin[1])
+                logger.error(f"{coin[1]}: backfill stopped: {e}")
+
+    logger.info(f"Backfill finished: {total} rows inserted, {len(failed)} coins incomplete {failed or ''}")
+    return total, failed
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Backfill crypto_prices history from CoinGecko")
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--top", type=int, default=50, help="Top N coins by market cap")
+    parser.add_argument("--coins", help="Comma-separated CoinGecko ids instead of --top")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--requests-per-minute", type=int, default=BACKFILL_REQUESTS_PER_MINUTE)
+    parser.add_argument("--checkpoint", default=BACKFILL_CHECKPOINT)
+    args = parser.parse_args()
+
+    coins = fetch_top_coin_ids(max(args.top, 250) if args.coins else args.top)
+    if args.coins:
+        wanted = [c.strip() for c in args.coins.split(",") if c.strip()]
+        known = {coin[0]: coin for coin in coins}
+        coins = [known.get(coin_id, (coin_id, coin_id.upper(), coin_id.title())) for coin_id in wanted]
+    if not coins:
+        logger.error("No coins to backfill")
+        sys.exit(1)
+
+    _, failed = run(coins, args.days, args.workers, args.checkpoint, args.requests_per_minute)
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+import re
+import json
+import uuid
+import random
+import asyncio
+from types import SimpleNamespace
+from datetime import datetime, timedelta
+
+# Symbols the fake model "recognises" when deciding on tool calls
+KNOWN_SYMBOLS = ["BTC", "ETH", "SOL", "BNB", "XRP", "ADA", "AVAX", "DOGE", "LINK", "DOT"]
+
+CANNED_ANSWER = (
+    "**Verdict: Neutral**\n\n"
+    "**Current State:**\n"
+    "• Price: $68,808 (-2.61% vs MA7, -3.39% vs MA30)\n"
+    "• Trend: downtrend\n"
+    "• Volume: 0.55x normal (low conviction)\n"
+    "• Risk: Low volatility (1.51%)\n\n"
+    "**Key Levels:**\n"
+    "• Support: $68,000 (1.2% away)\n"
+    "• Resistance: $72,771 (5.76% away)\n\n"
+    "**Bottom Line:** Wait for a break above $70,650 with 1.5x+ volume before adding exposure."
+)
+
+# ═══════════════════════════════════════════════════════════════
+# FAKE GROQ CLIENT
+# ═══════════════════════════════════════════════════════════════
+class FakeAsyncGroq:
+    """
+    Drop-in stand-in for groq.AsyncGroq (only the calls GenAi makes).
+    Latencies and token rates are configurable so the load-test harness can
+    model a real deployment without spending Groq quota.
+
+    :param tool_choice_latency: Seconds for a non-streamed completion.
+    :param first_token_latency: Seconds before the first streamed chunk.
+    :param tokens_per_second: Streaming speed of the synthesis answer.
+    :param max_concurrency: Requests served at once; the rest queue, which
+        mimics Groq's per-key rate limiting.
+    :param jitter: Relative +/- randomisation applied to every latency.
+    """
+
+    def __init__(self, tool_choice_latency=0.35, first_token_latency=0.25,
+                 tokens_per_second=250, max_concurrency=50, jitter=0.2, answer=CANNED_ANSWER):
+        self.tool_choice_latency = tool_choice_latency
+        self.first_token_latency = first_token_latency
+        self.tokens_per_second = tokens_per_second
+        self.jitter = jitter
+        self.answer = answer
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.queue_wait_total = 0.0
+        self.requests = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def _latency(self, seconds):
+        return max(seconds * random.uniform(1 - self.jitter, 1 + self.jitter), 0)
+
+    async def _acquire(self):
+        loop = asyncio.get_running_loop()
+        queued_at = loop.time()
+        await self.semaphore.acquire()
+        self.queue_wait_total += loop.time() - queued_at
+        self.requests += 1
+
+    async def create(self, model, messages, tools=None, stream=False, **kwargs):
+        await self._acquire()
+        try:
+            if stream:
+                await asyncio.sleep(self._latency(self.first_token_latency))
+            else:
+                await asyncio.sleep(self._latency(self.tool_choice_latency))
+        finally:
+            self.semaphore.release()
+
+        prompt_tokens = sum(len(str(m.get("content", "")) if isinstance(m, dict) else "") for m in messages) // 4
+
+        if stream:
+            return FakeStream(self.answer, self.tokens_per_second, prompt_tokens)
+
+        user_text = next(
+            (m["content"] for m in reversed(messages) if isinstance(m, dict) and m.get("role") == "user"), ""
+        )
+        words = set(re.findall(r"[A-Z]+", user_text.upper()))
+        symbols = [s for s in KNOWN_SYMBOLS if s in words]
+
+        tool_calls = [
+            SimpleNamespace(
+                id=f"call_{uuid.uuid4().hex[:8]}",
+                type="function",
+                function=SimpleNamespace(name="fetch_crypto_analysis", arguments=json.dumps({"symbol": s}))
+            )
+            for s in symbols
+        ] if tools else []
+
+        message = SimpleNamespace(
+            role="assistant",
+            content=None if tool_calls else self.answer,
+            tool_calls=tool_calls or None
+        )
+        completion_tokens = 20 * len(tool_calls) if tool_calls else len(self.answer) // 4
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=message)],
+            usage=SimpleNamespace(
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                total_tokens=prompt_tokens + completion_tokens
+            )
+        )
+
+class FakeStream:
+    """Async iterator of Groq-shaped chunks, paced at tokens_per_second"""
+
+    def __init__(self, text, tokens_per_second, prompt_tokens):
+        # ~4 characters per token, like the real tokenizer on English text
+        self.pieces = [text[i:i + 4] for i in range(0, len(text), 4)]
+        self.delay = 1 / tokens_per_second if tokens_per_second else 0
+        self.prompt_tokens = prompt_tokens
+        self.response = SimpleNamespace(aclose=self._aclose)
+
+    async def _aclose(self):
+        return None
+
+    async def __aiter__(self):
+        for i, piece in enumerate(self.pieces):
+            if i and self.delay:
+                await asyncio.sleep(self.delay)
+            yield SimpleNamespace(
+                choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))],
+                x_groq=None
+            )
+        yield SimpleNamespace(
+            choices=[],
+            x_groq=SimpleNamespace(usage=SimpleNamespace(
+                prompt_tokens=self.prompt_tokens,
+                completion_tokens=len(self.pieces),
+                total_tokens=self.prompt_tokens + len(self.pieces)
+            ))
+        )
+
+# ═══════════════════════════════════════════════════════════════
+# FAKE CLICKHOUSE CLIENT
+# ═══════════════════════════════════════════════════════════════
+class FakeAsyncClickHouse:
+    """
+    Minimal async ClickHouse stand-in returning synthetic 5-minute history,
+    enough for Analytics_engine and GenAi's data-version query.
+    """
+
+    def __init__(self, query_latency=0.02, days=30, interval_minutes=5):
+        self.query_latency = query_latency
+        self.rows_per_coin = days * 24 * 60 // interval_minutes
+        self.interval = timedelta(minutes=interval_minutes)
+        self.queries = 0
+
+    def _latest_timestamp(self):
+        now = datetime.utcnow().replace(second=0, microsecond=0)
+        return now - timedelta(minutes=now.minute % 5)
+
+    async def query(self, query, parameters=None, settings=None):
+        self.queries += 1
+        await asyncio.sleep(self.query_latency)
+
+        if "max(timestamp)" in query:
+            return SimpleNamespace(result_rows=[[self._latest_timestamp()]], column_names=["max(timestamp)"])
+
+        symbol = str(parameters[0]) if parameters else "BTC"
+        rng = random.Random(symbol)
+        price = rng.uniform(0.1, 70000)
+        volume = price * rng.uniform(1e5, 1e7)
+        end = self._latest_timestamp()
+        rows = []
+        for i in range(self.rows_per_coin):
+            price *= 1 + rng.gauss(0, 0.002)
+            rows.append([
+                end - self.interval * (self.rows_per_coin - 1 - i),
+                price,
+                volume * rng.uniform(0.5, 1.5),
+                price * 19_000_000,
+                rng.uniform(-5, 5)
+            ])
+        return SimpleNamespace(
+            result_rows=rows,
+            column_names=["timestamp", "price", "volume_24h", "market_cap", "change_24h"]
+        )
+
+    async def query_df(self, query, parameters=None, settings=None):
+        """Columnar variant, as used by Analytics_engine's history fetch"""
+        import pandas as pd
+
+        result = await self.query(query, parameters, settings)
+        df = pd.DataFrame(result.result_rows, columns=result.column_names)
+        df["timestamp"] = df["timestamp"].astype("datetime64[ns]")
+        return df
+
+    def close(self):
+        return None
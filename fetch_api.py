@@ -6,6 +6,7 @@ from dotenv import load_dotenv
 import logging
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
+from Telemetry import span, count
 
 # Setup logging
 logging.basicConfig(
@@ -18,6 +19,9 @@ load_dotenv()
 
 API_KEY = os.getenv("COINGECKO_API_KEY")
 
+# Override to point the pipeline or the backfill at a mock server
+BASE_URL = os.getenv("COINGECKO_BASE_URL", "https://api.coingecko.com/api/v3")
+
 def get_session_with_retries():
     """
     Creates a requests session with automatic retry logic.
@@ -63,7 +67,7 @@ def fetch_crypto_data(top_n=50, coin_ids=None, timeout=15):
         logger.error("COINGECKO_API_KEY not found in environment variables")
         return pd.DataFrame()
     
-    url = "https://api.coingecko.com/api/v3/coins/markets"
+    url = f"{BASE_URL}/coins/markets"
     
     params = {
         "vs_currency": "usd",
@@ -84,9 +88,10 @@ def fetch_crypto_data(top_n=50, coin_ids=None, timeout=15):
     session = get_session_with_retries()
     
     try:
-        response = session.get(url, params=params, timeout=timeout)
-        response.raise_for_status()
-        data = response.json()
+        with span("pipeline.fetch", coins=top_n):
+            response = session.get(url, params=params, timeout=timeout)
+            response.raise_for_status()
+            data = response.json()
         
         # Validate response
         if not isinstance(data, list):
@@ -142,6 +147,9 @@ def fetch_crypto_data(top_n=50, coin_ids=None, timeout=15):
             "change_24h": float(coin.get("price_change_percentage_24h", 0))
         })
     
+    count("pipeline_rows_fetched", len(rows))
+    count("pipeline_rows_skipped", skipped)
+    
     if skipped > 0:
         logger.warning(f"Skipped {skipped} coins due to missing/invalid data")
     
@@ -158,6 +166,71 @@ def fetch_crypto_data(top_n=50, coin_ids=None, timeout=15):
     
     return df
 
+def fetch_top_coin_ids(top_n=50, session=None, timeout=15):
+    """
+    CoinGecko ids of the top coins by market cap, for endpoints keyed by id.
+    
+    :return: List of (id, SYMBOL, name) tuples; empty list on failure.
+    """
+    if not API_KEY:
+        logger.error("COINGECKO_API_KEY not found in environment variables")
+        return []
+    
+    session = session or get_session_with_retries()
+    params = {
+        "vs_currency": "usd",
+        "order": "market_cap_desc",
+        "per_page": min(top_n, 250),
+        "page": 1,
+        "x_cg_demo_api_key": API_KEY
+    }
+    
+    try:
+        response = session.get(f"{BASE_URL}/coins/markets", params=params, timeout=timeout)
+        response.raise_for_status()
+        return [(coin["id"], coin["symbol"].upper(), coin["name"]) for coin in response.json()]
+    except Exception as e:
+        logger.error(f"Failed to fetch coin ids: {str(e)}")
+        return []
+
+def fetch_market_chart_range(coin_id, symbol, name, start, end, session=None, timeout=30):
+    """
+    Historical prices, market caps and volumes for one coin between two
+    UTC datetimes (CoinGecko returns 5-minute points for ranges up to a day,
+    hourly up to 90 days and daily beyond).
+    
+    :return: DataFrame in the crypto_prices layout minus change_24h, sorted
+        by timestamp; empty DataFrame when the range has no data.
+    :raises requests.exceptions.RequestException: after retries are exhausted,
+        so callers can checkpoint and resume instead of skipping the range.
+    """
+    session = session or get_session_with_retries()
+    params = {
+        "vs_currency": "usd",
+        "from": int(start.replace(tzinfo=timezone.utc).timestamp()),
+        "to": int(end.replace(tzinfo=timezone.utc).timestamp()),
+        "x_cg_demo_api_key": API_KEY
+    }
+    
+    response = session.get(f"{BASE_URL}/coins/{coin_id}/market_chart/range", params=params, timeout=timeout)
+    response.raise_for_status()
+    data = response.json()
+    
+    if not data.get("prices"):
+        return pd.DataFrame()
+    
+    df = pd.DataFrame(data["prices"], columns=["ms", "price"])
+    for key, column in (("market_caps", "market_cap"), ("total_volumes", "volume_24h")):
+        values = dict(data.get(key) or [])
+        df[column] = df["ms"].map(values).fillna(0.0).astype(float)
+    
+    df["timestamp"] = pd.to_datetime(df["ms"], unit="ms")
+    df["coin"] = symbol.upper()
+    df["name"] = name
+    df = df.drop(columns="ms").sort_values("timestamp", ignore_index=True)
+    
+    return df[["timestamp", "coin", "name", "price", "volume_24h", "market_cap"]]
+
 if __name__ == "__main__":
     # Test fetching top 5 coins
     logger.info("--- Testing: Fetching Top 5 Coins ---")
@@ -0,0 +1,188 @@
+"""
+Offline load test for the chat path.
+
+Drives N concurrent simulated users through GenAi.get_mrcrypto_response (or
+the Main_app send_message rendering path) with fake Groq and ClickHouse
+clients, then reports throughput, latency percentiles and queueing.
+
+    python loadtest.py --users 200 --messages 5
+    python loadtest.py --users 50 --mode ui --tokens-per-second 120 --groq-concurrency 20
+"""
+import os
+import re
+import sys
+import time
+import random
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import GenAi
+from Analytics_engine import ANALYTICS_EXECUTOR
+from Telemetry import histogram_summary
+from Query_layer import QueryLayer
+from fake_groq import FakeAsyncGroq, FakeAsyncClickHouse, KNOWN_SYMBOLS
+
+QUESTIONS = [
+    "How is {sym} doing?",
+    "Should I buy {sym} right now?",
+    "What are the key support and resistance levels for {sym}?",
+    "Compare {sym} and {sym2}",
+    "Is {sym} volume unusual today?",
+    "What is the market mood?",
+]
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(int(round(q * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+def make_question(rng):
+    sym, sym2 = rng.sample(KNOWN_SYMBOLS, 2)
+    return rng.choice(QUESTIONS).format(sym=sym, sym2=sym2)
+
+# ═══════════════════════════════════════════════════════════════
+# ONE REQUEST PER MODE
+# ═══════════════════════════════════════════════════════════════
+async def run_genai_request(question, session_id):
+    """Consumes get_mrcrypto_response directly; returns (ttft, total)"""
+    started = time.perf_counter()
+    first_token = None
+    words = set(re.findall(r"[A-Z]+", question.upper()))
+    symbols = [s for s in KNOWN_SYMBOLS if s in words]
+    async for _ in GenAi.get_mrcrypto_response(question, symbols=symbols):
+        if first_token is None:
+            first_token = time.perf_counter()
+    finished = time.perf_counter()
+    return (first_token or finished) - started, finished - started
+
+async def run_ui_request(question, session_id):
+    """Same flow as Main_app.send_message (admission control included), minus the NiceGUI elements"""
+    import Main_app
+
+    started = time.perf_counter()
+    first_render = None
+
+    def render(_html):
+        nonlocal first_render
+        if first_render is None:
+            first_render = time.perf_counter()
+
+    mentioned = Main_app.extract_coin_symbols(question)
+    await Main_app.answer_chat(session_id, question, mentioned, render)
+    finished = time.perf_counter()
+    return (first_render or finished) - started, finished - started
+
+# ═══════════════════════════════════════════════════════════════
+# HARNESS
+# ═══════════════════════════════════════════════════════════════
+class LoadStats:
+    def __init__(self):
+        self.ttft = []
+        self.total = []
+        self.errors = 0
+        self.inflight = 0
+        self.peak_inflight = 0
+        self.peak_analytics_queue = 0
+
+async def simulated_user(user_id, args, stats, request_fn):
+    rng = random.Random(user_id)
+    await asyncio.sleep(rng.uniform(0, args.ramp_up))
+
+    for _ in range(args.messages):
+        stats.inflight += 1
+        stats.peak_inflight = max(stats.peak_inflight, stats.inflight)
+        try:
+            ttft, total = await request_fn(make_question(rng), f"user-{user_id}")
+            stats.ttft.append(ttft)
+            stats.total.append(total)
+        except Exception:
+            stats.errors += 1
+        finally:
+            stats.inflight -= 1
+
+        if args.think_time:
+            await asyncio.sleep(rng.expovariate(1 / args.think_time))
+
+async def sample_queues(stats, stop):
+    while not stop.is_set():
+        stats.peak_analytics_queue = max(stats.peak_analytics_queue, ANALYTICS_EXECUTOR._work_queue.qsize())
+        await asyncio.sleep(0.05)
+
+async def run(args):
+    fake_groq = FakeAsyncGroq(
+        tool_choice_latency=args.tool_choice_latency,
+        first_token_latency=args.first_token_latency,
+        tokens_per_second=args.tokens_per_second,
+        max_concurrency=args.groq_concurrency
+    )
+    fake_ch = FakeAsyncClickHouse(query_latency=args.db_latency)
+
+    async def fake_ch_factory():
+        return fake_ch
+
+    queries = QueryLayer(max_concurrency=args.db_concurrency, client_factory=fake_ch_factory)
+    GenAi.set_llm_client(fake_groq)
+    GenAi.set_clickhouse_client(queries)
+    # Without --cache every message reaches the LLM: no cache hits and no coalescing
+    GenAi.response_cache.enabled = args.cache
+
+    request_fn = run_ui_request if args.mode == "ui" else run_genai_request
+    stats = LoadStats()
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(sample_queues(stats, stop))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(simulated_user(i, args, stats, request_fn) for i in range(args.users)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await sampler
+
+    completed = len(stats.total)
+    print("=" * 60)
+    print(f"Mode: {args.mode} | users: {args.users} | messages/user: {args.messages}")
+    print(f"Completed: {completed} | errors: {stats.errors} | wall time: {elapsed:.1f}s")
+    print(f"Throughput: {completed / elapsed:.1f} req/s")
+    for label, values in (("TTFT", stats.ttft), ("Total", stats.total)):
+        print(
+            f"{label:>6}: p50={percentile(values, 0.50) * 1000:.0f}ms "
+            f"p95={percentile(values, 0.95) * 1000:.0f}ms "
+            f"p99={percentile(values, 0.99) * 1000:.0f}ms "
+            f"mean={statistics.mean(values) * 1000 if values else 0:.0f}ms"
+        )
+    print(f"Peak in-flight chats: {stats.peak_inflight}")
+    print(f"Groq calls: {fake_groq.requests} | avg queue wait: "
+          f"{fake_groq.queue_wait_total / max(fake_groq.requests, 1) * 1000:.0f}ms")
+    print(f"DB queries: {fake_ch.queries} | peak analytics queue depth: {stats.peak_analytics_queue}")
+    print(f"Response cache: {GenAi.response_cache.stats()}")
+    print(f"Query layer: {queries.stats()}")
+    if args.mode == "ui":
+        from Admission import chat_admission
+        print(f"Admission: {chat_admission.stats()}")
+    print("-" * 60)
+    for name, summary in sorted(histogram_summary().items()):
+        print(f"{name:<30} n={summary['count']:<6} p50={summary['p50_ms']:<8} "
+              f"p95={summary['p95_ms']:<8} p99={summary['p99_ms']}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline load test for the MrCrypto chat path")
+    parser.add_argument("--users", type=int, default=100, help="Concurrent simulated users")
+    parser.add_argument("--messages", type=int, default=3, help="Messages sent by each user")
+    parser.add_argument("--mode", choices=["genai", "ui"], default="genai")
+    parser.add_argument("--think-time", type=float, default=1.0, help="Mean seconds between a user's messages")
+    parser.add_argument("--ramp-up", type=float, default=2.0, help="Seconds over which users start")
+    parser.add_argument("--tool-choice-latency", type=float, default=0.35)
+    parser.add_argument("--first-token-latency", type=float, default=0.25)
+    parser.add_argument("--tokens-per-second", type=float, default=250)
+    parser.add_argument("--groq-concurrency", type=int, default=50, help="Simulated Groq rate limit")
+    parser.add_argument("--db-latency", type=float, default=0.02)
+    parser.add_argument("--db-concurrency", type=int, default=16, help="Query layer in-flight limit")
+    parser.add_argument("--cache", action="store_true", help="Keep the response cache and in-flight coalescing enabled")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
@@ -0,0 +1,125 @@
+"""
+Local stand-in for the two CoinGecko endpoints the pipeline and the
+backfill use, with deterministic synthetic data. Point fetch_api at it via
+COINGECKO_BASE_URL to exercise the backfill (rate limiting, retries,
+resume) without an API key or quota.
+
+    python mock_coingecko.py --port 8765 --coins 20 --fail-rate 0.1
+    COINGECKO_BASE_URL=http://127.0.0.1:8765 COINGECKO_API_KEY=mock python backfill.py --days 3 --top 5
+"""
+import json
+import math
+import random
+import argparse
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# Point spacing by range length, as CoinGecko's market_chart/range picks it
+GRANULARITY = ((86400, 300), (90 * 86400, 3600))
+DAILY_SECONDS = 86400
+
+def make_coins(count):
+    seeds = [("bitcoin", "btc", "Bitcoin", 60000.0), ("ethereum", "eth", "Ethereum", 3000.0),
+             ("solana", "sol", "Solana", 150.0), ("ripple", "xrp", "XRP", 0.6)]
+    coins = seeds[:count]
+    for i in range(len(coins), count):
+        coins.append((f"mockcoin-{i}", f"mc{i}", f"Mock Coin {i}", round(10.0 / (i + 1), 4)))
+    return coins
+
+def synthetic_price(base, index, epoch):
+    """Smooth, deterministic price so re-fetching a range returns identical points"""
+    t = epoch / 86400
+    return base * (1 + 0.05 * math.sin(t * 2 * math.pi + index) + 0.01 * math.sin(t * 97 + index * 3))
+
+class MockState:
+    def __init__(self, coins, fail_rate):
+        self.coins = coins
+        self.by_id = {coin[0]: (i, coin) for i, coin in enumerate(coins)}
+        self.fail_rate = fail_rate
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def markets(self, per_page):
+        now = datetime.now(timezone.utc).timestamp()
+        rows = []
+        for i, (coin_id, symbol, name, base) in enumerate(self.coins[:per_page]):
+            price = synthetic_price(base, i, now)
+            rows.append({
+                "id": coin_id, "symbol": symbol, "name": name,
+                "current_price": price,
+                "market_cap": price * 1e7 / (i + 1),
+                "total_volume": price * 1e5,
+                "price_change_percentage_24h": (price / synthetic_price(base, i, now - 86400) - 1) * 100,
+                "last_updated": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+            })
+        return rows
+
+    def market_chart_range(self, coin_id, start, end):
+        i, (_, _, _, base) = self.by_id[coin_id]
+        step = next((step for span, step in GRANULARITY if end - start <= span), DAILY_SECONDS)
+        epochs = range(start - start % step + step, end + 1, step)
+        prices = [[epoch * 1000, synthetic_price(base, i, epoch)] for epoch in epochs]
+        return {
+            "prices": prices,
+            "market_caps": [[ms, price * 1e7 / (i + 1)] for ms, price in prices],
+            "total_volumes": [[ms, price * 1e5] for ms, price in prices],
+        }
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        def send_json(self, status, payload, headers=None):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {key: values[0] for key, values in parse_qs(url.query).items()}
+            parts = [part for part in url.path.split("/") if part]
+            with state.lock:
+                state.requests += 1
+
+            if random.random() < state.fail_rate:
+                return self.send_json(429, {"error": "rate limited (injected)"}, {"Retry-After": "1"})
+
+            if parts == ["coins", "markets"]:
+                return self.send_json(200, state.markets(int(params.get("per_page", 100))))
+            if len(parts) == 4 and parts[0] == "coins" and parts[2:] == ["market_chart", "range"]:
+                if parts[1] not in state.by_id:
+                    return self.send_json(404, {"error": "coin not found"})
+                return self.send_json(200, state.market_chart_range(parts[1], int(params["from"]), int(params["to"])))
+            self.send_json(404, {"error": "unknown endpoint"})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a mock CoinGecko API for local testing")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--coins", type=int, default=20)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of requests answered with 429")
+    args = parser.parse_args()
+
+    state = MockState(make_coins(args.coins), args.fail_rate)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(state))
+    print(f"Mock CoinGecko on http://{args.host}:{args.port} ({args.coins} coins, fail rate {args.fail_rate})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Served {state.requests} requests")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Slow-query report by call site.
+
+Every query the app and the pipeline send carries a `mrcrypto-` query_id
+and a log_comment naming its call site (Profiling.query_settings). This
+groups ClickHouse's system.query_log by that site, slowest first, and
+names the slowest query of each so it can be looked up directly.
+
+With --trace-log (the app's TRACE_LOG_PATH), server time is joined per
+query_id with the latency the app measured. The difference is time spent
+outside ClickHouse: waiting for a query slot, network, and decoding.
+
+    python query_report.py --minutes 60 --limit 20
+    python query_report.py --trace-log traces.jsonl --flush
+"""
+import os
+import sys
+import json
+import argparse
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from AI_chatbot import get_clickhouse_client
+from Profiling import query_settings, QUERY_ID_PREFIX
+
+SITE_QUERY = """
+    SELECT
+        JSONExtractString(log_comment, 'site') AS site,
+        count() AS queries,
+        countIf(type != 'QueryFinish') AS failed,
+        quantile(0.5)(query_duration_ms) AS p50_ms,
+        quantile(0.95)(query_duration_ms) AS p95_ms,
+        max(query_duration_ms) AS max_ms,
+        sum(read_rows) AS read_rows,
+        sum(read_bytes) AS read_bytes,
+        max(memory_usage) AS peak_memory,
+        argMax(query_id, query_duration_ms) AS slowest_query_id
+    FROM system.query_log
+    WHERE event_time >= now() - INTERVAL %s MINUTE
+      AND type IN ('QueryFinish', 'ExceptionWhileProcessing', 'ExceptionBeforeStart')
+      AND startsWith(query_id, %s)
+    GROUP BY site
+    ORDER BY p95_ms DESC
+    LIMIT %s
+"""
+
+DURATION_QUERY = """
+    SELECT JSONExtractString(log_comment, 'site') AS site, query_id, query_duration_ms
+    FROM system.query_log
+    WHERE event_time >= now() - INTERVAL %s MINUTE
+      AND type = 'QueryFinish'
+      AND startsWith(query_id, %s)
+"""
+
+def load_client_latencies(path):
+    """{query_id: milliseconds measured by the app} from a TRACE_LOG_PATH file"""
+    latencies = {}
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry.get("query_id"):
+                latencies[entry["query_id"]] = entry["duration_ms"]
+    return latencies
+
+def client_overhead_by_site(client, minutes, latencies):
+    """{site: (matched queries, median app-side ms minus server ms)}"""
+    result = client.query(DURATION_QUERY, parameters=[minutes, QUERY_ID_PREFIX],
+                          settings=query_settings("report.durations"))
+    overheads = defaultdict(list)
+    for site, query_id, server_ms in result.result_rows:
+        if query_id in latencies:
+            overheads[site].append(latencies[query_id] - server_ms)
+    return {
+        site: (len(values), sorted(values)[len(values) // 2])
+        for site, values in overheads.items()
+    }
+
+def format_bytes(value):
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if value < 1024:
+            return f"{value:.0f} {unit}"
+        value /= 1024
+    return f"{value:.1f} TiB"
+
+def main():
+    parser = argparse.ArgumentParser(description="Slowest ClickHouse call sites from system.query_log")
+    parser.add_argument("--minutes", type=int, default=60, help="Look-back window")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--trace-log", help="App trace log (TRACE_LOG_PATH) to join on query_id")
+    parser.add_argument("--flush", action="store_true", help="SYSTEM FLUSH LOGS first (query_log lags a few seconds)")
+    args = parser.parse_args()
+
+    client = get_clickhouse_client()
+    if args.flush:
+        client.command("SYSTEM FLUSH LOGS", settings=query_settings("report.flush"))
+
+    rows = client.query(SITE_QUERY, parameters=[args.minutes, QUERY_ID_PREFIX, args.limit],
+                        settings=query_settings("report.sites")).result_rows
+    if not rows:
+        print(f"No tagged queries in the last {args.minutes} minutes")
+        return
+
+    overhead = {}
+    if args.trace_log:
+        overhead = client_overhead_by_site(client, args.minutes, load_client_latencies(args.trace_log))
+
+    print(f"\nSlowest call sites, last {args.minutes} minutes (by p95 server time)")
+    header = f"{'site':<32} {'queries':>8} {'failed':>6} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} {'read':>10} {'peak mem':>10}"
+    if overhead:
+        header += f" {'app-side +ms':>12}"
+    print(header)
+    print("-" * len(header))
+    for site, queries, failed, p50, p95, max_ms, _, read_bytes, peak_memory, _ in rows:
+        line = (f"{site or '(untagged)':<32} {queries:>8} {failed:>6} {p50:>8.0f} {p95:>8.0f} {max_ms:>8.0f} "
+                f"{format_bytes(read_bytes):>10} {format_bytes(peak_memory):>10}")
+        if overhead:
+            matched = overhead.get(site)
+            line += f" {matched[1]:>12.1f}" if matched else f" {'-':>12}"
+        print(line)
+
+    print("\nSlowest query per site (look up with: SELECT query FROM system.query_log WHERE query_id = '...')")
+    for row in rows:
+        print(f"  {row[0] or '(untagged)':<32} {row[-1]}")
+
+if __name__ == "__main__":
+    main()
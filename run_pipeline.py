@@ -1,6 +1,8 @@
+import os
 import time
 import logging
 from Clickhouse_setup import main
+from Telemetry import span, count, set_gauge, start_metrics_server
 
 logging.basicConfig(
     level=logging.INFO,
@@ -11,20 +13,45 @@ logger = logging.getLogger(__name__)
 # Run every 5 minutes (300 seconds)
 INTERVAL_SECONDS = 300
 
+# Prometheus /metrics for the pipeline (0 disables)
+PIPELINE_METRICS_PORT = int(os.getenv("PIPELINE_METRICS_PORT", "9101"))
+
+if PIPELINE_METRICS_PORT:
+    start_metrics_server(PIPELINE_METRICS_PORT)
+    logger.info(f"📊 Metrics on :{PIPELINE_METRICS_PORT}/metrics")
+
 logger.info("🚀 Crypto Pipeline Started - Running every 5 minutes")
 
+# Cycles run on a fixed schedule; lag is how late each one starts
+next_run = time.time()
+
 while True:
+    lag = max(time.time() - next_run, 0)
+    set_gauge("pipeline_schedule_lag_seconds", lag)
+    if lag >= INTERVAL_SECONDS:
+        # Overran by whole cycles: drop them rather than firing back-to-back
+        count("pipeline_missed_cycles", int(lag // INTERVAL_SECONDS))
+        next_run = time.time()
+    next_run += INTERVAL_SECONDS
     try:
         logger.info("=" * 50)
-        main()
-        logger.info(f"💤 Sleeping for {INTERVAL_SECONDS} seconds...")
-        
+        with span("pipeline.cycle"):
+            rows_inserted = main()
+        if rows_inserted:
+            count("pipeline_cycles", status="ok")
+            set_gauge("pipeline_last_success_timestamp_seconds", time.time())
+        else:
+            # Nothing landed (e.g. the API returned no data); not a success
+            count("pipeline_cycles", status="empty")
+        logger.info("💤 Sleeping until next cycle...")
+
     except KeyboardInterrupt:
         logger.info("👋 Pipeline stopped by user")
         break
-        
+
     except Exception as e:
+        count("pipeline_cycles", status="failed")
         logger.error(f"❌ Pipeline cycle failed: {e}")
-        logger.info(f"🔄 Retrying in {INTERVAL_SECONDS} seconds...")
-    
-    time.sleep(INTERVAL_SECONDS)
\ No newline at end of file
+        logger.info("🔄 Retrying at the next cycle...")
+
+    time.sleep(max(next_run - time.time(), 0))
@@ -0,0 +1,80 @@
+"""
+Multi-process web tier.
+
+Starts one market publisher (Shared_market.py) and N NiceGUI workers
+(Main_app.py with MARKET_SHM_ROLE=reader) on consecutive ports, and
+restarts any of them that exits. Workers share the publisher's memory-
+mapped market segment, so ClickHouse sees the same polling load as a
+single process however many cores are used.
+
+Each page keeps its state (and its websocket) in the worker that served
+it, so put the workers behind a load balancer with sticky sessions, e.g.
+nginx `upstream { ip_hash; server 127.0.0.1:8081; server 127.0.0.1:8082; ... }`.
+
+    python serve_workers.py --workers 4 --base-port 8081
+"""
+import os
+import sys
+import time
+import signal
+import argparse
+import subprocess
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, APP_DIR)
+from Shared_market import MARKET_SHM_PATH
+
+def spawn_publisher(env):
+    return subprocess.Popen([sys.executable, os.path.join(APP_DIR, "Shared_market.py")], env=env)
+
+def spawn_worker(env, port):
+    worker_env = dict(env, APP_PORT=str(port), MARKET_SHM_ROLE="reader", NICEGUI_RELOAD="false")
+    return subprocess.Popen([sys.executable, os.path.join(APP_DIR, "Main_app.py")], env=worker_env)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run MrCrypto as a shared-memory multi-process web tier")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--base-port", type=int, default=int(os.getenv("APP_PORT", "8081")))
+    parser.add_argument("--publisher-timeout", type=float, default=30.0,
+                        help="Seconds to wait for the shared segment before starting workers")
+    args = parser.parse_args()
+
+    env = dict(os.environ, MARKET_SHM_PATH=MARKET_SHM_PATH)
+    stopping = False
+
+    def stop(*_):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    processes = {"publisher": spawn_publisher(env)}
+    started = time.monotonic()
+    while not os.path.exists(MARKET_SHM_PATH) and time.monotonic() - started < args.publisher_timeout:
+        time.sleep(0.1)
+    # Workers attach lazily, so a slow publisher only delays live data, not boot
+    for i in range(args.workers):
+        processes[args.base_port + i] = spawn_worker(env, args.base_port + i)
+    print(f"Publisher writing {MARKET_SHM_PATH}; workers on ports "
+          f"{args.base_port}-{args.base_port + args.workers - 1}")
+
+    try:
+        while not stopping:
+            for key, proc in list(processes.items()):
+                if proc.poll() is not None:
+                    print(f"{'Publisher' if key == 'publisher' else f'Worker :{key}'} exited "
+                          f"({proc.returncode}), restarting")
+                    processes[key] = spawn_publisher(env) if key == "publisher" else spawn_worker(env, key)
+            time.sleep(1)
+    finally:
+        for proc in processes.values():
+            proc.terminate()
+        for proc in processes.values():
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+if __name__ == "__main__":
+    main()
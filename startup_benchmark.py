@@ -0,0 +1,82 @@
+"""
+Startup benchmark for the web app.
+
+Measures, in fresh interpreters:
+  1. how long `import Main_app` takes,
+  2. boot-to-first-byte: launching Main_app.py until GET / returns 200,
+  3. the latency of a second page load once the server is up.
+
+    python startup_benchmark.py --runs 3
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+import urllib.request
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def measure_import():
+    code = (
+        "import time, sys; sys.path.insert(0, %r); t = time.perf_counter(); "
+        "import Main_app; print(time.perf_counter() - t)" % APP_DIR
+    )
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+def fetch(url, timeout=2):
+    started = time.perf_counter()
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        response.read()
+        if response.status != 200:
+            raise RuntimeError(f"HTTP {response.status}")
+    return time.perf_counter() - started
+
+def measure_boot(port, timeout):
+    env = dict(os.environ, APP_PORT=str(port), NICEGUI_RELOAD="false")
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(APP_DIR, "Main_app.py")],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    url = f"http://127.0.0.1:{port}/"
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                fetch(url)
+                first_byte = time.perf_counter() - started
+                return first_byte, fetch(url)
+            except Exception:
+                time.sleep(0.05)
+        raise TimeoutError(f"App did not answer on {url} within {timeout}s")
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure MrCrypto web app startup time")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    args = parser.parse_args()
+
+    imports, boots, reloads = [], [], []
+    for run in range(1, args.runs + 1):
+        imports.append(measure_import())
+        boot, reload = measure_boot(args.port, args.timeout)
+        boots.append(boot)
+        reloads.append(reload)
+        print(f"Run {run}: import={imports[-1]:.3f}s first_byte={boot:.3f}s page_load={reload * 1000:.0f}ms")
+
+    print("-" * 60)
+    print(f"Median import:      {statistics.median(imports):.3f}s")
+    print(f"Median first byte:  {statistics.median(boots):.3f}s (target < 1s after process start)")
+    print(f"Median page load:   {statistics.median(reloads) * 1000:.0f}ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Ingestion and analytics benchmark over a Storage backend.
+
+Loads synthetic 5-minute history for N coins in day-sized batches, then
+times pipeline-sized inserts (one row per coin), and
+the reads the app makes: latest, screener, history, chart rollups and
+the full analytics per coin.
+
+Runs with no external services on the embedded backend (the default):
+
+    python storage_benchmark.py --coins 50 --days 30
+
+The same workload against ClickHouse goes to a scratch table that copies
+crypto_prices' schema and is dropped afterwards:
+
+    python storage_benchmark.py --backend clickhouse --table crypto_prices_bench
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from Storage import ClickHouseStorage, EmbeddedStorage
+from Market_data import CHART_RANGES, SORT_KEYS, bucket_seconds
+from Analytics_engine import get_crypto_analysis
+from Profiling import query_settings
+
+STEP_SECONDS = 300
+
+def synthetic_rows(coins, start, periods, rng, last_prices):
+    """`periods` 5-minute rows for every coin (random walk continuing from last_prices)"""
+    stamps = pd.date_range(start, periods=periods, freq=f"{STEP_SECONDS}s")
+    frames = []
+    for i, coin in enumerate(coins):
+        walk = np.exp(np.cumsum(rng.normal(0, 0.002, len(stamps))))
+        prices = last_prices[coin] * walk
+        last_prices[coin] = prices[-1]
+        frames.append(pd.DataFrame({
+            "timestamp": stamps,
+            "coin": coin,
+            "name": f"Coin {coin}",
+            "price": prices,
+            "volume_24h": prices * rng.uniform(1e5, 1e6, len(stamps)),
+            "market_cap": prices * 1e7 / (i + 1),
+            "change_24h": rng.normal(0, 3, len(stamps)),
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+def timed(timings, name, fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    timings[name].append((time.perf_counter() - started) * 1000)
+    return result
+
+def report(timings):
+    print(f"\n{'operation':<22} {'runs':>6} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}")
+    print("-" * 59)
+    for name, values in timings.items():
+        ordered = sorted(values)
+        p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+        print(f"{name:<22} {len(values):>6} {statistics.median(values):>9.2f} {p95:>9.2f} {ordered[-1]:>9.2f}")
+
+def make_storage(args):
+    if args.backend == "embedded":
+        return EmbeddedStorage(path=None)
+    storage = ClickHouseStorage(table=args.table)
+    storage.client.command(f"CREATE TABLE IF NOT EXISTS {args.table} AS crypto_prices",
+                           settings=query_settings("benchmark.create"))
+    storage.client.command(f"TRUNCATE TABLE {args.table}", settings=query_settings("benchmark.truncate"))
+    return storage
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ingestion and analytics on a storage backend")
+    parser.add_argument("--backend", choices=("embedded", "clickhouse"), default="embedded")
+    parser.add_argument("--table", default="crypto_prices_bench", help="Scratch table (clickhouse backend)")
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch table afterwards")
+    parser.add_argument("--coins", type=int, default=50)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--cycles", type=int, default=20, help="Pipeline-sized inserts after the bulk load")
+    parser.add_argument("--repeats", type=int, default=5, help="Runs of each read per coin")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    if args.backend == "clickhouse" and args.table == "crypto_prices":
+        parser.error("refusing to benchmark against the live crypto_prices table")
+
+    rng = np.random.default_rng(args.seed)
+    coins = [f"C{i:03d}" for i in range(args.coins)]
+    last_prices = {coin: float(rng.uniform(0.1, 50000)) for coin in coins}
+    storage = make_storage(args)
+    timings = defaultdict(list)
+
+    try:
+        # ─── Ingestion ────────────────────────────────────────
+        today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        bulk_rows, bulk_seconds = 0, 0.0
+        for day in range(args.days, 0, -1):
+            batch = synthetic_rows(coins, today - timedelta(days=day), 86400 // STEP_SECONDS, rng, last_prices)
+            started = time.perf_counter()
+            bulk_rows += timed(timings, "insert.day_batch", storage.insert, batch)
+            bulk_seconds += time.perf_counter() - started
+
+        for cycle in range(args.cycles):
+            stamp = today + timedelta(seconds=STEP_SECONDS * cycle)
+            rows = synthetic_rows(coins, stamp, 1, rng, last_prices)
+            timed(timings, "insert.pipeline_cycle", storage.insert, rows)
+
+        print(f"Backend: {args.backend}; {args.coins} coins x {args.days} days")
+        print(f"Bulk load: {bulk_rows:,} rows in {bulk_seconds:.2f}s "
+              f"({bulk_rows / max(bulk_seconds, 1e-9):,.0f} rows/s)")
+
+        # ─── Reads ────────────────────────────────────────────
+        for _ in range(args.repeats):
+            timed(timings, "data_version", storage.data_version)
+            timed(timings, "latest", storage.latest)
+            for sort_key in SORT_KEYS:
+                timed(timings, "screener", storage.screener, sort_key, 50)
+
+        for coin in coins:
+            for _ in range(args.repeats):
+                timed(timings, "history.30d", storage.history, coin, 30)
+                for range_key in ("1D", "7D", "30D"):
+                    timed(timings, f"rollup.{range_key}", storage.rollup,
+                          coin, bucket_seconds(range_key, "line"), CHART_RANGES[range_key])
+            analysis = timed(timings, "analytics.full", get_crypto_analysis, storage, coin)
+            if "error" in analysis:
+                raise RuntimeError(f"Analytics failed for {coin}: {analysis['error']}")
+
+        report(timings)
+    finally:
+        if args.backend == "clickhouse" and not args.keep:
+            storage.client.command(f"DROP TABLE IF EXISTS {args.table}", settings=query_settings("benchmark.drop"))
+        storage.close()
+
+if __name__ == "__main__":
+    main()
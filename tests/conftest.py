@@ -0,0 +1,15 @@
+import os
+import sys
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The app modules live flat at the repository root
+sys.path.insert(0, ROOT)
+
+# Deployed, fetch_api.py sits in an API/ folder next to the app
+# (`from API.fetch_api import ...`); here it is the same file at the root
+if "API" not in sys.modules:
+    package = types.ModuleType("API")
+    package.__path__ = [ROOT]
+    sys.modules["API"] = package
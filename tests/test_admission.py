@@ -0,0 +1,131 @@
+import asyncio
+
+import pytest
+
+from Admission import ChatAdmission, Overloaded, RateLimited
+
+
+def make_admission(**overrides):
+    options = dict(max_active=1, max_queue=10, queue_timeout=5, rate_per_minute=600, burst=100)
+    options.update(overrides)
+    return ChatAdmission(**options)
+
+
+def test_waiters_are_admitted_in_arrival_order():
+    admission = make_admission()
+    order, positions = [], {}
+
+    async def chat(name, hold):
+        async with admission.slot(name, on_position=lambda p: positions.setdefault(name, []).append(p)):
+            order.append(name)
+            await hold
+
+    async def scenario():
+        release = asyncio.get_running_loop().create_future()
+        first = asyncio.create_task(chat("a", release))
+        await asyncio.sleep(0)
+        others = []
+        for name in ("b", "c", "d"):
+            others.append(asyncio.create_task(chat(name, asyncio.sleep(0))))
+            await asyncio.sleep(0)
+        assert admission.stats()["queued"] == 3
+        release.set_result(None)
+        await asyncio.gather(first, *others)
+
+    asyncio.run(scenario())
+    assert order == ["a", "b", "c", "d"]
+    # d saw itself move up the line as the others were admitted
+    assert positions["d"] == [3, 2, 1]
+    assert admission.stats() == {"active": 0, "queued": 0, "admitted": 4, "shed": 0, "rate_limited": 0}
+
+
+def test_queue_timeout_sheds_and_frees_the_place_in_line():
+    admission = make_admission(queue_timeout=0.05)
+
+    async def scenario():
+        hold = asyncio.Event()
+
+        async def holder():
+            async with admission.slot("holder"):
+                await hold.wait()
+
+        task = asyncio.create_task(holder())
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded):
+            async with admission.slot("late"):
+                pass
+        assert admission.stats()["queued"] == 0
+        hold.set()
+        await task
+        # The slot is free again afterwards
+        async with admission.slot("next"):
+            assert admission.active == 1
+
+    asyncio.run(scenario())
+    assert admission.shed == 1
+    assert admission.active == 0
+
+
+def test_full_queue_sheds_immediately():
+    admission = make_admission(max_queue=1)
+
+    async def scenario():
+        hold = asyncio.Event()
+
+        async def chat(name):
+            async with admission.slot(name):
+                await hold.wait()
+
+        tasks = [asyncio.create_task(chat("a")), asyncio.create_task(chat("b"))]
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded):
+            async with admission.slot("c"):
+                pass
+        hold.set()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(scenario())
+    assert admission.stats()["shed"] == 1 and admission.stats()["admitted"] == 2
+
+
+def test_cancelled_waiter_does_not_leak_a_slot():
+    admission = make_admission()
+
+    async def scenario():
+        hold = asyncio.Event()
+
+        async def chat(name):
+            async with admission.slot(name):
+                await hold.wait()
+
+        holder = asyncio.create_task(chat("a"))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(chat("b"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        hold.set()
+        await holder
+
+    asyncio.run(scenario())
+    assert admission.stats()["active"] == 0 and admission.stats()["queued"] == 0
+
+
+def test_per_session_rate_limit():
+    admission = make_admission(max_active=10, rate_per_minute=1, burst=2)
+
+    async def scenario():
+        for _ in range(2):
+            async with admission.slot("spammy"):
+                pass
+        with pytest.raises(RateLimited) as raised:
+            async with admission.slot("spammy"):
+                pass
+        assert raised.value.retry_after > 0
+        # Other sessions have their own bucket
+        async with admission.slot("polite"):
+            pass
+
+    asyncio.run(scenario())
+    assert admission.rate_limited == 1
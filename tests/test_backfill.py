@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from backfill import CHUNK_DAYS, COLUMNS, prepare_chunk
+from mock_coingecko import MockState, make_coins
+
+
+def fetched(stamps, prices):
+    return pd.DataFrame({
+        "timestamp": pd.to_datetime(stamps),
+        "coin": "BTC", "name": "Bitcoin",
+        "price": prices,
+        "volume_24h": 1.0, "market_cap": 1.0,
+    })
+
+
+def stored(stamps, prices):
+    return pd.DataFrame({"timestamp": pd.to_datetime(stamps).astype("datetime64[ns]"), "price": prices})
+
+
+def test_points_near_stored_ones_are_dropped():
+    existing = stored(["2024-01-02 00:00:00", "2024-01-02 01:00:00"], [100.0, 101.0])
+    df = fetched(
+        ["2024-01-02 00:01:00", "2024-01-02 00:30:00", "2024-01-02 00:57:31", "2024-01-02 02:00:00"],
+        [1.0, 2.0, 3.0, 4.0],
+    )
+    out = prepare_chunk(df, existing)
+    # 00:01 and 00:57:31 are within DUPLICATE_WINDOW_SECONDS (150s) of a stored point
+    assert out["price"].tolist() == [2.0, 4.0]
+    assert list(out.columns) == COLUMNS
+
+
+def test_rerunning_a_chunk_inserts_nothing():
+    df = fetched(pd.date_range("2024-01-01", periods=48, freq="h"), np.linspace(100, 147, 48))
+    first = prepare_chunk(df.copy(), stored([], []))
+    assert len(first) == 48
+    again = prepare_chunk(df.copy(), first[["timestamp", "price"]])
+    assert again.empty
+
+
+def test_change_24h_uses_stored_and_chunk_prices():
+    existing = stored(["2024-01-01 00:00:00"], [100.0])
+    df = fetched(["2024-01-01 12:00:00", "2024-01-02 00:00:00", "2024-01-02 12:00:00"], [90.0, 110.0, 99.0])
+    out = prepare_chunk(df, existing)
+    # 00:00 on the 2nd compares with the stored row, 12:00 with the chunk's own row; the first has no reference
+    assert out["change_24h"].tolist() == pytest.approx([0.0, 10.0, 10.0])
+
+
+def test_mixed_timestamp_resolutions_are_aligned():
+    existing = stored(["2024-01-01 00:00:00"], [100.0])
+    df = fetched(["2024-01-02 00:00:00"], [120.0])
+    df["timestamp"] = df["timestamp"].astype("datetime64[ms]")
+    out = prepare_chunk(df, existing)
+    assert out["change_24h"].tolist() == pytest.approx([20.0])
+
+
+def test_mock_serves_hourly_points_for_a_full_chunk():
+    state = MockState(make_coins(1), fail_rate=0)
+    start = 1_700_000_000
+    chunk = state.market_chart_range("bitcoin", start, start + CHUNK_DAYS * 86400)["prices"]
+    assert chunk[1][0] - chunk[0][0] == 3600 * 1000
+    day = state.market_chart_range("bitcoin", start, start + 86400)["prices"]
+    assert day[1][0] - day[0][0] == 300 * 1000
@@ -0,0 +1,87 @@
+import asyncio
+import math
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+import Market_data
+from Market_data import (
+    CANDLE_BUDGET, MAX_SERVER_BUCKETS, MIN_BUCKET_SECONDS,
+    ChartCache, bucket_seconds, build_series, lttb,
+)
+
+
+def test_lttb_keeps_endpoints_and_meets_the_budget():
+    xs = list(range(10_000))
+    ys = [math.sin(x / 50) for x in xs]
+    kept = lttb(xs, ys, 500)
+    assert len(kept) == 500
+    assert kept[0] == 0 and kept[-1] == len(xs) - 1
+    assert kept == sorted(set(kept))
+
+
+def test_lttb_keeps_a_lone_spike():
+    ys = [1.0] * 1000
+    ys[637] = 50.0
+    assert 637 in lttb(list(range(1000)), ys, 20)
+
+
+def test_lttb_returns_everything_under_budget():
+    assert lttb([0, 1, 2], [3, 4, 5], 10) == [0, 1, 2]
+    assert lttb(list(range(5)), [0] * 5, 2) == list(range(5))
+
+
+def test_bucket_seconds_respects_budgets_and_floor():
+    assert bucket_seconds("1D", "line") == MIN_BUCKET_SECONDS
+    assert 365 * 86400 / bucket_seconds("1Y", "line") <= MAX_SERVER_BUCKETS
+    assert 30 * 86400 / bucket_seconds("30D", "candles") <= CANDLE_BUDGET
+
+
+def test_all_range_buckets_follow_the_stored_span():
+    three_years = 3 * 365 * 86400
+    assert three_years / bucket_seconds("All", "line", three_years) <= MAX_SERVER_BUCKETS
+    assert three_years / bucket_seconds("All", "candles", three_years) <= CANDLE_BUDGET
+    # A few hours of history still gets 5-minute buckets, not one daily bar
+    assert bucket_seconds("All", "candles", 6 * 3600) == MIN_BUCKET_SECONDS
+    assert bucket_seconds("All", "line", 0) == MIN_BUCKET_SECONDS
+
+
+def ohlc_frame(points):
+    stamps = pd.date_range("2024-01-01", periods=points, freq="300s")
+    close = np.linspace(100, 200, points)
+    return pd.DataFrame({"bucket": stamps, "open": close, "high": close + 1, "low": close - 1, "close": close})
+
+
+def test_build_series_line_is_thinned_to_the_pixel_budget():
+    series = build_series(ohlc_frame(2000), "line", pixel_budget=300)
+    assert len(series["timestamps"]) == len(series["prices"]) == 300
+    assert series["timestamps"][0] == "2024-01-01T00:00:00"
+    assert series["prices"][-1] == 200.0
+
+
+def test_build_series_candles_keep_every_bucket():
+    series = build_series(ohlc_frame(50), "candles")
+    assert set(series) == {"timestamps", "open", "high", "low", "close"}
+    assert len(series["close"]) == 50
+    assert build_series(ohlc_frame(0), "line") == {"timestamps": [], "prices": []}
+
+
+def test_all_range_load_sizes_buckets_from_stored_span(monkeypatch):
+    calls = []
+
+    class FakeQueryLayer:
+        async def query(self, query, parameters=None, site=None):
+            calls.append(("span", parameters))
+            return SimpleNamespace(result_rows=[[2 * 365 * 86400]])
+
+        async def query_df(self, query, parameters=None, site=None):
+            calls.append(("chart", parameters))
+            return ohlc_frame(10)
+
+    monkeypatch.setattr(Market_data, "query_layer", FakeQueryLayer())
+    series = asyncio.run(ChartCache().get_series("btc", "All", "candles"))
+
+    assert len(series["close"]) == 10
+    assert calls[0] == ("span", ["BTC"])
+    assert calls[1] == ("chart", [bucket_seconds("All", "candles", 2 * 365 * 86400), "BTC"])
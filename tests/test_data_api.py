@@ -0,0 +1,70 @@
+import asyncio
+import json
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from starlette.requests import Request
+
+import Data_api
+import Market_data
+from Market_data import ChartCache, market_snapshot
+
+
+def make_request():
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": [], "query_string": b""})
+
+
+def test_history_etag_matches_the_version_the_series_was_loaded_for(monkeypatch):
+    before, after = datetime(2024, 1, 1, 0, 0), datetime(2024, 1, 1, 0, 5)
+    monkeypatch.setattr(market_snapshot, "rows", {"BTC": {"coin": "BTC", "timestamp": before}})
+    monkeypatch.setattr(Data_api, "chart_cache", ChartCache())
+    monkeypatch.setattr(Data_api, "body_cache", Data_api.BodyCache())
+    closes = iter([1.0, 2.0])
+
+    class IngestDuringLoad:
+        async def query_df(self, query, parameters=None, site=None):
+            price = next(closes)
+            # A new ingest lands while the first load is in flight
+            market_snapshot.rows = {"BTC": {"coin": "BTC", "timestamp": after}}
+            stamps = pd.date_range("2024-01-01", periods=3, freq="300s")
+            return pd.DataFrame({"bucket": stamps, **{c: np.full(3, price) for c in ("open", "high", "low", "close")}})
+
+    monkeypatch.setattr(Market_data, "query_layer", IngestDuringLoad())
+
+    first = asyncio.run(Data_api.api_history(make_request(), "btc", range_key="1D", mode="line"))
+    second = asyncio.run(Data_api.api_history(make_request(), "btc", range_key="1D", mode="line"))
+
+    assert json.loads(first.body)["prices"] == [1.0, 1.0, 1.0]
+    assert json.loads(second.body)["prices"] == [2.0, 2.0, 2.0]
+    assert first.headers["ETag"] != second.headers["ETag"]
+    assert ("history", "BTC", "1D", "line", before, "json") in Data_api.body_cache.entries
+
+
+def test_etag_matches_compares_whole_entity_tags():
+    etag = '"abc123"'
+    assert Data_api.etag_matches('"abc123"', etag)
+    assert Data_api.etag_matches('"zzz", W/"abc123"', etag)
+    assert Data_api.etag_matches("*", etag)
+    assert not Data_api.etag_matches(None, etag)
+    assert not Data_api.etag_matches('"abc1234"', etag)
+    assert not Data_api.etag_matches('"xabc123", "abc"', etag)
+
+
+def test_encode_json_writes_non_finite_floats_as_null():
+    body = Data_api.encode_json({"rsi": float("nan"), "prices": [1.0, np.float64("inf"), -float("inf")]})
+
+    assert json.loads(body) == {"rsi": None, "prices": [1.0, None, None]}
+    assert b"NaN" not in body and b"Infinity" not in body
+
+
+def test_cached_response_serves_arrow_when_asked(monkeypatch):
+    import pyarrow as pa
+
+    monkeypatch.setattr(Data_api, "body_cache", Data_api.BodyCache())
+    request = Request({"type": "http", "method": "GET", "path": "/", "headers": [], "query_string": b"format=arrow"})
+
+    response = Data_api.cached_response(request, ("test",), lambda: {}, lambda: {"coin": ["BTC"], "price": [1.5]})
+
+    assert response.media_type == Data_api.ARROW_MEDIA_TYPE
+    assert pa.ipc.open_stream(response.body).read_all().to_pydict() == {"coin": ["BTC"], "price": [1.5]}
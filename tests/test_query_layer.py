@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+from clickhouse_connect.driver.exceptions import DatabaseError, OperationalError
+
+from Query_layer import QueryLayer
+
+
+class FlakyClient:
+    """Sync close(), like clickhouse-connect 0.7's AsyncClient"""
+
+    def __init__(self, name, failures):
+        self.name = name
+        self.failures = failures
+        self.closed = False
+        self.query_ids = []
+
+    async def query(self, query, parameters=None, settings=None):
+        self.query_ids.append(settings["query_id"])
+        if self.failures:
+            error = self.failures.pop(0)
+            raise error
+        return self.name
+
+    def close(self):
+        self.closed = True
+
+
+def make_layer(failures_per_client, retries=1):
+    clients = []
+
+    async def factory():
+        failures = failures_per_client[len(clients)] if len(clients) < len(failures_per_client) else []
+        clients.append(FlakyClient(f"client-{len(clients)}", list(failures)))
+        return clients[-1]
+
+    return QueryLayer(max_concurrency=4, timeout=5, retries=retries, client_factory=factory), clients
+
+
+def test_connection_error_reconnects_and_retries():
+    layer, clients = make_layer([[OperationalError("connection reset")]])
+
+    async def scenario():
+        result = await layer.query("SELECT 1", site="test.reconnect")
+        await layer.close()
+        return result
+
+    assert asyncio.run(scenario()) == "client-1"
+    assert len(clients) == 2
+    assert clients[0].closed and clients[1].closed
+    # The retry runs under a fresh query_id
+    assert clients[0].query_ids[0] != clients[1].query_ids[0]
+    stats = layer.stats()["test.reconnect"]
+    assert stats["retries"] == 1 and stats["errors"] == 0
+
+
+def test_gives_up_after_the_retry_budget():
+    layer, clients = make_layer([[OperationalError("down")], [OperationalError("still down")]])
+
+    with pytest.raises(OperationalError):
+        asyncio.run(layer.query("SELECT 1", site="test.down"))
+    assert len(clients) == 2
+    assert layer.stats()["test.down"]["errors"] == 1
+
+
+def test_sql_errors_are_not_retried():
+    layer, clients = make_layer([[DatabaseError("Unknown identifier")]])
+
+    with pytest.raises(DatabaseError):
+        asyncio.run(layer.query("SELECT nope", site="test.sql"))
+    assert len(clients) == 1 and not clients[0].closed
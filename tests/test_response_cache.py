@@ -0,0 +1,187 @@
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import GenAi
+from GenAi import ResponseCache
+from Telemetry import request_id_var
+
+
+class VersionClient:
+    """Answers the data-version query with the newest ingest it was told about"""
+
+    def __init__(self):
+        self.version = datetime(2024, 1, 1)
+
+    async def query(self, query, parameters=None, settings=None):
+        assert "max(timestamp)" in query
+        return SimpleNamespace(result_rows=[[self.version]])
+
+
+async def collect(gen):
+    return "".join([part async for part in gen])
+
+
+def install_fake_stream(monkeypatch, fail=False, tool_failed=False):
+    calls = []
+
+    async def fake_stream_answer(user_input, symbols, skip_tool_choice, status=None):
+        calls.append(user_input)
+        await asyncio.sleep(0.05)
+        if fail and len(calls) == 1:
+            raise RuntimeError("groq down")
+        if status is not None:
+            status["tool_failed"] = tool_failed
+        yield "BTC is "
+        await asyncio.sleep(0.01)
+        yield "up."
+
+    monkeypatch.setattr(GenAi, "stream_answer", fake_stream_answer)
+    monkeypatch.setattr(GenAi, "response_cache", ResponseCache(max_entries=8, ttl_seconds=60))
+    monkeypatch.setattr(GenAi, "_ch_client", VersionClient())
+    return calls
+
+
+def test_identical_concurrent_questions_share_one_llm_call(monkeypatch):
+    calls = install_fake_stream(monkeypatch)
+
+    async def scenario():
+        return await asyncio.gather(*(
+            collect(GenAi.get_mrcrypto_response("How is BTC doing?")) for _ in range(5)
+        ))
+
+    answers = asyncio.run(scenario())
+    cache = GenAi.response_cache
+    assert answers == ["BTC is up."] * 5
+    assert len(calls) == 1
+    assert cache.coalesced == 4
+    assert cache.inflight == {}
+
+
+def test_normalised_question_is_served_from_cache_afterwards(monkeypatch):
+    calls = install_fake_stream(monkeypatch)
+
+    async def scenario():
+        first = await collect(GenAi.get_mrcrypto_response("How is BTC doing?"))
+        second = await collect(GenAi.get_mrcrypto_response("how is btc doing"))
+        return first, second
+
+    assert asyncio.run(scenario()) == ("BTC is up.", "BTC is up.")
+    assert len(calls) == 1
+    assert GenAi.response_cache.hits == 1
+
+
+def test_request_id_does_not_leak_into_the_callers_task(monkeypatch):
+    install_fake_stream(monkeypatch)
+    seen = []
+
+    async def page_handler():
+        async for _ in GenAi.get_mrcrypto_response("How is BTC doing?"):
+            seen.append(request_id_var.get())
+        return request_id_var.get()
+
+    assert asyncio.run(page_handler()) is None
+    assert seen and seen[0] is not None
+
+
+def test_answers_without_symbols_expire_on_ingest(monkeypatch):
+    calls = install_fake_stream(monkeypatch)
+
+    async def ask():
+        return await collect(GenAi.get_mrcrypto_response("Top gainer right now?"))
+
+    asyncio.run(ask())
+    asyncio.run(ask())
+    assert len(calls) == 1
+    GenAi._ch_client.version += timedelta(minutes=5)
+    asyncio.run(ask())
+    assert len(calls) == 2
+
+
+def test_disabled_cache_bypasses_lookup_and_coalescing(monkeypatch):
+    calls = install_fake_stream(monkeypatch)
+    GenAi.response_cache.enabled = False
+
+    async def scenario():
+        return await asyncio.gather(*(
+            collect(GenAi.get_mrcrypto_response("How is BTC doing?")) for _ in range(3)
+        ))
+
+    assert asyncio.run(scenario()) == ["BTC is up."] * 3
+    assert len(calls) == 3
+    stats = GenAi.response_cache.stats()
+    assert stats["entries"] == stats["coalesced"] == stats["hits"] == 0
+
+
+def test_followers_answer_themselves_when_the_leader_fails(monkeypatch):
+    calls = install_fake_stream(monkeypatch, fail=True)
+
+    async def scenario():
+        return await asyncio.gather(
+            collect(GenAi.get_mrcrypto_response("How is BTC doing?")),
+            collect(GenAi.get_mrcrypto_response("How is BTC doing?")),
+        )
+
+    leader, follower = asyncio.run(scenario())
+    assert "groq down" in leader
+    assert follower == "BTC is up."
+    assert len(calls) == 2
+    assert GenAi.response_cache.coalesced == 0
+    assert GenAi.response_cache.inflight == {}
+
+
+def test_answers_built_on_failed_tool_calls_are_not_cached(monkeypatch):
+    calls = install_fake_stream(monkeypatch, tool_failed=True)
+
+    async def scenario():
+        together = await asyncio.gather(*(
+            collect(GenAi.get_mrcrypto_response("How is BTC doing?")) for _ in range(2)
+        ))
+        later = await collect(GenAi.get_mrcrypto_response("How is BTC doing?"))
+        return together, later
+
+    together, later = asyncio.run(scenario())
+    # Concurrent followers still share the answer, but nothing is kept
+    assert together == ["BTC is up."] * 2
+    assert len(calls) == 2
+    assert GenAi.response_cache.entries == {}
+    assert GenAi.response_cache.get_stale("How is BTC doing?", None) is None
+
+
+def test_run_tool_calls_reports_failed_payloads(monkeypatch):
+    monkeypatch.setattr(GenAi, "_ch_client", object())
+    monkeypatch.setattr(GenAi, "serialize_tool_payload", lambda data, budget: str(data))
+
+    async def analysis(data=None, error=None):
+        if error:
+            raise error
+        return data
+
+    async def scenario(**prefetched):
+        tasks = {sym: asyncio.ensure_future(coro) for sym, coro in prefetched.items()}
+        return await GenAi.run_tool_calls([], tasks, skip_tool_choice=True)
+
+    _, _, failed = asyncio.run(scenario(BTC=analysis(error=RuntimeError("timeout"))))
+    assert failed
+    messages, _, failed = asyncio.run(scenario(BTC=analysis(data=None)))
+    assert failed and "not found" in messages[-1]["content"]
+    _, _, failed = asyncio.run(scenario(BTC=analysis(data={"symbol": "BTC", "price": 1.0})))
+    assert not failed
+
+
+def test_entries_expire_and_evict_least_recently_used(monkeypatch):
+    cache = ResponseCache(max_entries=2, ttl_seconds=60)
+    now = [1000.0]
+    monkeypatch.setattr(GenAi.time, "monotonic", lambda: now[0])
+
+    a, b, c = (cache.make_key(q, ["BTC"], 1) for q in ("a", "b", "c"))
+    cache.put(a, "A")
+    cache.put(b, "B")
+    assert cache.get(a) == "A"  # a is now most recent
+    cache.put(c, "C")
+    assert cache.get(b) is None
+    assert cache.get(a) == "A"
+
+    now[0] += 61
+    assert cache.get(c) is None
+    assert cache.get_stale("c", ["BTC"]) == "C"
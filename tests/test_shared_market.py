@@ -0,0 +1,78 @@
+import sys
+import asyncio
+import threading
+from datetime import datetime, timedelta
+
+from Shared_market import SharedMarketReader, SharedMarketWriter
+
+
+def snapshot(coins, price, version):
+    rows = {
+        coin: {"name": coin.title(), "timestamp": version, "price": price,
+               "volume_24h": price, "market_cap": price, "change_24h": 0.0}
+        for coin in coins
+    }
+    series = {coin: ([version.timestamp()] * 3, [price] * 3) for coin in coins}
+    return rows, version, series
+
+
+def test_reader_never_sees_a_torn_snapshot(tmp_path):
+    # Switch threads as often as possible so reads land mid-publish
+    old_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+
+    path = str(tmp_path / "market")
+    writer = SharedMarketWriter(path=path, max_coins=64, points=8)
+    small_version, large_version = datetime(2024, 1, 1), datetime(2024, 1, 1) + timedelta(minutes=5)
+    small = snapshot([f"S{i}" for i in range(3)], 1.0, small_version)
+    large = snapshot([f"L{i}" for i in range(40)], 2.0, large_version)
+    expected = {small_version: (3, 1.0), large_version: (40, 2.0)}
+    writer.publish(*small)
+
+    stop = threading.Event()
+
+    def publish_loop():
+        while not stop.is_set():
+            writer.publish(*large)
+            writer.publish(*small)
+
+    reader = SharedMarketReader(path=path)
+    seen, torn = set(), []
+    thread = threading.Thread(target=publish_loop)
+    thread.start()
+    try:
+        for _ in range(3000):
+            version, rows = asyncio.run(reader.load())
+            size, price = expected[version]
+            seen.add(version)
+            if len(rows) != size or any(row["price"] != price for row in rows.values()):
+                torn.append((version, len(rows)))
+            series = reader.series("L0", "1D", "line")
+            if series is not None and set(series["prices"]) != {2.0}:
+                torn.append(("series", series["prices"]))
+    finally:
+        stop.set()
+        thread.join()
+        sys.setswitchinterval(old_interval)
+        writer.close()
+
+    assert torn == []
+    assert seen == {small_version, large_version}
+
+
+def test_reader_waits_for_the_first_publish(tmp_path):
+    path = str(tmp_path / "market")
+    reader = SharedMarketReader(path=path)
+    assert asyncio.run(reader.load()) == (None, None)
+
+    writer = SharedMarketWriter(path=path, max_coins=8, points=4)
+    try:
+        assert asyncio.run(reader.load()) == (None, None)
+        writer.publish(*snapshot(["BTC"], 5.0, datetime(2024, 1, 1)))
+        version, rows = asyncio.run(reader.load())
+        assert version == datetime(2024, 1, 1)
+        assert rows["BTC"]["price"] == 5.0
+        assert reader.series("btc", "1D", "line")["prices"] == [5.0, 5.0, 5.0]
+        assert reader.series("btc", "7D", "line") is None
+    finally:
+        writer.close()
@@ -0,0 +1,82 @@
+import os
+import subprocess
+import sys
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+import Clickhouse_setup
+import Storage
+from Storage import EmbeddedStorage, StorageBackend, get_storage
+
+
+def market_rows(when, prices):
+    return pd.DataFrame({
+        "timestamp": [when] * len(prices),
+        "coin": list(prices),
+        "name": [coin.title() for coin in prices],
+        "price": list(prices.values()),
+        "volume_24h": 1e9, "market_cap": 1e11, "change_24h": 0.5,
+    })
+
+
+def test_backends_must_implement_the_whole_interface():
+    with pytest.raises(TypeError):
+        StorageBackend()
+
+    class InsertOnly(StorageBackend):
+        def insert(self, df, site="storage.insert"):
+            return len(df)
+
+    with pytest.raises(TypeError):
+        InsertOnly()
+
+
+def test_embedded_backend_never_builds_a_clickhouse_client(monkeypatch):
+    def no_server():
+        raise AssertionError("ClickHouse client built for the embedded backend")
+
+    monkeypatch.setattr(Storage, "STORAGE_BACKEND", "embedded")
+    assert isinstance(get_storage(client_factory=no_server), EmbeddedStorage)
+    with pytest.raises(ValueError):
+        get_storage("sqlite")
+
+
+def test_pipeline_inserts_through_the_configured_storage(monkeypatch, tmp_path):
+    path = str(tmp_path / "prices.pkl")
+    when = datetime.utcnow().replace(microsecond=0)
+    monkeypatch.setattr(Clickhouse_setup, "get_storage", lambda client_factory=None: EmbeddedStorage(path=path))
+    monkeypatch.setattr(Clickhouse_setup, "fetch_crypto_data",
+                        lambda top_n: market_rows(when, {"BTC": 42000.0, "ETH": 2200.0}))
+
+    assert Clickhouse_setup.main() == 2
+
+    # close() at the end of the cycle persisted the rows
+    reopened = EmbeddedStorage(path=path)
+    latest = reopened.latest()
+    assert {coin: row["price"] for coin, row in latest.items()} == {"BTC": 42000.0, "ETH": 2200.0}
+    assert reopened.data_version() == when
+
+
+def test_pipeline_reports_zero_rows_for_an_empty_fetch(monkeypatch, tmp_path):
+    monkeypatch.setattr(Clickhouse_setup, "get_storage",
+                        lambda client_factory=None: EmbeddedStorage(path=str(tmp_path / "prices.pkl")))
+    monkeypatch.setattr(Clickhouse_setup, "fetch_crypto_data", lambda top_n: pd.DataFrame())
+    assert Clickhouse_setup.main() == 0
+
+
+def test_pipeline_imports_stay_clear_of_the_web_app():
+    # Deployed, the pipeline and the app live in different folders
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    script = (
+        "import sys, types\n"
+        f"sys.path.insert(0, {root!r})\n"
+        "api = types.ModuleType('API'); api.__path__ = sys.path[:1]; sys.modules['API'] = api\n"
+        "import Clickhouse_setup\n"
+        "app = {'Market_data', 'Analytics_engine', 'Query_layer', 'AI_chatbot', 'GenAi', 'nicegui'}\n"
+        "print(sorted(app & set(sys.modules)))\n"
+    )
+    result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True)
+
+    assert result.stdout.strip() == "[]"
@@ -0,0 +1,74 @@
+import re
+
+from Telemetry import count, prometheus_text, record, register_stats, request_id_var, request_scope, set_gauge
+
+SAMPLE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{([a-zA-Z_][a-zA-Z0-9_]*="([^"\\]|\\.)*",?)*\})? \S+$')
+
+
+def samples(text, metric):
+    return {line.split(" ")[0]: line.split(" ")[1] for line in text.splitlines() if line.startswith(metric)}
+
+
+def test_values_keep_full_precision():
+    set_gauge("test_last_success_timestamp_seconds", 1718035212.456789)
+    count("test_rows_inserted", 123456789)
+    count("test_rows_inserted", 1)
+    set_gauge("test_ratio", 0.1 + 0.2)
+    set_gauge("test_whole_float", 3.0)
+    text = prometheus_text()
+
+    assert samples(text, "mrcrypto_test_last_success")["mrcrypto_test_last_success_timestamp_seconds"] == "1718035212.456789"
+    assert samples(text, "mrcrypto_test_rows_inserted")["mrcrypto_test_rows_inserted_total"] == "123456790"
+    assert float(samples(text, "mrcrypto_test_ratio")["mrcrypto_test_ratio"]) == 0.1 + 0.2
+    assert samples(text, "mrcrypto_test_whole_float")["mrcrypto_test_whole_float"] == "3"
+
+
+def test_non_finite_values_use_prometheus_spelling():
+    set_gauge("test_nan", float("nan"))
+    set_gauge("test_inf", float("inf"))
+    text = prometheus_text()
+    assert "mrcrypto_test_nan NaN" in text.splitlines()
+    assert "mrcrypto_test_inf +Inf" in text.splitlines()
+
+
+def test_every_line_is_valid_exposition_format():
+    count("test_cycles", status="ok")
+    count("test_cycles", status='we"ird\\')
+    record("test.span", 42.0)
+    register_stats("test_stats", lambda: {"a": {"hits": 2, "hit_rate": 0.25, "note": "skipped"}}, label="site")
+    text = prometheus_text()
+
+    assert text.endswith("\n")
+    families = []
+    for line in text.splitlines():
+        if line.startswith("# TYPE"):
+            families.append(line.split()[2])
+        elif not line.startswith("#"):
+            assert SAMPLE.match(line), line
+    # One TYPE line per family
+    assert len(families) == len(set(families))
+    assert 'mrcrypto_test_cycles_total{status="we\\"ird\\\\"} 1' in text
+    assert 'mrcrypto_test_stats_hit_rate{site="a"} 0.25' in text
+    assert "mrcrypto_test_stats_note" not in text
+
+
+def test_histogram_buckets_are_cumulative():
+    for ms in (3, 7, 7, 20000):
+        record("test.hist", ms)
+    lines = [line for line in prometheus_text().splitlines() if 'span="test.hist"' in line]
+    buckets = [(re.search(r'le="([^"]+)"', line).group(1), int(line.split()[-1]))
+               for line in lines if "_bucket" in line]
+    counts = [value for _, value in buckets]
+    assert counts == sorted(counts)
+    assert dict(buckets)["0.005"] == 1 and dict(buckets)["0.01"] == 3
+    assert buckets[-1] == ("+Inf", 4)
+    assert any(line.endswith(" 4") and "_count" in line for line in lines)
+
+
+def test_request_scope_resets_the_request_id():
+    with request_scope() as outer:
+        assert request_id_var.get() == outer
+        with request_scope() as inner:
+            assert request_id_var.get() == inner != outer
+        assert request_id_var.get() == outer
+    assert request_id_var.get() is None